@@ -0,0 +1,44 @@
+# bench_async_download.py
+# wall time of the asyncio downloader against a local server with injected
+# per request latency, for a range of concurrency limits, e.g.
+#   python bench_async_download.py --images 64 --latency 0.05
+import argparse
+import asyncio
+import tempfile
+import time
+
+from thumbnail_aio import AsyncDownloader
+from thumbnail_samples import make_sample_bytes
+from thumbnail_testserver import LocalImageServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--size', type=int, default=1024,
+                        help="width of the generated images")
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    body = make_sample_bytes(args.size, args.size * 3 // 4)
+    images = {'/img{}.jpg'.format(i): body for i in range(args.images)}
+
+    print("{} images of {} KiB, {:.0f} ms latency per request".format(
+        args.images, len(body) // 1024, 1000 * args.latency))
+    print("{:>11} {:>10} {:>10}".format('concurrency', 'wall s', 'images/s'))
+    with LocalImageServer(images, latency=args.latency) as server:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as input_dir:
+                downloader = AsyncDownloader(input_dir, concurrency=concurrency)
+                start = time.perf_counter()
+                asyncio.run(downloader.download_images(
+                    server.urls(), lambda img_filename, size: None))
+                wall = time.perf_counter() - start
+            print("{:>11} {:>10.2f} {:>10.1f}".format(
+                concurrency, wall, args.images / wall))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_draft_decode.py
+# compares decode time, total resize time and peak RSS of full resolution
+# decoding against JPEG draft (DCT scaled) decoding, e.g.
+#   python bench_draft_decode.py --width 6000 --height 4000 --images 5
+# every mode runs in a fresh process so the peak RSS numbers don't mix
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from PIL import Image
+
+from bench_resize_pyramid import pixel_difference
+from thumbnail_resize import (TARGET_SIZES, RESIZE_DIRECT, draft_for_targets,
+                              resize_to_targets)
+from thumbnail_samples import make_sample_image
+
+
+def run_mode(paths, draft, results):
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    decode = resize = 0.0
+    thumbnails = []
+    for path in paths:
+        start = time.perf_counter()
+        with Image.open(path) as orig_img:
+            orig_size = orig_img.size
+            if draft:
+                draft_for_targets(orig_img, TARGET_SIZES)
+            orig_img.load()
+            decoded = time.perf_counter()
+            thumbnails.append([img.tobytes() for _, img in resize_to_targets(
+                orig_img, TARGET_SIZES, RESIZE_DIRECT, orig_size=orig_size)])
+        decode += decoded - start
+        resize += time.perf_counter() - decoded
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on linux
+    results.put((decode, resize, (peak_rss - baseline_rss) / 1024.0, thumbnails))
+
+
+def measure(paths, draft):
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_mode, args=(paths, draft, results))
+    p.start()
+    result = results.get()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--images', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for seed in range(args.images):
+            path = os.path.join(tmp_dir, 'sample{}.jpg'.format(seed))
+            make_sample_image(args.width, args.height, seed).save(path, quality=90)
+            paths.append(path)
+
+        full = measure(paths, draft=False)
+        drafted = measure(paths, draft=True)
+
+    print("{}x{} JPEG source, {} images".format(
+        args.width, args.height, args.images))
+    print("{:<6} {:>14} {:>14} {:>14}".format(
+        'mode', 'decode ms/img', 'resize ms/img', 'peak RSS MiB'))
+    for name, (decode, resize, rss, _) in (('full', full), ('draft', drafted)):
+        print("{:<6} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+            name, 1000 * decode / args.images, 1000 * resize / args.images, rss))
+
+    print("draft vs full pixel difference (0-255):")
+    for i, basewidth in enumerate(TARGET_SIZES):
+        diffs = []
+        for full_imgs, draft_imgs in zip(full[3], drafted[3]):
+            size = (basewidth, len(full_imgs[i]) // (3 * basewidth))
+            diffs.append(pixel_difference(
+                Image.frombytes('RGB', size, full_imgs[i]),
+                Image.frombytes('RGB', size, draft_imgs[i])))
+        print("  {:>4}px  mean {:.2f}  max {}".format(
+            basewidth, sum(m for m, _ in diffs) / len(diffs),
+            max(p for _, p in diffs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# bench_encode_profiles.py
+# reports encode time against output bytes of every encoder profile, per
+# target size, e.g.
+#   python bench_encode_profiles.py --width 4000 --height 3000 --images 5
+# resizing happens once up front, only the encoding is timed
+import argparse
+import io
+import time
+
+from thumbnail_encode import PROFILES, profiles_for_targets
+from thumbnail_resize import TARGET_SIZES, resize_to_targets
+from thumbnail_samples import make_sample_image
+
+
+def measure(thumbnails, profile_name, repeat):
+    # thumbnails is one list of (basewidth, img) per source image. returns
+    # basewidth -> (seconds per encode, bytes per thumbnail)
+    profiles = profiles_for_targets(profile_name, TARGET_SIZES)
+    results = {}
+    for i, basewidth in enumerate(TARGET_SIZES):
+        profile = profiles[i]
+        seconds = size = 0
+        for resized in thumbnails:
+            img = resized[i][1]
+            # the first call pays for loading the codec
+            profile.encode(img, io.BytesIO(), 'JPEG')
+            start = time.perf_counter()
+            for _ in range(repeat):
+                buf = io.BytesIO()
+                profile.encode(img, buf, 'JPEG')
+            seconds += (time.perf_counter() - start) / repeat
+            size += buf.tell()
+        results[basewidth] = (seconds / len(thumbnails),
+                              size / float(len(thumbnails)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--images', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="encodes per thumbnail, the mean is reported")
+    parser.add_argument('--profiles', nargs='+', default=sorted(PROFILES),
+                        choices=sorted(PROFILES))
+    args = parser.parse_args()
+
+    thumbnails = [resize_to_targets(make_sample_image(args.width, args.height,
+                                                      seed), TARGET_SIZES)
+                  for seed in range(args.images)]
+
+    print("{}x{} JPEG source, {} images, sizes {}".format(
+        args.width, args.height, args.images, TARGET_SIZES))
+    print("{:<18} {:>6} {:>10} {:>10} {:>9}".format(
+        'profile', 'size', 'encode ms', 'bytes', 'vs default'))
+    baseline = measure(thumbnails, 'default', args.repeat)
+    for name in args.profiles:
+        results = baseline if name == 'default' else \
+            measure(thumbnails, name, args.repeat)
+        for basewidth in TARGET_SIZES:
+            seconds, size = results[basewidth]
+            print("{:<18} {:>6} {:>10.2f} {:>10.0f} {:>8.0f}%".format(
+                name, basewidth, 1000 * seconds, size,
+                100 * size / baseline[basewidth][1]))
+        print("{:<18} {:>6} {:>10.2f} {:>10.0f} {:>8.0f}%".format(
+            name, 'total', 1000 * sum(s for s, _ in results.values()),
+            sum(b for _, b in results.values()),
+            100 * sum(b for _, b in results.values()) /
+            sum(b for _, b in baseline.values())))
+
+
+if __name__ == '__main__':
+    main()
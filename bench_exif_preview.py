@@ -0,0 +1,67 @@
+# bench_exif_preview.py
+# batch time and bytes transferred for camera JPEGs with and without the
+# EXIF thumbnail fast path, against a bandwidth capped local server, e.g.
+#   python bench_exif_preview.py --images 16 --width 3000 --height 2000 \
+#       --bandwidth 4000000
+# the last row asks for a target wider than the embedded thumbnails, so every
+# image needs the range request and the full download
+import argparse
+import tempfile
+import time
+
+from thumbnail_resize import TARGET_SIZES
+from thumbnail_samples import make_camera_bytes
+from thumbnail_service import BACKENDS, BACKEND_THREAD, ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+SMALL_TARGETS = [32, 64]
+
+
+def run_config(args, images, target_sizes, exif_preview):
+    with LocalImageServer(images, latency=args.latency,
+                          bandwidth=args.bandwidth) as server, \
+            tempfile.TemporaryDirectory() as home_dir:
+        service = ThumbnailMakerService(home_dir, backend=args.backend,
+                                        num_dl_threads=args.dl_threads,
+                                        target_sizes=target_sizes,
+                                        exif_preview=exif_preview)
+        start = time.perf_counter()
+        service.make_thumbnails(server.urls())
+        elapsed = time.perf_counter() - start
+    return elapsed, server.bytes_sent, len(server.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default=BACKEND_THREAD, choices=BACKENDS)
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--bandwidth', type=int, default=4000000,
+                        help="bytes per second per response, 0 for no cap")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="seconds of server latency per request")
+    parser.add_argument('--dl-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    images = {'/img{}.jpg'.format(i): make_camera_bytes(args.width,
+                                                        args.height, seed=i)
+              for i in range(args.images)}
+    total = sum(len(body) for body in images.values())
+    print("{} camera JPEGs of {}x{}, {:.1f} MiB, {} bytes/s per response"
+          .format(args.images, args.width, args.height,
+                  total / 1024.0 / 1024.0, args.bandwidth))
+    print("{:<22} {:>9} {:>9} {:>9}".format('mode', 'batch s', 'MiB in',
+                                             'requests'))
+    configs = [('full, 32+64', SMALL_TARGETS, False),
+               ('preview, 32+64', SMALL_TARGETS, True),
+               ('preview, 32+64+200', TARGET_SIZES, True)]
+    for name, target_sizes, exif_preview in configs:
+        elapsed, sent, requests = run_config(args, images, target_sizes,
+                                             exif_preview)
+        print("{:<22} {:>9.3f} {:>9.2f} {:>9}".format(
+            name, elapsed, sent / 1024.0 / 1024.0, requests))
+
+
+if __name__ == '__main__':
+    main()
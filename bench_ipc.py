@@ -0,0 +1,73 @@
+# bench_ipc.py
+# throughput of the resize processes for a big batch of tiny images when
+# every image is its own message (the old per-item JoinableQueue.put) against
+# fixed and self-tuned chunks, e.g.
+#   python bench_ipc.py --images 10000 --chunksizes 1 8 64 auto
+# images are tiny so the numbers are mostly pickling and pipe round trips.
+# every pool runs a few batches and the best one counts, auto only knows
+# the per-image cost once the first chunks came back
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from thumbnail_pool import ResizeWorkerPool
+from thumbnail_resize import ThumbnailResizer
+from thumbnail_samples import make_sample_image
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=10000)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--chunksizes', nargs='+', default=['1', '16', 'auto'],
+                        help="chunk sizes to compare, auto tunes itself")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample = os.path.join(tmp_dir, 'sample.jpg')
+        make_sample_image(8, 6).save(sample)
+        input_dir = os.path.join(tmp_dir, 'incoming')
+        output_dir = os.path.join(tmp_dir, 'outgoing')
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+        # a single tiny target keeps the per-image work small
+        resizer = ThumbnailResizer(output_dir, target_sizes=[4])
+
+        print("{} images of 8x6, {} resize processes".format(
+            args.images, args.processes))
+        print("{:>9} {:>8} {:>10} {:>9} {:>11}".format(
+            'chunksize', 'wall s', 'images/s', 'messages', 'final chunk'))
+        for chunksize in args.chunksizes:
+            fixed = None if chunksize == 'auto' else int(chunksize)
+            best = None
+            with ResizeWorkerPool(resizer, args.processes,
+                                  chunksize=fixed) as pool:
+                for _ in range(args.rounds):
+                    # fresh inputs for every round, resizing removes them
+                    paths = []
+                    for i in range(args.images):
+                        path = os.path.join(input_dir, 'img{}.jpg'.format(i))
+                        shutil.copyfile(sample, path)
+                        paths.append(path)
+                    messages = pool.messages
+                    start = time.perf_counter()
+                    batch = pool.batch()
+                    for path in paths:
+                        batch.submit(path)
+                    batch.close()
+                    batch.wait()
+                    wall = time.perf_counter() - start
+                    if best is None or wall < best[0]:
+                        best = (wall, pool.messages - messages)
+            print("{:>9} {:>8.2f} {:>10.0f} {:>9} {:>11}".format(
+                chunksize, best[0], args.images / best[0], best[1],
+                pool.chunksize))
+
+
+if __name__ == '__main__':
+    main()
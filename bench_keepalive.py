@@ -0,0 +1,62 @@
+# bench_keepalive.py
+# batch times of the threaded downloaders with a connection per request and
+# with keep-alive connections per host, against a local server that holds
+# every new connection for a handshake like a far away origin would, e.g.
+#   python bench_keepalive.py --batches 5 --images 32 --handshake 0.05
+# reports the connections the server accepted along with the timings
+import argparse
+import tempfile
+import time
+
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import BACKEND_THREAD, ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+
+def run_config(args, images, keepalive):
+    times = []
+    with LocalImageServer(images, latency=args.latency,
+                          handshake=args.handshake) as server, \
+            tempfile.TemporaryDirectory() as home_dir:
+        with ThumbnailMakerService(home_dir, backend=BACKEND_THREAD,
+                                   persistent=True,
+                                   num_dl_threads=args.dl_threads,
+                                   limit_per_host=args.max_per_host,
+                                   keepalive=keepalive) as service:
+            for i in range(args.batches):
+                # fresh urls every batch so nothing is answered from cache
+                urls = [url + '?batch={}'.format(i) for url in server.urls()]
+                start = time.perf_counter()
+                service.submit(urls).wait()
+                times.append(time.perf_counter() - start)
+        return times, server.connections, len(server.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--handshake', type=float, default=0.05,
+                        help="seconds every new connection is held")
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help="seconds of server latency per request")
+    parser.add_argument('--dl-threads', type=int, default=4)
+    parser.add_argument('--max-per-host', type=int, default=0,
+                        help="connections per host, 0 for no limit")
+    args = parser.parse_args()
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(args.images)}
+    print("{} batches of {} images, {} s handshake, {} download threads"
+          .format(args.batches, args.images, args.handshake, args.dl_threads))
+    print("{:<11} {:>12} {:>12} {:>12} {:>9}".format(
+        'mode', 'first s', 'later s', 'connections', 'requests'))
+    for name, keepalive in (('per request', False), ('keep-alive', True)):
+        times, connections, requests = run_config(args, images, keepalive)
+        later = times[1:] or times
+        print("{:<11} {:>12.3f} {:>12.3f} {:>12} {:>9}".format(
+            name, times[0], sum(later) / len(later), connections, requests))
+
+
+if __name__ == '__main__':
+    main()
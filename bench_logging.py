@@ -0,0 +1,93 @@
+# bench_logging.py
+# per-image overhead of logging: the same batch of tiny images through the
+# resize processes with logging off, writing straight to logfile.log from
+# every process, and queued to a single listener, e.g.
+#   python bench_logging.py --images 2000 --processes 4
+# each mode runs in a fresh child process, the logging setup is global
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = [('off', {'THUMBNAIL_LOG_LEVEL': 'WARNING'}),
+         ('file', {'THUMBNAIL_LOG_LEVEL': 'DEBUG'}),
+         ('queued', {'THUMBNAIL_LOG_LEVEL': 'DEBUG',
+                     'THUMBNAIL_LOG_QUEUE': '1'})]
+
+
+def run_child(images, processes):
+    # imported here so the environment of the child picks the mode
+    from thumbnail_logging import configure_logging, stop_logging
+    from thumbnail_pool import ResizeWorkerPool
+    from thumbnail_resize import ThumbnailResizer
+    from thumbnail_samples import make_sample_image
+
+    configure_logging()
+    input_dir = os.path.join(os.getcwd(), 'incoming')
+    output_dir = os.path.join(os.getcwd(), 'outgoing')
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    paths = []
+    sample = make_sample_image(16, 12)
+    for i in range(images):
+        path = os.path.join(input_dir, 'img{}.jpg'.format(i))
+        sample.save(path)
+        paths.append(path)
+
+    with ResizeWorkerPool(ThumbnailResizer(output_dir), processes) as pool:
+        start = time.perf_counter()
+        batch = pool.batch()
+        for path in paths:
+            batch.submit(path)
+        batch.close()
+        batch.wait()
+        wall = time.perf_counter() - start
+    # the queued mode only has everything on disk once the listener drained
+    stop_logging()
+    with open('logfile.log') as f:
+        lines = sum(1 for _ in f)
+    return {'wall_s': wall, 'log_lines': lines}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=2000)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.images, args.processes)))
+        return
+
+    print("{} images of 16x12, {} resize processes".format(
+        args.images, args.processes))
+    print("{:<8} {:>10} {:>12} {:>10}".format(
+        'logging', 'wall s', 'us/image', 'log lines'))
+    baseline = None
+    for name, env in MODES:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child',
+                 '--images', str(args.images),
+                 '--processes', str(args.processes)],
+                cwd=tmp_dir, capture_output=True, text=True, check=True,
+                env=dict(os.environ, PYTHONPATH=os.path.dirname(
+                    os.path.abspath(__file__)), **env))
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        per_image = 1e6 * result['wall_s'] / args.images
+        if baseline is None:
+            baseline = per_image
+        print("{:<8} {:>10.2f} {:>12.1f} {:>10}  ({:+.1f} us/image)".format(
+            name, result['wall_s'], per_image, result['log_lines'],
+            per_image - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# bench_mmap_input.py
+# compares decode throughput and peak RSS of decoding input files through a
+# buffered file object against decoding them out of an mmap, e.g.
+#   python bench_mmap_input.py --width 6000 --height 4000 --images 5
+# the files are read once up front so both modes decode from a warm page
+# cache, every mode runs in a fresh process so the peak RSS numbers don't mix
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from PIL import Image
+
+from thumbnail_resize import TARGET_SIZES, draft_for_targets
+from thumbnail_samples import make_sample_image
+from thumbnail_shm import MappedFile
+
+
+def decode(source, draft):
+    with Image.open(source) as img:
+        if draft:
+            draft_for_targets(img, TARGET_SIZES)
+        img.load()
+
+
+def run_mode(paths, use_mmap, draft, repeat, results):
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        for path in paths:
+            if use_mmap:
+                with MappedFile(path) as source:
+                    decode(source, draft)
+            else:
+                decode(path, draft)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on linux
+    results.put((wall, cpu, (peak_rss - baseline_rss) / 1024.0))
+
+
+def measure(paths, use_mmap, draft, repeat):
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_mode,
+                                args=(paths, use_mmap, draft, repeat, results))
+    p.start()
+    result = results.get()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--images', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="times every image is decoded per mode")
+    parser.add_argument('--draft', action='store_true',
+                        help="decode JPEGs at reduced scale like draft=True")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        total_bytes = 0
+        for seed in range(args.images):
+            path = os.path.join(tmp_dir, 'sample{}.jpg'.format(seed))
+            make_sample_image(args.width, args.height, seed).save(path,
+                                                                  quality=90)
+            with open(path, 'rb') as f:
+                # warm the page cache
+                total_bytes += len(f.read())
+            paths.append(path)
+
+        results = [(name, measure(paths, use_mmap, args.draft, args.repeat))
+                   for name, use_mmap in (('buffered', False),
+                                          ('mmap', True))]
+
+    decoded = args.images * args.repeat
+    print("{}x{} JPEG source, {} images, {:.1f} MiB, {} decodes per mode{}"
+          .format(args.width, args.height, args.images,
+                  total_bytes / 1024.0 / 1024.0, decoded,
+                  ', draft' if args.draft else ''))
+    print("{:<9} {:>10} {:>12} {:>10} {:>14}".format(
+        'mode', 'images/s', 'input MiB/s', 'cpu ms/img', 'peak RSS MiB'))
+    for name, (wall, cpu, rss) in results:
+        print("{:<9} {:>10.1f} {:>12.1f} {:>10.1f} {:>14.1f}".format(
+            name, decoded / wall,
+            total_bytes * args.repeat / wall / 1024.0 / 1024.0,
+            1000 * cpu / decoded, rss))
+
+
+if __name__ == '__main__':
+    main()
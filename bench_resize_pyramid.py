@@ -0,0 +1,60 @@
+# bench_resize_pyramid.py
+# compares CPU time per image and pixel difference of the direct and the
+# pyramid resize modes, e.g.
+#   python bench_resize_pyramid.py --width 6000 --height 4000 --images 5
+import argparse
+import time
+
+from PIL import ImageChops, ImageStat
+
+from thumbnail_resize import (TARGET_SIZES, RESIZE_DIRECT, RESIZE_PYRAMID,
+                              resize_to_targets)
+from thumbnail_samples import make_sample_image
+
+
+def pixel_difference(img_a, img_b):
+    # mean and max absolute difference over all channels, in 0..255
+    diff = ImageChops.difference(img_a.convert('RGB'), img_b.convert('RGB'))
+    stat = ImageStat.Stat(diff)
+    mean = sum(stat.mean) / len(stat.mean)
+    peak = max(hi for lo, hi in stat.extrema)
+    return mean, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--images', type=int, default=3)
+    args = parser.parse_args()
+
+    cpu = {RESIZE_DIRECT: 0.0, RESIZE_PYRAMID: 0.0}
+    diffs = {basewidth: [] for basewidth in TARGET_SIZES}
+
+    for seed in range(args.images):
+        orig_img = make_sample_image(args.width, args.height, seed)
+        outputs = {}
+        for mode in (RESIZE_DIRECT, RESIZE_PYRAMID):
+            start = time.process_time()
+            outputs[mode] = dict(resize_to_targets(orig_img, TARGET_SIZES, mode))
+            cpu[mode] += time.process_time() - start
+        for basewidth in TARGET_SIZES:
+            diffs[basewidth].append(pixel_difference(
+                outputs[RESIZE_DIRECT][basewidth],
+                outputs[RESIZE_PYRAMID][basewidth]))
+
+    print("{}x{} source, {} images".format(args.width, args.height, args.images))
+    for mode in (RESIZE_DIRECT, RESIZE_PYRAMID):
+        print("{:<8} cpu per image: {:8.1f} ms".format(
+            mode, 1000 * cpu[mode] / args.images))
+    print("speedup: {:.2f}x".format(cpu[RESIZE_DIRECT] / cpu[RESIZE_PYRAMID]))
+    print("pyramid vs direct pixel difference (0-255):")
+    for basewidth in TARGET_SIZES:
+        means = [mean for mean, _ in diffs[basewidth]]
+        peaks = [peak for _, peak in diffs[basewidth]]
+        print("  {:>4}px  mean {:.2f}  max {}".format(
+            basewidth, sum(means) / len(means), max(peaks)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# bench_services.py
+# runs every ThumbnailMakerService backend against a local server serving
+# generated images and reports wall time, images/s, time to the first
+# thumbnail, percentiles of the per-image latency from the start of its
+# download to its thumbnails, cpu time and peak rss, as a table and as
+# json, e.g.
+#   python bench_services.py --images 32 --sizes 1920x1080 640x480 \
+#       --formats jpeg png --latency 0.05 --bandwidth 2000000 --json out.json
+# each backend runs in a fresh child process, so cpu time and peak rss are
+# its own and not the accumulation of the backends that ran before
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import BACKENDS, ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+
+def percentile(values, pct):
+    # nearest rank, good enough for a few hundred samples
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1,
+                      int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def image_latencies(batch):
+    # seconds from the first request for each image to its result. the
+    # batch's own latencies count from its creation, so they mostly tell
+    # how far back in the queue an image was
+    latencies = []
+    for result in batch.stream:
+        started = batch.download_started.get(result.filename)
+        if started is not None:
+            latencies.append(batch.created + result.latency - started)
+    return latencies
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def make_images(count, sizes, formats):
+    # cycles through every size and format combination
+    combos = [(size, fmt) for size in sizes for fmt in formats]
+    images = {}
+    for i in range(count):
+        (width, height), fmt = combos[i % len(combos)]
+        ext = 'jpg' if fmt == 'jpeg' else fmt
+        images['/img{}.{}'.format(i, ext)] = make_sample_bytes(
+            width, height, fmt=fmt.upper(), seed=i)
+    return images
+
+
+def run_backend(config):
+    # child side: one make_thumbnails worth of work, measured from the
+    # inside. start() is timed too, starting workers is part of the cost
+    with tempfile.TemporaryDirectory() as home_dir:
+        service = ThumbnailMakerService(home_dir, backend=config['backend'],
+                                        **config['options'])
+        start = time.perf_counter()
+        service.start()
+        try:
+            batch = service.submit(config['urls'])
+            batch.wait()
+        finally:
+            service.close()
+        wall = time.perf_counter() - start
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    latencies = image_latencies(batch)
+    # ru_maxrss is in KiB on linux
+    return {
+        'backend': config['backend'],
+        'images': len(batch.results),
+        'errors': len(batch.errors) + batch.stats['download_errors'],
+        'wall_s': wall,
+        'images_per_s': len(batch.results) / wall if wall else 0.0,
+        'first_ms': 1000 * batch.stream[0].latency if batch.stream else 0.0,
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p95_ms': 1000 * percentile(latencies, 95),
+        'p99_ms': 1000 * percentile(latencies, 99),
+        'cpu_s': own.ru_utime + own.ru_stime +
+        children.ru_utime + children.ru_stime,
+        'peak_rss_mib': own.ru_maxrss / 1024.0,
+        'peak_child_rss_mib': children.ru_maxrss / 1024.0,
+        'stats': batch.stats,
+        'metrics': service.metrics.snapshot(),
+    }
+
+
+def spawn_backend(config):
+    # parent side, the config goes in on stdin and the result comes back
+    # as the last line of stdout
+    proc = subprocess.run([sys.executable, __file__, '--child'],
+                          input=json.dumps(config), capture_output=True,
+                          text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_table(results):
+    columns = [('backend', '{:<14}', '{:<14}'),
+               ('wall_s', '{:>8}', '{:>8.2f}'),
+               ('images_per_s', '{:>9}', '{:>9.1f}'),
+               ('first_ms', '{:>8}', '{:>8.0f}'),
+               ('p50_ms', '{:>8}', '{:>8.0f}'),
+               ('p95_ms', '{:>8}', '{:>8.0f}'),
+               ('p99_ms', '{:>8}', '{:>8.0f}'),
+               ('cpu_s', '{:>7}', '{:>7.2f}'),
+               ('peak_rss_mib', '{:>9}', '{:>9.1f}'),
+               ('peak_child_rss_mib', '{:>9}', '{:>9.1f}'),
+               ('errors', '{:>6}', '{:>6}')]
+    headers = ['backend', 'wall s', 'images/s', 'first ms', 'p50 ms',
+               'p95 ms', 'p99 ms', 'cpu s', 'rss MiB', 'child MiB', 'errors']
+    print(' '.join(fmt.format(header) for (_, fmt, _), header
+                   in zip(columns, headers)))
+    for result in results:
+        print(' '.join(fmt.format(result[key]) for key, _, fmt in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS),
+                        choices=BACKENDS)
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--sizes', type=parse_size, nargs='+',
+                        default=[(1920, 1080)], help="WIDTHxHEIGHT")
+    parser.add_argument('--formats', nargs='+', default=['jpeg'],
+                        choices=['jpeg', 'png'])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds of server latency per request")
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help="bytes per second per response, 0 for no cap")
+    parser.add_argument('--resizers', type=int, default=None,
+                        help="resize threads or processes per backend")
+    parser.add_argument('--dl-threads', type=int, default=4)
+    parser.add_argument('--json', default=None,
+                        help="also write the results to this file")
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(json.load(sys.stdin))))
+        return
+
+    images = make_images(args.images, args.sizes, args.formats)
+    total_bytes = sum(len(body) for body in images.values())
+    print("{} images, {:.1f} MiB, {:.0f} ms latency, {} bandwidth".format(
+        args.images, total_bytes / 1024.0 / 1024.0, 1000 * args.latency,
+        '{} B/s'.format(args.bandwidth) if args.bandwidth else 'unlimited'))
+
+    results = []
+    with LocalImageServer(images, latency=args.latency,
+                          bandwidth=args.bandwidth) as server:
+        for backend in args.backends:
+            options = {'num_dl_threads': args.dl_threads}
+            if args.resizers is not None:
+                options['num_resizers'] = args.resizers
+            results.append(spawn_backend({'backend': backend,
+                                          'urls': server.urls(),
+                                          'options': options}))
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': {'images': args.images,
+                                  'sizes': args.sizes,
+                                  'formats': args.formats,
+                                  'latency': args.latency,
+                                  'bandwidth': args.bandwidth,
+                                  'total_bytes': total_bytes},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
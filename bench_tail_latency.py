@@ -0,0 +1,97 @@
+# bench_tail_latency.py
+# batch times against an origin that stalls or resets a share of requests,
+# without retries, with timeouts and retries, and with hedged requests on
+# top, e.g.
+#   python bench_tail_latency.py --batches 30 --images 16 --stall-rate 0.05 \
+#       --stall 2 --reset-rate 0.02 --read-timeout 1
+# reports p50, p95 and p99 of the batch times and the failed downloads
+import argparse
+import random
+import tempfile
+import threading
+import time
+
+from bench_services import percentile
+from thumbnail_http import NO_RETRY, RetryPolicy
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import BACKENDS, BACKEND_THREAD, ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+
+def random_faults(stall_rate, reset_rate, seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def fault(path):
+        with lock:
+            roll = rng.random()
+        if roll < stall_rate:
+            return 'stall'
+        if roll < stall_rate + reset_rate:
+            return 'reset'
+        return None
+    return fault
+
+
+def run_config(args, images, retry, hedge):
+    fault = random_faults(args.stall_rate, args.reset_rate, args.seed)
+    times = []
+    errors = 0
+    with LocalImageServer(images, latency=args.latency, fault=fault,
+                          stall=args.stall) as server, \
+            tempfile.TemporaryDirectory() as home_dir:
+        with ThumbnailMakerService(home_dir, backend=args.backend,
+                                   persistent=True,
+                                   num_dl_threads=args.dl_threads,
+                                   timeouts=(args.connect_timeout,
+                                             args.read_timeout),
+                                   retry=retry, hedge=hedge) as service:
+            for i in range(args.batches):
+                # fresh urls every batch so nothing is answered from cache
+                urls = [url + '?batch={}'.format(i) for url in server.urls()]
+                start = time.perf_counter()
+                batch = service.submit(urls)
+                batch.wait()
+                times.append(time.perf_counter() - start)
+                errors += batch.stats['download_errors']
+    return times, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default=BACKEND_THREAD, choices=BACKENDS)
+    parser.add_argument('--batches', type=int, default=30)
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help="seconds of server latency per request")
+    parser.add_argument('--stall-rate', type=float, default=0.05)
+    parser.add_argument('--stall', type=float, default=2.0,
+                        help="seconds a stalled request hangs")
+    parser.add_argument('--reset-rate', type=float, default=0.02)
+    parser.add_argument('--connect-timeout', type=float, default=1.0)
+    parser.add_argument('--read-timeout', type=float, default=1.0)
+    parser.add_argument('--dl-threads', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(args.images)}
+    configs = [('no retry', NO_RETRY, False),
+               ('retry', RetryPolicy(), False),
+               ('retry+hedge', RetryPolicy(), True)]
+
+    print("{} batches of {} images, {:.0%} stalls of {} s, {:.0%} resets, "
+          "{} s read timeout".format(args.batches, args.images,
+                                     args.stall_rate, args.stall,
+                                     args.reset_rate, args.read_timeout))
+    print("{:<12} {:>8} {:>8} {:>8} {:>8}".format(
+        'config', 'p50 s', 'p95 s', 'p99 s', 'errors'))
+    for name, retry, hedge in configs:
+        times, errors = run_config(args, images, retry, hedge)
+        print("{:<12} {:>8.3f} {:>8.3f} {:>8.3f} {:>8}".format(
+            name, percentile(times, 50), percentile(times, 95),
+            percentile(times, 99), errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# bench_worker_pool.py
+# per-batch overhead of starting resize processes for every batch (what the
+# multiprocess and queue variants do) against the persistent worker pool.
+# batches are small and images tiny, so the numbers are mostly overhead, e.g.
+#   python bench_worker_pool.py --batches 30 --start-method spawn
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from thumbnail_pool import ResizeWorkerPool, resize_item
+from thumbnail_resize import ThumbnailResizer
+from thumbnail_samples import make_sample_image
+
+
+def resize_path(args):
+    resizer, path = args
+    return resize_item(resizer, path)
+
+
+def queue_worker(resizer, img_queue):
+    while True:
+        path = img_queue.get()
+        if path is None:
+            img_queue.task_done()
+            break
+        resize_item(resizer, path)
+        img_queue.task_done()
+
+
+def pool_per_batch(resizer, paths, num_processes):
+    # thumnbnail_multiprocess: a new multiprocessing.Pool for every call
+    pool = multiprocessing.Pool(num_processes)
+    pool.map(resize_path, [(resizer, path) for path in paths])
+    pool.close()
+    pool.join()
+
+
+def processes_per_batch(resizer, paths, num_processes):
+    # queue variants: fresh Process objects for every call
+    img_queue = multiprocessing.JoinableQueue()
+    workers = [multiprocessing.Process(target=queue_worker,
+                                       args=(resizer, img_queue))
+               for _ in range(num_processes)]
+    for p in workers:
+        p.start()
+    for path in paths:
+        img_queue.put(path)
+    for _ in workers:
+        img_queue.put(None)
+    for p in workers:
+        p.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--start-method', default=None,
+                        choices=multiprocessing.get_all_start_methods())
+    args = parser.parse_args()
+    if args.start_method:
+        multiprocessing.set_start_method(args.start_method)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample = os.path.join(tmp_dir, 'sample.jpg')
+        make_sample_image(64, 48).save(sample)
+        input_dir = os.path.join(tmp_dir, 'incoming')
+        output_dir = os.path.join(tmp_dir, 'outgoing')
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+        resizer = ThumbnailResizer(output_dir)
+
+        def make_batch(n):
+            # fresh inputs for every batch, resizing removes them
+            paths = []
+            for i in range(args.batch_size):
+                path = os.path.join(input_dir, 'b{}_{}.jpg'.format(n, i))
+                shutil.copyfile(sample, path)
+                paths.append(path)
+            return paths
+
+        def run(name, process_batch):
+            total = 0.0
+            for n in range(args.batches):
+                paths = make_batch(n)
+                start = time.perf_counter()
+                process_batch(paths)
+                total += time.perf_counter() - start
+            print("{:<20} {:>10.1f}".format(
+                name, 1000 * total / args.batches))
+
+        print("{} batches of {} images, {} processes, start method {}".format(
+            args.batches, args.batch_size, args.processes,
+            multiprocessing.get_start_method()))
+        print("{:<20} {:>10}".format('mode', 'ms/batch'))
+        run('pool per batch',
+            lambda paths: pool_per_batch(resizer, paths, args.processes))
+        run('processes per batch',
+            lambda paths: processes_per_batch(resizer, paths, args.processes))
+
+        with ResizeWorkerPool(resizer, args.processes) as pool:
+            def persistent(paths):
+                batch = pool.batch()
+                for path in paths:
+                    batch.submit(path)
+                batch.close()
+                batch.wait()
+            run('persistent pool', persistent)
+
+
+if __name__ == '__main__':
+    main()
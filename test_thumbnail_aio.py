@@ -0,0 +1,44 @@
+import asyncio
+import os
+
+from thumbnail_aio import AsyncDownloader
+from thumbnail_http import RetryPolicy
+from thumbnail_samples import make_sample_bytes
+from thumbnail_testserver import LocalImageServer, scripted_faults
+
+IMAGES = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+          for i in range(12)}
+
+
+def test_downloads_concurrently_within_the_limit(tmp_path):
+    downloaded = []
+    with LocalImageServer(IMAGES, latency=0.1) as server:
+        downloader = AsyncDownloader(str(tmp_path), concurrency=4,
+                                     chunk_size=1024)
+        asyncio.run(downloader.download_images(
+            server.urls(), lambda *result: downloaded.append(result)))
+
+    assert server.peak_active == 4
+    assert sorted(downloaded) == sorted(
+        (path[1:], len(body)) for path, body in IMAGES.items())
+    for path, body in IMAGES.items():
+        with open(str(tmp_path) + os.path.sep + path[1:], 'rb') as f:
+            assert f.read() == body
+
+
+def test_failed_requests_are_retried(tmp_path):
+    downloaded, errors = [], []
+    fault = scripted_faults({'/img0.jpg': ['reset', 503, 'stall'],
+                             '/img1.jpg': [404]})
+    with LocalImageServer(IMAGES, fault=fault, stall=5) as server:
+        downloader = AsyncDownloader(
+            str(tmp_path), timeouts=(1, 0.2),
+            retry=RetryPolicy(attempts=4, backoff=0.01))
+        asyncio.run(downloader.download_images(
+            server.urls()[:2], lambda *result: downloaded.append(result),
+            on_error=lambda url, e: errors.append(url)))
+        paths = [path for path, _ in server.requests]
+
+    assert downloaded == [('img0.jpg', len(IMAGES['/img0.jpg']))]
+    assert errors == [server.url('/img1.jpg')]
+    assert paths.count('/img0.jpg') == 4 and paths.count('/img1.jpg') == 1
@@ -0,0 +1,91 @@
+import os
+import threading
+
+from thumbnail_autoscale import IDLE_TICKS, Sample, decide
+from thumbnail_pool import TaskThreadPool
+from thumbnail_samples import make_sample_bytes
+from thumbnail_testserver import LocalImageServer
+
+BOUNDS = ((1, 8), (1, 4))
+
+
+def test_network_bound_grows_downloads():
+    sample = Sample(dl_backlog=20, resize_backlog=0, dl_rate=5,
+                    resize_rate=5, cpu=0.2)
+    assert decide(sample, 2, 2, *BOUNDS, idle={}) == (3, 2)
+
+
+def test_cpu_bound_grows_resizers_while_cpus_are_idle():
+    sample = Sample(dl_backlog=0, resize_backlog=10, dl_rate=20,
+                    resize_rate=2, cpu=0.4)
+    assert decide(sample, 2, 1, *BOUNDS, idle={}) == (2, 2)
+
+
+def test_saturated_cpu_throttles_downloads():
+    sample = Sample(dl_backlog=20, resize_backlog=10, dl_rate=20,
+                    resize_rate=2, cpu=0.95)
+    assert decide(sample, 4, 2, *BOUNDS, idle={}) == (3, 2)
+
+
+def test_idle_stages_shrink_after_a_few_ticks_within_bounds():
+    sample = Sample(0, 0, 0, 0, cpu=0.0)
+    idle = {}
+    sizes = [decide(sample, 2, 2, *BOUNDS, idle=idle)
+             for _ in range(IDLE_TICKS)]
+    assert sizes[:-1] == [(2, 2)] * (IDLE_TICKS - 1)
+    assert sizes[-1] == (1, 1)
+    assert decide(sample, 1, 1, *BOUNDS, idle=idle) == (1, 1)
+
+
+def test_stage_stops_growing_when_throughput_does_not_rise():
+    idle = {}
+    slow = Sample(dl_backlog=20, resize_backlog=3, dl_rate=10,
+                  resize_rate=4, cpu=0.4)
+    assert decide(slow, 2, 1, *BOUNDS, idle=idle) == (3, 2)
+    # the extra thread and process didn't make either stage faster
+    assert decide(slow, 3, 2, *BOUNDS, idle=idle) == (3, 2)
+    assert decide(slow, 3, 2, *BOUNDS, idle=idle) == (3, 2)
+    # downloads got faster after all, resizes didn't
+    faster = Sample(dl_backlog=20, resize_backlog=3, dl_rate=15,
+                    resize_rate=4, cpu=0.4)
+    assert decide(faster, 3, 2, *BOUNDS, idle=idle) == (4, 2)
+    # after an idle tick a stage may grow again
+    assert decide(Sample(0, 3, 0, 4, cpu=0.4), 4, 2, *BOUNDS,
+                  idle=idle) == (4, 2)
+    assert decide(slow, 4, 2, *BOUNDS, idle=idle) == (5, 2)
+    assert decide(Sample(20, 0, 10, 0, cpu=0.4), 5, 2, *BOUNDS,
+                  idle=idle) == (5, 2)
+    assert decide(slow, 5, 2, *BOUNDS, idle=idle) == (5, 3)
+
+
+def test_task_pool_resizes_while_busy():
+    release = threading.Event()
+    with TaskThreadPool(1) as pool:
+        for _ in range(4):
+            pool.submit(release.wait)
+        pool.resize(4)
+        assert pool.num_threads == 4
+        pool.resize(2)
+        assert pool.num_threads == 2
+        assert pool.backlog() == 4
+        release.set()
+    assert pool.completed == 4
+
+
+def test_autoscaled_service_grows_downloads(tmp_path):
+    from thumnbnail_multipro_queue import ThumbnailMakerService
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(64, 48, seed=i)
+              for i in range(24)}
+    with LocalImageServer(images, latency=0.2) as server:
+        with ThumbnailMakerService(str(tmp_path), persistent=True,
+                                   num_processes=1, num_dl_threads=1,
+                                   autoscale=True, dl_bounds=(1, 8),
+                                   process_bounds=(1, 2)) as service:
+            service.autoscaler.interval = 0.1
+            batch = service.submit(server.urls())
+            assert len(batch.wait(30)) == 24
+        assert server.peak_active > 1
+        assert max(dl for _, _, dl, _ in service.autoscaler.decisions) > 1
+
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 72
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+
+import pytest
+
+from thumbnail_cache import ThumbnailCache
+from thumbnail_resize import ThumbnailResizer
+from thumbnail_samples import make_sample_bytes, make_sample_image
+from thumbnail_service import ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+
+def make_sources(tmp_path, count):
+    src_dir = tmp_path / 'incoming'
+    src_dir.mkdir()
+    paths = []
+    for i in range(count):
+        path = str(src_dir / 'img{}.jpg'.format(i))
+        make_sample_image(320, 240, seed=i).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_hit_skips_resize_and_copies_outputs(tmp_path):
+    src, = make_sources(tmp_path, 1)
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    first_dir, second_dir = tmp_path / 'first', tmp_path / 'second'
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    first = ThumbnailResizer(str(first_dir), cache=cache).resize_image(src)
+    second = ThumbnailResizer(str(second_dir), cache=cache).resize_image(src)
+
+    for a, b in zip(first, second):
+        with open(a, 'rb') as fa, open(b, 'rb') as fb:
+            assert fa.read() == fb.read()
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_resize_params_are_part_of_the_key(tmp_path):
+    src, = make_sources(tmp_path, 1)
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+
+    ThumbnailResizer(str(tmp_path), cache=cache).resize_image(src)
+    ThumbnailResizer(str(tmp_path), cache=cache,
+                     resize_mode='pyramid').resize_image(src)
+
+    assert cache.stats()['misses'] == 2
+
+
+def test_lru_eviction_keeps_the_budget(tmp_path):
+    paths = make_sources(tmp_path, 3)
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    resizer = ThumbnailResizer(str(tmp_path), cache=cache)
+    resizer.resize_image(paths[0])
+    resizer.resize_image(paths[1])
+    # room for exactly the first two entries
+    cache.max_bytes = cache.stats()['bytes']
+
+    resizer.resize_image(paths[0])  # touch, img1 is now least recently used
+    resizer.resize_image(paths[2])
+
+    stats = cache.stats()
+    assert stats['bytes'] <= cache.max_bytes
+    assert stats['entries'] < 3
+    resizer.resize_image(paths[1])
+    assert cache.stats()['hits'] == 1
+
+
+def resize_in_worker(args):
+    resizer, path = args
+    return resizer.resize_image(path)
+
+
+def test_shared_between_processes(tmp_path):
+    paths = make_sources(tmp_path, 3)
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    resizer = ThumbnailResizer(str(tmp_path), cache=cache)
+
+    with multiprocessing.Pool(4) as pool:
+        results = pool.map(resize_in_worker, [(resizer, p) for p in paths * 4])
+
+    assert all(os.path.getsize(p) > 0 for out in results for p in out)
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 12
+    assert stats['entries'] == 3
+
+
+@pytest.mark.parametrize('backend', ['serial', 'thread', 'thread-resize'])
+def test_service_threads_share_the_cache(tmp_path, backend):
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(320, 240, seed=i)
+              for i in range(4)}
+    cache = ThumbnailCache(str(tmp_path / 'cache'))
+    with LocalImageServer(images) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend=backend,
+                                        num_resizers=2, cache=cache)
+        # each call resizes on threads of its own
+        for _ in range(2):
+            results = service.make_thumbnails(server.urls())
+            assert len(results) == 4 and service.stats['resize_errors'] == 0
+
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+    stats = cache.stats()
+    assert stats['misses'] == 4 and stats['hits'] == 4
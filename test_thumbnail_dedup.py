@@ -0,0 +1,138 @@
+import os
+import shutil
+from types import SimpleNamespace
+
+from thumbnail_dedup import (Coalescer, Deduplicator, FAILED, RESIZED,
+                             normalize_url, unique_filename)
+from thumbnail_pool import InlineResizePool
+from thumbnail_resize import ThumbnailResizer
+from thumbnail_samples import make_sample_bytes
+
+
+def test_equivalent_urls_normalise_the_same():
+    assert normalize_url('HTTP://Example.COM:80/a/./b/../c%7e.jpg#top') == \
+        normalize_url('http://example.com/a/c~.jpg') == \
+        'http://example.com/a/c~.jpg'
+    assert normalize_url('https://example.com') == 'https://example.com/'
+    # escaped slashes and the query stay what they are
+    assert normalize_url('http://h/a%2fb.jpg?y=1&x=2') == \
+        'http://h/a%2Fb.jpg?y=1&x=2'
+    assert normalize_url('http://h:8080/x') != normalize_url('http://h/x')
+
+
+def test_unique_filenames_keep_basename_and_extension():
+    first = unique_filename('http://a.example/cat.jpg')
+    second = unique_filename('http://b.example/cat.jpg')
+    assert first != second
+    assert first.startswith('cat-') and first.endswith('.jpg')
+    assert unique_filename('HTTP://A.example:80/cat.jpg') == first
+
+
+def test_coalescer_fans_out_and_remembers_successes():
+    coalescer = Coalescer(remember=1)
+    got = []
+    assert coalescer.join('k', None)
+    assert not coalescer.join('k', lambda: got.append)
+    coalescer.complete('k', (RESIZED, ['k_32.jpg'], None))
+    assert got == [(RESIZED, ['k_32.jpg'], None)]
+
+    # answered straight away from what it remembers
+    assert not coalescer.join('k', lambda: got.append)
+    assert len(got) == 2
+
+    assert coalescer.join('bad', None)
+    coalescer.complete('bad', (FAILED, None, 'boom'))
+    assert coalescer.join('bad', None)
+
+
+IMAGE = make_sample_bytes(160, 120)
+
+
+def dedup_batches(tmp_path, count):
+    resizer = ThumbnailResizer(str(tmp_path / 'outgoing'))
+    os.makedirs(resizer.output_dir)
+    os.makedirs(str(tmp_path / 'incoming'))
+    dedup, pool = Deduplicator(resizer), InlineResizePool(resizer)
+    batches = []
+    for _ in range(count):
+        batch = pool.batch()
+        batch.dedup = dedup.batch(batch)
+        batch.on_result = batch.dedup.resized
+        batches.append(batch)
+    return batches
+
+
+def download(tmp_path, batch, url, filename):
+    path = str(tmp_path / 'incoming' / filename)
+    with open(path, 'wb') as f:
+        f.write(IMAGE)
+    batch.sources[filename] = url
+    return path
+
+
+def test_batches_share_downloads_and_resizes(tmp_path):
+    first, second, third = dedup_batches(tmp_path, 3)
+    assert first.dedup.join('http://h/a.jpg', 'a.jpg')
+    assert not second.dedup.join('HTTP://h/./a.jpg', 'a.jpg')
+    assert third.dedup.join('http://h/b.jpg', 'b.jpg')
+
+    path = download(tmp_path, first, 'http://h/a.jpg', 'a.jpg')
+    assert first.dedup.downloaded(path, 'a.jpg')
+    first.submit(path)
+    # same bytes under another url: the thumbnails of a.jpg come back
+    copy = download(tmp_path, third, 'http://h/b.jpg', 'b.jpg')
+    assert not third.dedup.downloaded(copy, 'b.jpg')
+    for batch in (first, second, third):
+        batch.close()
+        assert batch.done()
+
+    [(_, out_paths)] = first.results
+    assert second.results == [('a.jpg', out_paths)]
+    assert third.results == [('b.jpg', out_paths)]
+    assert third.stream[0].source == 'http://h/b.jpg'
+
+
+def test_remembered_resizes_need_their_thumbnails(tmp_path):
+    first, second = dedup_batches(tmp_path, 2)
+    first.dedup.join('http://h/a.jpg', 'a.jpg')
+    path = download(tmp_path, first, 'http://h/a.jpg', 'a.jpg')
+    first.dedup.downloaded(path, 'a.jpg')
+    first.submit(path)
+    first.close()
+
+    shutil.rmtree(str(tmp_path / 'outgoing'))
+    second.dedup.join('http://h/b.jpg', 'b.jpg')
+    copy = download(tmp_path, second, 'http://h/b.jpg', 'b.jpg')
+    assert second.dedup.downloaded(copy, 'b.jpg')
+
+
+def test_failed_delivery_still_settles_the_batch(tmp_path):
+    leader, follower = dedup_batches(tmp_path, 2)
+    leader.dedup.join('http://h/a.jpg', 'a.jpg')
+    assert not follower.dedup.join('http://h/a.jpg', 'a.jpg')
+    path = download(tmp_path, leader, 'http://h/a.jpg', 'a.jpg')
+    leader.dedup.downloaded(path, 'a.jpg')
+    # thumbnails that are gone by the time the follower gets them
+    missing = str(tmp_path / 'outgoing' / 'gone.jpg')
+    leader.dedup.resized(SimpleNamespace(filename='a.jpg',
+                                         out_paths=[missing], error=None))
+    follower.close()
+
+    assert follower.done()
+    assert [name for name, _ in follower.errors] == ['a.jpg']
+
+
+def test_failed_and_unmodified_urls_settle_their_followers(tmp_path):
+    leader, follower = dedup_batches(tmp_path, 2)
+    for name in ('a.jpg', 'b.jpg'):
+        assert leader.dedup.join('http://h/' + name, name)
+        assert not follower.dedup.join('http://h/' + name, name)
+    leader.dedup.failed('http://h/a.jpg', 'boom')
+    # b.jpg answered 304
+    leader.dedup.finish()
+    follower.close()
+
+    assert follower.done()
+    assert follower.results == follower.errors == []
+    # nothing is remembered, the next batch downloads them again
+    assert follower.dedup.join('http://h/a.jpg', 'a.jpg')
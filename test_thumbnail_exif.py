@@ -0,0 +1,79 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from thumbnail_exif import HEADER_BYTES, preview_for_targets
+from thumbnail_samples import (exif_with_thumbnail, make_camera_bytes,
+                               make_sample_bytes, make_sample_image)
+from thumbnail_service import ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+# bigger than HEADER_BYTES, so the header alone is never the whole file
+IMAGES = {'/img{}.jpg'.format(i): make_camera_bytes(2000, 1500, seed=i)
+          for i in range(3)}
+
+
+def test_preview_serves_targets_up_to_its_width():
+    header = IMAGES['/img0.jpg'][:HEADER_BYTES]
+    preview = preview_for_targets(header, [32, 64, 160])
+    with Image.open(io.BytesIO(preview)) as img:
+        assert img.size == (160, 120)
+    assert preview_for_targets(header, [32, 64, 200]) is None
+
+    # no EXIF block at all
+    plain = make_sample_bytes(2000, 1500)[:HEADER_BYTES]
+    assert preview_for_targets(plain, [32]) is None
+    # a square preview of a 4:3 image is letterboxed
+    square = io.BytesIO()
+    make_sample_image(160, 160).save(square, 'JPEG')
+    buf = io.BytesIO()
+    make_sample_image(2000, 1500).save(
+        buf, 'JPEG', exif=exif_with_thumbnail(square.getvalue()))
+    assert preview_for_targets(buf.getvalue()[:HEADER_BYTES], [32]) is None
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_small_targets_come_from_the_preview(tmp_path, backend):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend=backend,
+                                        target_sizes=[32, 64],
+                                        exif_preview=True)
+        results = service.make_thumbnails(server.urls())
+
+    assert len(results) == 3
+    assert all('Range' in headers for _, headers in server.requests)
+    assert len(server.requests) == 3
+    assert server.bytes_sent <= 3 * HEADER_BYTES
+    assert service.metrics.counters['exif_previews'] == 3
+    with Image.open(str(tmp_path / 'outgoing' / 'img1_64.jpg')) as img:
+        assert img.size == (64, 48)
+
+
+def test_full_download_when_a_target_is_too_wide(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend='thread',
+                                        exif_preview=True)
+        results = service.make_thumbnails(server.urls())
+        paths = [path for path, _ in server.requests]
+
+    assert len(results) == 3
+    assert sorted(paths) == sorted(list(IMAGES) * 2)
+    assert 'exif_previews' not in service.metrics.counters
+    with Image.open(str(tmp_path / 'outgoing' / 'img0_200.jpg')) as img:
+        assert img.size == (200, 150)
+
+
+def test_server_ignoring_ranges(tmp_path):
+    images = dict(IMAGES, **{'/small.jpg': make_sample_bytes(160, 120)})
+    with LocalImageServer(images, ranges=False) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend='thread',
+                                        target_sizes=[32, 64],
+                                        exif_preview=True)
+        results = service.make_thumbnails(server.urls())
+
+    # the small one arrived whole with the first request
+    assert len(results) == 4
+    assert len(server.requests) == 4
+    assert os.path.exists(str(tmp_path / 'outgoing' / 'small_64.jpg'))
@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+import queue
+import time
+
+import pytest
+from PIL import Image
+
+from thumbnail_fleet import MAX_REQUEUES, WorkQueue, connect, run_worker
+from thumbnail_samples import make_sample_bytes
+from thumbnail_testserver import LocalImageServer
+from thumnbnail_multipro_manager import FleetThumbnailMakerService
+
+AUTHKEY = b'fleet-test'
+IMAGES = {'/img{}.jpg'.format(i): make_sample_bytes(320, 240, seed=i)
+          for i in range(8)}
+
+
+def start_workers(address, n, authkey=AUTHKEY):
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(address, authkey),
+                                       kwargs={'lease_size': 2})
+               for _ in range(n)]
+    for p in workers:
+        p.start()
+    return workers
+
+
+def test_workers_on_localhost_resize_the_batches(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        with FleetThumbnailMakerService(
+                str(tmp_path), persistent=True,
+                fleet_address=('127.0.0.1', 0),
+                fleet_authkey=AUTHKEY) as service:
+            workers = start_workers(service.pool.address, 3)
+            for i in range(2):
+                urls = [url + '?batch={}'.format(i) for url in server.urls()]
+                batch = service.submit(urls)
+                assert batch.wait(30)
+                assert batch.stats['resized'] == 8
+                assert batch.stats['resize_errors'] == 0
+
+    # the queue closed with the service, the workers are done
+    for p in workers:
+        p.join(10)
+        assert p.exitcode == 0
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 24
+    with Image.open(str(tmp_path / 'outgoing' / 'img3_64.jpg')) as img:
+        assert img.size == (64, 48)
+    assert service.metrics.counters['images'] == 16
+
+
+def test_wrong_authkey_is_refused(tmp_path):
+    with FleetThumbnailMakerService(str(tmp_path), persistent=True,
+                                    fleet_address=('127.0.0.1', 0),
+                                    fleet_authkey=AUTHKEY) as service:
+        with pytest.raises(multiprocessing.AuthenticationError):
+            connect(service.pool.address, b'guess')
+
+
+def lease_and_die(address, leased):
+    # takes tasks like a worker, tells the test and dies holding them
+    work, _ = connect(address, AUTHKEY)
+    tasks = []
+    while len(tasks) < 3:
+        tasks.extend(work.lease('doomed', 3 - len(tasks), 1.0))
+    leased.set()
+    os._exit(1)
+
+
+def test_tasks_of_a_dead_worker_go_to_another(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        with FleetThumbnailMakerService(
+                str(tmp_path), persistent=True,
+                fleet_address=('127.0.0.1', 0),
+                fleet_authkey=AUTHKEY) as service:
+            service.pool.heartbeat_timeout = 0.5
+            leased = multiprocessing.Event()
+            doomed = multiprocessing.Process(
+                target=lease_and_die, args=(service.pool.address, leased))
+            doomed.start()
+            batch = service.submit(server.urls())
+            assert leased.wait(30)
+            doomed.join()
+            workers = start_workers(service.pool.address, 1)
+            assert batch.wait(30)
+            assert len(batch.results) == 8 and not batch.errors
+        for p in workers:
+            p.join(10)
+
+
+def test_a_task_that_keeps_killing_workers_fails():
+    results = queue.Queue()
+    work = WorkQueue(results)
+    work.put((1, 7, 'poison.jpg', b''))
+    work.put((2, 7, 'fine.jpg', b''))
+    for attempt in range(MAX_REQUEUES + 1):
+        worker_id = 'doomed{}'.format(attempt)
+        assert [task[0] for task in work.lease(worker_id, 1, 0)] == [1]
+        time.sleep(0.01)
+        requeued = 0 if attempt == MAX_REQUEUES else 1
+        assert work.reap(0) == [(worker_id, requeued)]
+
+    worker_id, [failed] = results.get_nowait()
+    assert worker_id == 'doomed{}'.format(MAX_REQUEUES)
+    assert failed[:4] == (1, 7, 'poison.jpg', None)
+    assert 'died' in failed[4]
+    # the rest of the queue goes on
+    assert [task[0] for task in work.lease('healthy', 1, 0)] == [2]
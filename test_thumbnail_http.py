@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+import urllib.error
+
+import pytest
+
+from thumbnail_http import (NO_RETRY, ConnectionPool, RetryPolicy,
+                            ValidatorStore, download_file)
+from thumbnail_maker import ThumbnailMakerService
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import ThumbnailMakerService as ServiceWithBackend
+from thumbnail_testserver import LocalImageServer, scripted_faults
+
+IMAGES = {'/img/a.jpg': make_sample_bytes(320, 240, seed=1),
+          '/img/b.jpg': make_sample_bytes(320, 240, seed=2)}
+
+
+def test_304_skips_the_transfer(tmp_path):
+    store_path = str(tmp_path / 'validators.json')
+    dest = str(tmp_path / 'a.jpg')
+    with LocalImageServer(IMAGES) as server:
+        url = server.url('/img/a.jpg')
+        validators = ValidatorStore(store_path)
+        assert download_file(url, dest, validators)
+        validators.save()
+        os.remove(dest)
+
+        # a fresh store picks the validators up from disk
+        assert not download_file(url, dest, ValidatorStore(store_path))
+        assert not os.path.exists(dest)
+        assert 'If-None-Match' in server.requests[-1][1]
+
+
+def test_unconditional_when_asked(tmp_path):
+    dest = str(tmp_path / 'a.jpg')
+    with LocalImageServer(IMAGES) as server:
+        url = server.url('/img/a.jpg')
+        validators = ValidatorStore(str(tmp_path / 'validators.json'))
+        download_file(url, dest, validators)
+
+        assert download_file(url, dest, validators, conditional=False)
+        assert 'If-None-Match' not in server.requests[-1][1]
+        assert os.path.getsize(dest) == len(IMAGES['/img/a.jpg'])
+
+
+def test_service_skips_resize_on_304(tmp_path):
+    home_dir = str(tmp_path)
+    with LocalImageServer(IMAGES) as server:
+        ThumbnailMakerService(home_dir, revalidate=True).make_thumbnails(
+            server.urls())
+        out_dir = tmp_path / 'outgoing'
+        mtimes = {p.name: p.stat().st_mtime_ns for p in out_dir.iterdir()}
+        assert len(mtimes) == 6
+
+        ThumbnailMakerService(home_dir, revalidate=True).make_thumbnails(
+            server.urls())
+
+        assert all('If-None-Match' in headers
+                   for _, headers in server.requests[-2:])
+        assert mtimes == {p.name: p.stat().st_mtime_ns for p in out_dir.iterdir()}
+        assert os.listdir(home_dir + os.path.sep + 'incoming') == []
+
+        # without the old thumbnails there is nothing to revalidate
+        os.remove(str(out_dir / 'b_64.jpg'))
+        ThumbnailMakerService(home_dir, revalidate=True).make_thumbnails(
+            server.urls())
+        assert (out_dir / 'b_64.jpg').exists()
+
+
+def test_retries_get_past_resets_and_503s(tmp_path):
+    dest = str(tmp_path / 'a.jpg')
+    fault = scripted_faults({'/img/a.jpg': ['reset', 503],
+                             '/img/b.jpg': [404]})
+    with LocalImageServer(IMAGES, fault=fault) as server:
+        retry = RetryPolicy(attempts=3, backoff=0.01)
+        assert retry.run(download_file, server.url('/img/a.jpg'), dest)
+        assert len(server.requests) == 3
+        with pytest.raises(urllib.error.HTTPError):
+            retry.run(download_file, server.url('/img/b.jpg'), dest)
+        # 404 is final
+        assert len(server.requests) == 4
+
+    assert open(dest, 'rb').read() == IMAGES['/img/a.jpg']
+
+
+def test_read_timeout_cuts_a_stall_short(tmp_path):
+    dest = str(tmp_path / 'a.jpg')
+    fault = scripted_faults({'/img/a.jpg': ['stall']})
+    with LocalImageServer(IMAGES, fault=fault, stall=5) as server:
+        start = time.perf_counter()
+        with pytest.raises(OSError):
+            download_file(server.url('/img/a.jpg'), dest, timeouts=(1, 0.2))
+        assert time.perf_counter() - start < 2
+        assert RetryPolicy(backoff=0.01).run(
+            download_file, server.url('/img/a.jpg'), dest, None, True,
+            (1, 0.2))
+
+
+@pytest.mark.parametrize('backend', ['thread', 'asyncio'])
+def test_hedged_download_beats_a_stall(tmp_path, backend):
+    fault = scripted_faults({'/img/a.jpg': ['stall']})
+    with LocalImageServer(IMAGES, fault=fault, stall=3) as server:
+        service = ServiceWithBackend(str(tmp_path), backend=backend,
+                                     hedge=True, retry=NO_RETRY)
+        # pretend the origin usually answers in 10ms
+        for _ in range(20):
+            service.dl_latency.add(0.01)
+        start = time.perf_counter()
+        assert len(service.make_thumbnails(server.urls())) == 2
+        assert time.perf_counter() - start < 2
+        paths = [path for path, _ in server.requests]
+
+    assert paths.count('/img/a.jpg') == 2
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+
+
+def test_pool_keeps_connections_alive(tmp_path):
+    dest = str(tmp_path / 'a.jpg')
+    pool = ConnectionPool()
+    with LocalImageServer(IMAGES) as server:
+        validators = ValidatorStore(str(tmp_path / 'validators.json'))
+        assert download_file(server.url('/img/a.jpg'), dest, validators,
+                             pool=pool)
+        assert download_file(server.url('/img/b.jpg'), dest, pool=pool)
+        assert not download_file(server.url('/img/a.jpg'), dest, validators,
+                                 pool=pool)
+        assert server.connections == 1
+
+        # error pages come with Connection: close
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            download_file(server.url('/img/missing.jpg'), dest, pool=pool)
+        assert excinfo.value.code == 404
+        assert download_file(server.url('/img/a.jpg'), dest, pool=pool)
+        assert server.connections == 2
+        pool.close()
+
+    assert open(dest, 'rb').read() == IMAGES['/img/a.jpg']
+
+
+def test_pool_caps_connections_per_host(tmp_path):
+    pool = ConnectionPool(max_per_host=2)
+    with LocalImageServer(IMAGES, latency=0.05) as server:
+        def download(i):
+            download_file(server.url('/img/a.jpg'),
+                          str(tmp_path / '{}.jpg'.format(i)), pool=pool)
+        threads = [threading.Thread(target=download, args=(i,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert server.connections == 2
+        assert server.peak_active == 2
+        pool.close()
+
+    assert len(os.listdir(str(tmp_path))) == 8
+
+
+def test_service_reuses_connections_across_batches(tmp_path):
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(8)}
+    with LocalImageServer(images) as server:
+        with ServiceWithBackend(str(tmp_path), backend='thread',
+                                persistent=True, num_dl_threads=4,
+                                limit_per_host=2) as service:
+            for i in range(3):
+                urls = [url + '?batch={}'.format(i) for url in server.urls()]
+                batch = service.submit(urls)
+                batch.wait()
+                assert batch.stats['downloaded'] == 8
+        assert server.connections <= 2
+
+
+def test_connections_outlive_make_thumbnails(tmp_path):
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(8)}
+    with LocalImageServer(images) as server:
+        with ServiceWithBackend(str(tmp_path), backend='thread',
+                                num_dl_threads=2,
+                                limit_per_host=2) as service:
+            # every call starts and stops its own download threads
+            for i in range(3):
+                urls = [url + '?call={}'.format(i) for url in server.urls()]
+                assert len(service.make_thumbnails(urls)) == 8
+                assert not service.running
+        assert server.connections <= 2
@@ -0,0 +1,175 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+from thumbnail_journal import (COMMITTED, DOWNLOADED, QUEUED, RESIZED,
+                               Journal)
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+IMAGES = {'/img{}.jpg'.format(i): make_sample_bytes(320, 240, seed=i)
+          for i in range(6)}
+
+# dies the hard way after the first two results, leaving the rest of the
+# batch somewhere between queued and resized
+CRASH = """
+import os, sys
+from thumbnail_service import ThumbnailMakerService
+urls = sys.argv[2:]
+service = ThumbnailMakerService(sys.argv[1], backend='thread',
+                                num_resizers=1, journal=True)
+for i, result in enumerate(service.iter_thumbnails(urls)):
+    if i == 1:
+        os._exit(1)
+"""
+
+
+def record_many(journal, worker):
+    for i in range(50):
+        journal.record(RESIZED, 'w{}-{}.jpg'.format(worker, i))
+
+
+def test_records_of_many_processes_and_a_torn_line(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = Journal(path)
+    journal.record(QUEUED, 'a.jpg', url='http://x/a.jpg')
+    journal.record(DOWNLOADED, 'a.jpg', size=10)
+    workers = [multiprocessing.Process(target=record_many,
+                                       args=(journal, worker))
+               for worker in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    # a crash in the middle of a write
+    with open(path, 'ab') as f:
+        f.write(b'{"file": "a.jpg", "sta')
+    journal.close()
+
+    fresh = Journal(path)
+    assert fresh.latest('a.jpg') == {'state': DOWNLOADED, 'file': 'a.jpg',
+                                     'url': 'http://x/a.jpg', 'size': 10}
+    assert fresh.latest('w2-49.jpg')['state'] == RESIZED
+    assert len(fresh.load()) == 151
+    fresh.compact()
+    with open(path) as f:
+        assert len([json.loads(line) for line in f]) == 151
+
+
+def test_records_after_a_torn_line_are_kept(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    Journal(path).record(RESIZED, 'a.jpg')
+    with open(path, 'ab') as f:
+        f.write(b'{"file": "b.jpg", "sta')
+
+    # the next run appends after the torn line, not onto it
+    journal = Journal(path)
+    journal.record(COMMITTED, 'a.jpg')
+    journal.close()
+    fresh = Journal(path)
+    assert fresh.latest('a.jpg')['state'] == COMMITTED
+    assert fresh.latest('b.jpg') is None
+
+
+@contextlib.contextmanager
+def holding(lock):
+    # lock stays held by another thread until the block is over
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with lock:
+            held.set()
+            release.wait()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        yield
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_a_child_forked_while_the_lock_is_held_can_record(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = Journal(path)
+    child = multiprocessing.get_context('fork').Process(
+        target=record_many, args=(journal, 0))
+    # another thread of the parent is half way through a record
+    with holding(journal._lock):
+        child.start()
+        child.join(10)
+    if child.exitcode is None:
+        child.terminate()
+    assert child.exitcode == 0
+    assert Journal(path).latest('w0-49.jpg')['state'] == RESIZED
+
+
+def test_resume_needs_the_journal(tmp_path):
+    service = ThumbnailMakerService(str(tmp_path), backend='serial')
+    with pytest.raises(ValueError):
+        service.make_thumbnails([], resume=True)
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process', 'asyncio'])
+def test_resume_skips_what_is_done(tmp_path, backend):
+    with LocalImageServer(IMAGES) as server:
+        urls = server.urls()
+        service = ThumbnailMakerService(str(tmp_path), backend=backend,
+                                        journal=True)
+        assert len(service.make_thumbnails(urls)) == 6
+        # img0 lost a thumbnail, img1 got as far as being downloaded
+        os.remove(str(tmp_path / 'outgoing' / 'img0_64.jpg'))
+        with open(str(tmp_path / 'incoming' / 'img1.jpg'), 'wb') as f:
+            f.write(IMAGES['/img1.jpg'])
+        service.journal.record(DOWNLOADED, 'img1.jpg', size=1)
+        del server.requests[:]
+
+        results = service.make_thumbnails(urls, resume=True)
+        assert [path for path, _ in server.requests] == ['/img0.jpg']
+
+    assert len(results) == 6
+    assert service.stats['resumed'] == 5
+    assert service.stats['downloaded'] == 1
+    assert service.stats['not_modified'] == 0
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+    with Image.open(str(tmp_path / 'outgoing' / 'img0_64.jpg')) as img:
+        assert img.size == (64, 48)
+    assert service.journal.latest('img1.jpg')['state'] == COMMITTED
+
+
+def test_resume_after_a_crash(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        urls = server.urls()
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.abspath(__file__)))
+        crashed = subprocess.run([sys.executable, '-c', CRASH,
+                                  str(tmp_path)] + urls, env=env, timeout=60)
+        assert crashed.returncode == 1
+        fetched = len(server.requests)
+        del server.requests[:]
+
+        service = ThumbnailMakerService(str(tmp_path), backend='thread',
+                                        journal=True)
+        results = service.make_thumbnails(urls, resume=True)
+        refetched = len(server.requests)
+
+    assert len(results) == 6
+    # the two results seen before the crash are not done again
+    assert service.stats['resumed'] >= 2
+    assert refetched <= 6 - 2
+    assert fetched + refetched >= 6
+    outgoing = os.listdir(str(tmp_path / 'outgoing'))
+    assert len(outgoing) == 18
+    assert not [name for name in outgoing if name.endswith('.tmp')]
+    for name in outgoing:
+        with Image.open(str(tmp_path / 'outgoing' / name)) as img:
+            img.load()
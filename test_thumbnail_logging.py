@@ -0,0 +1,64 @@
+import logging
+import os
+import subprocess
+import sys
+
+from thumbnail_logging import BatchingFileHandler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# logging is configured once per process, so every mode runs in its own
+SCRIPT = '''
+import sys
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import ThumbnailMakerService
+from thumbnail_testserver import LocalImageServer
+
+images = {'/img%d.jpg' % i: make_sample_bytes(64, 48, seed=i)
+          for i in range(4)}
+with LocalImageServer(images) as server:
+    ThumbnailMakerService('.', backend=sys.argv[1],
+                          num_resizers=2).make_thumbnails(server.urls())
+'''
+
+
+def run_service(tmp_path, backend, **env):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, **env)
+    subprocess.run([sys.executable, '-c', SCRIPT, backend], cwd=str(tmp_path),
+                   env=env, check=True, timeout=60)
+    with open(str(tmp_path / 'logfile.log')) as f:
+        return f.read().splitlines()
+
+
+def test_queued_logging_collects_the_worker_records(tmp_path):
+    lines = run_service(tmp_path, 'process', THUMBNAIL_LOG_QUEUE='1')
+
+    done = [line for line in lines if 'done resizing image' in line]
+    assert len(done) == 4
+    # written by the listener in the parent, logged in the resize processes
+    assert all(':MainProcess:' not in line for line in done)
+    assert any('END make_thumbnails' in line for line in lines)
+    assert all(line.split(':')[0] in ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+               for line in lines)
+
+
+def test_log_level_comes_from_the_environment(tmp_path):
+    lines = run_service(tmp_path, 'thread', THUMBNAIL_LOG_LEVEL='INFO')
+
+    assert any('END make_thumbnails' in line for line in lines)
+    assert not any(line.startswith('DEBUG') for line in lines)
+
+
+def test_batching_handler_writes_on_flush(tmp_path):
+    path = str(tmp_path / 'batch.log')
+    handler = BatchingFileHandler(path, batch_size=3)
+    record = logging.LogRecord('x', logging.INFO, __file__, 1, 'msg', None,
+                               None)
+    handler.handle(record)
+    handler.handle(record)
+    assert os.path.getsize(path) == 0
+    handler.handle(record)
+    assert open(path).read() == 'msg\n' * 3
+    handler.handle(record)
+    handler.close()
+    assert open(path).read() == 'msg\n' * 4
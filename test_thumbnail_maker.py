@@ -1,44 +1,30 @@
-# from thumbnail_maker import ThumbnailMakerService
-# from thumnbnail_threading import ThumbnailMakerService
-# from thumbnail_queue import ThumbnailMakerService
-# from thumnbnail_multiprocess import ThumbnailMakerService
-# from thumnbnail_multipro_queue import ThumbnailMakerService
-# from thumnbnail_multipro_manager import ThumbnailMakerService
-from thumnbnail_asyncio import ThumbnailMakerService
+import importlib
+import os
 
-IMG_URLS = \
-    ['https://dl.dropboxusercontent.com/s/2fu69d8lfesbhru/pexels-photo-48603.jpeg',
-     'https://dl.dropboxusercontent.com/s/zch88m6sb8a7bm1/pexels-photo-134392.jpeg',
-     'https://dl.dropboxusercontent.com/s/lsr6dxw5m2ep5qt/pexels-photo-135130.jpeg',
-     'https://dl.dropboxusercontent.com/s/6xinfm0lcnbirb9/pexels-photo-167300.jpeg',
-     'https://dl.dropboxusercontent.com/s/2dp2hli32h9p0y6/pexels-photo-167921.jpeg',
-     'https://dl.dropboxusercontent.com/s/fjb1m3grcrceqo2/pexels-photo-173125.jpeg',
-     'https://dl.dropboxusercontent.com/s/56u8p4oplagc4bp/pexels-photo-185934.jpeg',
-     'https://dl.dropboxusercontent.com/s/2s1x7wz4sdvxssr/pexels-photo-192454.jpeg',
-     'https://dl.dropboxusercontent.com/s/1gjphqnllzm10hh/pexels-photo-193038.jpeg',
-     'https://dl.dropboxusercontent.com/s/pcjz40c8pxpy057/pexels-photo-193043.jpeg',
-     'https://dl.dropboxusercontent.com/s/hokdfk7y8zmwe96/pexels-photo-207962.jpeg',
-     'https://dl.dropboxusercontent.com/s/k2tk2co7r18juy7/pexels-photo-247917.jpeg',
-     'https://dl.dropboxusercontent.com/s/m4xjekvqk4rksbx/pexels-photo-247932.jpeg',
-     'https://dl.dropboxusercontent.com/s/znmswtwhcdbpc10/pexels-photo-265186.jpeg',
-     'https://dl.dropboxusercontent.com/s/jgb6n4esquhh4gu/pexels-photo-302899.jpeg',
-     'https://dl.dropboxusercontent.com/s/rjuggi2ubc1b3bk/pexels-photo-317156.jpeg',
-     'https://dl.dropboxusercontent.com/s/cpaog2nwplilrz9/pexels-photo-317383.jpeg',
-     'https://dl.dropboxusercontent.com/s/16x2b6ruk18gji5/pexels-photo-320007.jpeg',
-     'https://dl.dropboxusercontent.com/s/xqzqzjkcwl52en0/pexels-photo-322207.jpeg',
-     'https://dl.dropboxusercontent.com/s/frclthpd7t8exma/pexels-photo-323503.jpeg',
-     'https://dl.dropboxusercontent.com/s/7ixez07vnc3jeyg/pexels-photo-324030.jpeg',
-     'https://dl.dropboxusercontent.com/s/1xlgrfy861nyhox/pexels-photo-324655.jpeg',
-     'https://dl.dropboxusercontent.com/s/v1b03d940lop05d/pexels-photo-324658.jpeg',
-     'https://dl.dropboxusercontent.com/s/ehrm5clkucbhvi4/pexels-photo-325520.jpeg',
-     'https://dl.dropboxusercontent.com/s/l7ga4ea98hfl49b/pexels-photo-333529.jpeg',
-     'https://dl.dropboxusercontent.com/s/rleff9tx000k19j/pexels-photo-341520.jpeg'
-     ]
+import pytest
 
+from thumbnail_samples import make_sample_bytes
+from thumbnail_testserver import LocalImageServer
 
-def test_thumbnail_maker():
-    tn_maker = ThumbnailMakerService()
-    tn_maker.make_thumbnails(IMG_URLS)
+VARIANTS = ['thumbnail_maker', 'thumnbnail_threading', 'thumbnail_queue',
+            'thumnbnail_multiprocess', 'thumnbnail_multipro_queue',
+            'thumnbnail_multipro_manager', 'thumnbnail_asyncio']
 
+# a mix of sizes and formats, served from localhost instead of dropbox
+IMAGES = {'/img{}.{}'.format(i, ext): make_sample_bytes(width, height,
+                                                        fmt=fmt, seed=i)
+          for i, (width, height, fmt, ext) in enumerate(
+              [(640, 480, 'JPEG', 'jpg'), (320, 240, 'PNG', 'png'),
+               (1024, 768, 'JPEG', 'jpg'), (200, 150, 'JPEG', 'jpg')])}
 
-test_thumbnail_maker()
+
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_thumbnail_maker(tmp_path, variant):
+    service_class = importlib.import_module(variant).ThumbnailMakerService
+    with LocalImageServer(IMAGES, latency=0.01) as server:
+        tn_maker = service_class(str(tmp_path))
+        tn_maker.make_thumbnails(server.urls())
+
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 3 * len(IMAGES)
+    assert tn_maker.stats['thumbnails'] == 3 * len(IMAGES)
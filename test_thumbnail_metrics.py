@@ -0,0 +1,38 @@
+import pickle
+
+from thumbnail_metrics import Metrics, bucket_bound, bucket_index
+
+
+def test_histogram_percentiles_stay_within_a_bucket():
+    metrics = Metrics()
+    for i in range(1, 101):
+        metrics.observe('decode', i / 1000.0)
+    snapshot = metrics.snapshot()['histograms']['decode']
+
+    assert snapshot['count'] == 100
+    assert snapshot['min'] == 0.001 and snapshot['max'] == 0.1
+    for pct in (50, 95, 99):
+        exact = pct / 1000.0
+        assert exact <= snapshot['p{}'.format(pct)] < 2 * exact
+    assert sum(n for _, n in snapshot['buckets']) == 100
+
+
+def test_bucket_bounds():
+    assert bucket_index(0) == 0
+    for value in (1e-5, 3e-4, 0.2, 7.0):
+        index = bucket_index(value)
+        assert bucket_bound(index - 1) < value <= bucket_bound(index)
+
+
+def test_merge_a_pickled_worker_metrics():
+    parent, worker = Metrics(), Metrics()
+    parent.observe('resize_64', 0.01)
+    worker.observe('resize_64', 0.03)
+    worker.add('bytes_out', 100)
+    parent.merge(pickle.loads(pickle.dumps(worker)))
+    parent.merge(pickle.loads(pickle.dumps(worker)))
+
+    snapshot = parent.snapshot()
+    assert snapshot['histograms']['resize_64']['count'] == 3
+    assert snapshot['histograms']['resize_64']['max'] == 0.03
+    assert snapshot['counters'] == {'bytes_out': 200}
@@ -0,0 +1,288 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+from thumbnail_metrics import Metrics
+from thumbnail_pool import Backpressure, ResizeWorkerPool
+from thumbnail_resize import ThumbnailResizer
+from thumbnail_samples import make_sample_bytes, make_sample_image
+from thumbnail_testserver import LocalImageServer
+
+
+def make_inputs(input_dir, prefix, count):
+    os.makedirs(input_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(input_dir, '{}{}.jpg'.format(prefix, i))
+        make_sample_image(160, 120, seed=i).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_batches_share_the_same_workers(tmp_path):
+    input_dir = str(tmp_path / 'incoming')
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 2) as pool:
+        pids = sorted(p.pid for p in pool._workers)
+        first, second = pool.batch(), pool.batch()
+        for path in make_inputs(input_dir, 'a', 3):
+            first.submit(path)
+        for path in make_inputs(input_dir, 'b', 2):
+            second.submit(path)
+        second.close()
+        first.close()
+
+        assert sorted(name for name, _ in first.wait(10)) == \
+            ['a0.jpg', 'a1.jpg', 'a2.jpg']
+        assert sorted(name for name, _ in second.wait(10)) == \
+            ['b0.jpg', 'b1.jpg']
+        assert sorted(p.pid for p in pool._workers) == pids
+    assert os.listdir(input_dir) == []
+
+
+def test_errors_are_reported_per_batch(tmp_path):
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 1) as pool:
+        batch = pool.batch()
+        batch.submit(str(tmp_path / 'missing.jpg'))
+        batch.close()
+        assert batch.wait(10) == []
+        assert len(batch.errors) == 1
+
+
+class CrashingResizer(ThumbnailResizer):
+    def resize_image(self, input_path, metrics=None):
+        if 'crash' in input_path:
+            os._exit(1)
+        return super().resize_image(input_path, metrics)
+
+
+def test_resize_the_pool(tmp_path):
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 2) as pool:
+        pool.resize(3)
+        assert pool.num_processes == 3
+        pool.resize(1)
+        assert pool.num_processes == 1
+
+        batch = pool.batch()
+        for path in make_inputs(str(tmp_path / 'incoming'), 'a', 3):
+            batch.submit(path)
+        batch.close()
+        assert len(batch.wait(10)) == 3
+
+
+def test_dead_worker_is_replaced(tmp_path):
+    with ResizeWorkerPool(CrashingResizer(str(tmp_path)), 1,
+                          chunksize=2) as pool:
+        victim = pool._workers[0]
+        lost = pool.batch()
+        # both go to the victim in one chunk
+        lost.submit(make_inputs(str(tmp_path / 'incoming'), 'b', 1)[0])
+        lost.submit('crash.jpg')
+        lost.close()
+
+        victim.join(10)
+        # the chunk it died on comes back as errors
+        assert lost.wait(10) == []
+        assert sorted(filename for filename, _ in lost.errors) == \
+            ['b0.jpg', 'crash.jpg']
+        assert pool.backlog() == 0
+
+        batch = pool.batch()
+        for path in make_inputs(str(tmp_path / 'incoming'), 'a', 2):
+            batch.submit(path)
+        batch.close()
+
+        assert len(batch.wait(10)) == 2
+        assert pool._workers[0] is not victim
+        assert pool.num_processes == 1
+
+
+def take_and_die(task_queue):
+    # a worker that dies after taking a chunk, before it could claim it
+    task_queue.get()
+    os._exit(1)
+
+
+def test_chunk_taken_by_a_worker_that_died_unclaimed_is_lost(tmp_path):
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 1,
+                          chunksize=2) as pool:
+        idle = pool._workers[0]
+        batch = pool.batch()
+        for path in make_inputs(str(tmp_path / 'incoming'), 'a', 2):
+            batch.submit(path)
+        batch.close()
+        assert len(batch.wait(10)) == 2
+        # the results are out, the worker holds no chunk any more
+        assert pool._current[idle].value == -1
+
+        pool.resize(0)
+        idle.join(10)
+        thief = multiprocessing.Process(target=take_and_die,
+                                        args=(pool.task_queue,))
+        with pool._lock:
+            pool._current[thief] = multiprocessing.RawValue('q', -1)
+            pool._workers.append(thief)
+        thief.start()
+        lost = pool.batch()
+        for path in make_inputs(str(tmp_path / 'incoming'), 'b', 2):
+            lost.submit(path)
+        lost.close()
+
+        assert lost.wait(10) == []
+        assert sorted(filename for filename, _ in lost.errors) == \
+            ['b0.jpg', 'b1.jpg']
+        assert pool.num_processes == 1
+        assert pool.backlog() == 0
+
+
+def test_persistent_service_accepts_overlapping_batches(tmp_path):
+    from thumnbnail_multipro_queue import ThumbnailMakerService
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(6)}
+    with LocalImageServer(images, latency=0.05) as server:
+        urls = server.urls()
+        with ThumbnailMakerService(str(tmp_path), persistent=True,
+                                   num_processes=2) as service:
+            first = service.submit(urls[:3])
+            second = service.submit(urls[3:])
+            assert len(second.wait(10)) == 3
+            assert len(first.wait(10)) == 3
+            assert first.errors == second.errors == []
+            service.make_thumbnails(urls)
+        assert service.pool.num_processes == 0
+
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 18
+
+
+def test_backpressure_blocks_on_items_and_bytes():
+    metrics = Metrics()
+    limiter = Backpressure(max_items=2, max_bytes=100, metrics=metrics)
+    limiter.acquire()
+    limiter.add('a.jpg', 10)
+    limiter.acquire()
+    blocked = threading.Thread(target=limiter.acquire)
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    limiter.release('a.jpg')
+    blocked.join(5)
+    assert not blocked.is_alive()
+    assert metrics.snapshot()['counters']['throttled'] == 1
+
+    # give one slot back, bind the other to a file over the byte bound
+    limiter.cancel()
+    limiter.add('big.jpg', 150)
+    blocked = threading.Thread(target=limiter.acquire)
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    limiter.release('big.jpg')
+    blocked.join(5)
+    assert not blocked.is_alive()
+    assert limiter.items == 1 and limiter.bytes == 0
+
+
+def test_backpressure_wakes_waiting_coroutines():
+    limiter = Backpressure(max_items=1)
+    limiter.acquire()
+    limiter.add('a.jpg', 1)
+
+    async def wait_for_slot():
+        threading.Timer(0.1, limiter.release, args=('a.jpg',)).start()
+        await asyncio.wait_for(limiter.acquire_async(), 5)
+
+    asyncio.run(wait_for_slot())
+    assert limiter.items == 1
+    assert limiter.throttled_seconds > 0
+
+
+class SlowResizer(ThumbnailResizer):
+    # records how many downloads were waiting in incoming/ at most
+    peak_incoming = 0
+
+    def resize_image(self, input_path, metrics=None):
+        waiting = len(os.listdir(os.path.dirname(input_path)))
+        SlowResizer.peak_incoming = max(SlowResizer.peak_incoming, waiting)
+        time.sleep(0.05)
+        return super().resize_image(input_path, metrics)
+
+
+def test_bounded_service_keeps_incoming_small(tmp_path):
+    from thumbnail_service import ThumbnailMakerService
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(64, 48, seed=i)
+              for i in range(12)}
+    with LocalImageServer(images) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend='thread',
+                                        num_resizers=1, num_dl_threads=6,
+                                        max_queued=2)
+        service.resizer = SlowResizer(service.output_dir)
+        assert len(service.make_thumbnails(server.urls())) == 12
+
+    assert SlowResizer.peak_incoming <= 2
+    assert service.metrics.snapshot()['counters']['throttled'] > 0
+    assert service.backpressure.items == 0
+
+
+def test_bounded_asyncio_downloads_wait_for_the_resizers(tmp_path):
+    from thumbnail_service import ThumbnailMakerService
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(64, 48, seed=i)
+              for i in range(12)}
+    with LocalImageServer(images) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend='asyncio',
+                                        num_resizers=1, max_queued=2)
+        assert len(service.make_thumbnails(server.urls())) == 12
+
+    histograms = service.metrics.snapshot()['histograms']
+    assert histograms['throttle_wait']['count'] > 0
+    assert service.backpressure.items == 0
+    assert service.backpressure.bytes == 0
+
+
+def test_items_travel_in_tuned_chunks(tmp_path):
+    paths = make_inputs(str(tmp_path / 'incoming'), 'a', 40)
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 2) as pool:
+        batch = pool.batch()
+        for path in paths:
+            batch.submit(path)
+        batch.close()
+        assert len(batch.wait(30)) == 40
+        assert pool.messages < 40
+        assert pool.item_cost > 0
+
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 2,
+                          chunksize=1) as pool:
+        batch = pool.batch()
+        for path in make_inputs(str(tmp_path / 'incoming'), 'b', 5):
+            batch.submit(path)
+        batch.close()
+        assert len(batch.wait(10)) == 5
+        assert pool.messages == 5
+
+
+def test_worker_metrics_come_back_per_chunk_and_add_up(tmp_path):
+    paths = make_inputs(str(tmp_path / 'incoming'), 'a', 40)
+    merged = []
+
+    class CountingMetrics(Metrics):
+        def merge(self, other):
+            merged.append(other)
+            super().merge(other)
+
+    metrics = CountingMetrics()
+    with ResizeWorkerPool(ThumbnailResizer(str(tmp_path)), 2,
+                          metrics) as pool:
+        batch = pool.batch()
+        for path in paths:
+            batch.submit(path)
+        batch.close()
+        assert len(batch.wait(30)) == 40
+        # exact while the workers are still running
+        assert metrics.counters['images'] == 40
+        assert metrics.snapshot()['histograms']['resize_64']['count'] == 40
+        assert len(merged) == pool.messages < 40
+    assert all(result.timings['decode'] > 0 for result in batch.stream)
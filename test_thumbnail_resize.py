@@ -0,0 +1,141 @@
+import os
+
+import pytest
+from PIL import Image, ImageChops, ImageCms, ImageStat
+
+from thumbnail_encode import EncoderProfile
+from thumbnail_resize import (RESIZE_DIRECT, RESIZE_PYRAMID, ThumbnailResizer,
+                              draft_for_targets, resize_to_targets,
+                              target_dimensions)
+from thumbnail_samples import make_sample_image
+
+
+def test_pyramid_matches_direct_dimensions():
+    orig_img = make_sample_image(1200, 900)
+    direct = resize_to_targets(orig_img, [32, 64, 200], RESIZE_DIRECT)
+    pyramid = resize_to_targets(orig_img, [32, 64, 200], RESIZE_PYRAMID)
+
+    assert [w for w, _ in pyramid] == [32, 64, 200]
+    for (_, a), (_, b) in zip(direct, pyramid):
+        assert a.size == b.size == target_dimensions(orig_img.size, a.size[0])
+
+
+def test_pyramid_falls_back_to_original_for_small_steps():
+    orig_img = make_sample_image(400, 300)
+    # 100 -> 80 is far below the minimum step, so 80 comes from the original
+    direct = dict(resize_to_targets(orig_img, [80, 100], RESIZE_DIRECT))
+    pyramid = dict(resize_to_targets(orig_img, [80, 100], RESIZE_PYRAMID))
+    assert direct[80].tobytes() == pyramid[80].tobytes()
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ThumbnailResizer('.', resize_mode='bogus')
+
+
+def test_resizer_writes_every_target(tmp_path):
+    src = str(tmp_path / 'cat.jpg')
+    make_sample_image(640, 480).save(src)
+    resizer = ThumbnailResizer(str(tmp_path), resize_mode=RESIZE_PYRAMID)
+
+    out_paths = resizer.resize_image(src)
+
+    assert [os.path.basename(p) for p in out_paths] == \
+        ['cat_32.jpg', 'cat_64.jpg', 'cat_200.jpg']
+    assert all(os.path.getsize(p) > 0 for p in out_paths)
+
+
+def test_draft_is_visually_equivalent(tmp_path):
+    src = str(tmp_path / 'dog.jpg')
+    make_sample_image(2000, 1500).save(src, quality=90)
+
+    with Image.open(src) as full_img:
+        full = resize_to_targets(full_img)
+    with Image.open(src) as draft_img:
+        orig_size = draft_img.size
+        assert draft_for_targets(draft_img) == (250, 188)
+        drafted = resize_to_targets(draft_img, orig_size=orig_size)
+
+    for (_, a), (_, b) in zip(full, drafted):
+        assert a.size == b.size
+        assert max(ImageStat.Stat(ImageChops.difference(a, b)).mean) < 2
+
+
+def test_profiles_pick_format_and_options_per_size(tmp_path):
+    src = str(tmp_path / 'cat.jpg')
+    make_sample_image(640, 480).save(src, quality=95)
+    resizer = ThumbnailResizer(str(tmp_path / 'out'), profiles={
+        32: EncoderProfile('WEBP', quality=60),
+        200: EncoderProfile('JPEG', quality=80, progressive=True)})
+    os.makedirs(resizer.output_dir)
+
+    out_paths = resizer.resize_image(src)
+
+    assert [os.path.basename(p) for p in out_paths] == \
+        ['cat_32.webp', 'cat_64.jpg', 'cat_200.jpg']
+    formats = []
+    for path in out_paths:
+        with Image.open(path) as img:
+            formats.append(img.format)
+            if path.endswith('_200.jpg'):
+                assert img.info.get('progressive')
+    assert formats == ['WEBP', 'JPEG', 'JPEG']
+    assert resizer.outputs_exist('cat.jpg')
+
+
+def test_profiles_strip_metadata_unless_asked(tmp_path):
+    src = str(tmp_path / 'cat.jpg')
+    exif = Image.Exif()
+    # 0x010f is the camera make
+    exif[0x010f] = 'test camera'
+    make_sample_image(320, 240).save(src, exif=exif)
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    png_src = str(tmp_path / 'cat.png')
+    make_sample_image(320, 240).save(png_src, icc_profile=icc)
+
+    for strip in (True, False):
+        out_dir = tmp_path / str(strip)
+        out_dir.mkdir()
+        resizer = ThumbnailResizer(str(out_dir), target_sizes=[64],
+                                   profiles=EncoderProfile(
+                                       'JPEG', strip_metadata=strip))
+        with Image.open(resizer.resize_image(src)[0]) as img:
+            assert ('exif' in img.info) == (not strip)
+        # the PNG encoder writes the profile resize() copied over unless
+        # told not to
+        resizer = ThumbnailResizer(str(out_dir), target_sizes=[64],
+                                   profiles=EncoderProfile(
+                                       'PNG', strip_metadata=strip))
+        with Image.open(resizer.resize_image(png_src)[0]) as img:
+            assert bool(img.info.get('icc_profile')) == (not strip)
+
+    # by default a thumbnail is saved the way it always was
+    resizer = ThumbnailResizer(str(tmp_path), target_sizes=[64])
+    with Image.open(resizer.resize_image(png_src)[0]) as img:
+        assert img.info.get('icc_profile') == icc
+    with Image.open(resizer.resize_image(src)[0]) as img:
+        assert 'exif' not in img.info
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        ThumbnailResizer('.', profiles='gif')
+    with pytest.raises(ValueError):
+        EncoderProfile('GIF')
+
+
+def test_mmap_input_matches_buffered_and_unmaps(tmp_path):
+    src = str(tmp_path / 'cat.jpg')
+    make_sample_image(640, 480).save(src)
+    outputs = {}
+    for mmap_input in (False, True):
+        out_dir = tmp_path / str(mmap_input)
+        out_dir.mkdir()
+        resizer = ThumbnailResizer(str(out_dir), mmap_input=mmap_input)
+        outputs[mmap_input] = [open(path, 'rb').read()
+                               for path in resizer.resize_image(src)]
+
+    assert outputs[True] == outputs[False]
+    # nothing of the input stays mapped once resize_image returns
+    with open('/proc/self/maps') as f:
+        assert src not in f.read()
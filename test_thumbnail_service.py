@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import (BACKENDS, BACKEND_ASYNCIO, BACKEND_SERIAL,
+                               BACKEND_THREAD, ThumbnailMakerService)
+from thumbnail_testserver import LocalImageServer
+
+IMAGES = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+          for i in range(5)}
+
+
+def run_backend(home_dir, backend, urls, **kwargs):
+    service = ThumbnailMakerService(home_dir, backend=backend, **kwargs)
+    results = service.make_thumbnails(urls)
+    outputs = {}
+    for name in os.listdir(home_dir + os.path.sep + 'outgoing'):
+        with open(home_dir + os.path.sep + 'outgoing' + os.path.sep + name,
+                  'rb') as f:
+            outputs[name] = f.read()
+    return sorted(name for name, _ in results), service.stats, outputs
+
+
+def test_backends_agree_on_results_and_stats(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        runs = {backend: run_backend(str(tmp_path / backend), backend,
+                                     server.urls(), num_resizers=2)
+                for backend in BACKENDS}
+
+    names, stats, outputs = runs[BACKEND_SERIAL]
+    assert names == ['img{}.jpg'.format(i) for i in range(5)]
+    assert stats['downloaded'] == stats['resized'] == 5
+    assert stats['thumbnails'] == len(outputs) == 15
+    assert stats['dl_bytes'] == sum(len(body) for body in IMAGES.values())
+    for backend in BACKENDS:
+        assert runs[backend] == runs[BACKEND_SERIAL], backend
+        assert os.listdir(str(tmp_path / backend / 'incoming')) == []
+
+
+@pytest.mark.parametrize('backend', [BACKEND_THREAD, BACKEND_ASYNCIO])
+def test_failed_downloads_are_counted(tmp_path, backend):
+    with LocalImageServer(IMAGES) as server:
+        urls = server.urls() + [server.url('/missing.jpg')]
+        service = ThumbnailMakerService(str(tmp_path), backend=backend)
+        assert len(service.make_thumbnails(urls)) == 5
+
+    assert service.stats['download_errors'] == 1
+    assert service.stats['not_modified'] == 0
+
+
+def test_revalidated_batch_counts_not_modified(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend=BACKEND_THREAD,
+                                        revalidate=True)
+        service.make_thumbnails(server.urls())
+        assert service.make_thumbnails(server.urls()) == []
+
+    assert service.stats['not_modified'] == 5
+    assert service.stats['thumbnails'] == 0
+
+
+def test_invalid_combinations_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ThumbnailMakerService(str(tmp_path), backend='fork')
+    with pytest.raises(ValueError):
+        ThumbnailMakerService(str(tmp_path), backend=BACKEND_THREAD,
+                              ingest='memory')
+    with pytest.raises(ValueError):
+        ThumbnailMakerService(str(tmp_path), backend=BACKEND_SERIAL,
+                              autoscale=True)
+    with pytest.raises(RuntimeError):
+        ThumbnailMakerService(str(tmp_path)).submit([])
+
+
+def test_metrics_are_aggregated_from_the_resize_processes(tmp_path):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), num_resizers=2)
+        service.make_thumbnails(server.urls())
+
+    snapshot = json.loads(service.metrics.to_json())
+    histograms, counters = snapshot['histograms'], snapshot['counters']
+    for stage in ('download', 'queue_wait', 'decode', 'resize_32',
+                  'resize_64', 'resize_200'):
+        assert histograms[stage]['count'] == 5, stage
+    assert histograms['encode']['count'] == histograms['write']['count'] == 15
+    assert counters['images'] == 5
+    assert counters['bytes_in'] == service.stats['dl_bytes']
+    assert counters['bytes_out'] == service.stats['thumbnail_bytes']
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_thumbnails_stream_in_completion_order(tmp_path, backend):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend=backend,
+                                        num_resizers=2)
+        stream = service.iter_thumbnails(server.urls(), timeout=30)
+        first = next(stream)
+        # the first image is out before the last one has been resized
+        assert service.running
+        results = [first] + list(stream)
+        assert not service.running
+
+    assert sorted(result.source for result in results) == \
+        sorted(server.urls())
+    assert [result.latency for result in results] == \
+        sorted(result.latency for result in results)
+    for result in results:
+        assert result.error is None
+        assert len(result.out_paths) == len(result.sizes) == 3
+        assert all(size > 0 for size in result.sizes)
+        assert result.timings['decode'] > 0
+    assert service.stats['thumbnails'] == 15
+
+
+@pytest.mark.parametrize('backend', [BACKEND_ASYNCIO, BACKEND_THREAD])
+def test_download_start_of_every_image(tmp_path, backend):
+    with LocalImageServer(IMAGES) as server:
+        service = ThumbnailMakerService(str(tmp_path), backend=backend)
+        service.start()
+        try:
+            batch = service.submit(server.urls())
+            batch.wait(30)
+        finally:
+            service.close()
+
+    assert sorted(batch.download_started) == \
+        sorted(result.filename for result in batch.stream)
+    for result in batch.stream:
+        started = batch.download_started[result.filename]
+        assert batch.created <= started < batch.created + result.latency
+
+
+@pytest.mark.parametrize('backend', [BACKEND_ASYNCIO, BACKEND_THREAD])
+def test_thumbnails_stream_to_an_async_iterator(tmp_path, backend):
+    service = ThumbnailMakerService(str(tmp_path), backend=backend)
+
+    async def collect(urls):
+        return [result async for result in service.aiter_thumbnails(urls)]
+
+    with LocalImageServer(IMAGES) as server:
+        urls = server.urls() + [server.url('/missing.jpg')]
+        results = asyncio.run(collect(urls))
+
+    assert sorted(result.filename for result in results) == \
+        ['img{}.jpg'.format(i) for i in range(5)]
+    assert service.stats['download_errors'] == 1
+    assert not service.running
+
+
+@pytest.mark.parametrize('backend', [BACKEND_THREAD, BACKEND_ASYNCIO,
+                                     'process'])
+def test_duplicates_are_downloaded_and_resized_once(tmp_path, backend):
+    images = {'/a/cat.jpg': IMAGES['/img0.jpg'],
+              '/b/cat.jpg': IMAGES['/img1.jpg'],
+              '/c/copy.jpg': IMAGES['/img0.jpg']}
+    with LocalImageServer(images) as server:
+        urls = server.urls() + [server.url('/a/./cat.jpg#top'),
+                                server.url('/a/cat.jpg').replace(
+                                    'http://', 'HTTP://')]
+        service = ThumbnailMakerService(str(tmp_path), backend=backend,
+                                        num_resizers=2, dedup=True)
+        results = list(service.iter_thumbnails(urls, timeout=30))
+        requested = sorted(path for path, _ in server.requests)
+
+    assert requested == ['/a/cat.jpg', '/b/cat.jpg', '/c/copy.jpg']
+    assert len(results) == 5
+    assert all(result.error is None for result in results)
+    by_source = {result.source: result for result in results}
+    assert sorted(by_source) == sorted(urls)
+    # the copy gets the thumbnails of whichever identical image came first
+    assert sorted(by_source[urls[0]].out_paths) == \
+        sorted(by_source[urls[2]].out_paths)
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 6
+    assert len(set(result.filename for result in results)) == 3
+    stats = service.stats
+    assert (stats['downloaded'], stats['coalesced'],
+            stats['duplicate_content'], stats['not_modified']) == (3, 2, 1, 0)
+
+
+def test_overlapping_batches_share_downloads(tmp_path):
+    with LocalImageServer(IMAGES, latency=0.2) as server:
+        url = server.url('/img0.jpg')
+        with ThumbnailMakerService(str(tmp_path), backend=BACKEND_THREAD,
+                                   persistent=True, dedup=True) as service:
+            first, second = service.submit([url]), service.submit([url])
+            assert [name for name, _ in first.wait(10)] == \
+                [name for name, _ in second.wait(10)]
+            # new url, known bytes: downloaded but not resized again
+            third = service.submit([server.url('/img0.jpg?copy')])
+            assert len(third.wait(10)) == 1
+        assert len(server.requests) == 2
+
+    assert second.stats['coalesced'] == 1
+    assert third.stats['duplicate_content'] == 1
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 3
+
+
+def test_known_content_is_resized_again_once_its_thumbnails_changed(tmp_path):
+    images = {'/a.jpg': IMAGES['/img0.jpg'], '/b.jpg': IMAGES['/img0.jpg']}
+    with LocalImageServer(images) as server:
+        with ThumbnailMakerService(str(tmp_path), backend=BACKEND_THREAD,
+                                   persistent=True, dedup=True) as service:
+            first = service.submit([server.url('/a.jpg')])
+            [(a_name, a_paths)] = first.wait(10)
+            # a's thumbnails now show other bytes than b's
+            server.images['/a.jpg'] = IMAGES['/img1.jpg']
+            assert len(service.submit([server.url('/a.jpg')]).wait(10)) == 1
+            [(b_name, b_paths)] = service.submit(
+                [server.url('/b.jpg')]).wait(10)
+            assert b_name != a_name and b_paths != a_paths
+
+            # and once they are gone
+            shutil.rmtree(str(tmp_path / 'outgoing'))
+            again = service.submit([server.url('/a.jpg')])
+            [(_, paths)] = again.wait(10)
+            assert all(os.path.exists(path) for path in paths)
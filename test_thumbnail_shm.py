@@ -0,0 +1,63 @@
+import io
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import pytest
+from PIL import Image
+
+from thumbnail_samples import make_sample_bytes
+from thumbnail_shm import SharedSource, ShmIngest
+from thumbnail_testserver import LocalImageServer
+
+BODY = make_sample_bytes(320, 240)
+
+
+class FakeResponse(io.BytesIO):
+    def __init__(self, body, headers):
+        super().__init__(body)
+        self.headers = headers
+
+
+def decode_in_worker(descriptor):
+    with SharedSource(descriptor) as source:
+        with Image.open(source) as img:
+            img.load()
+            return img.size
+
+
+@pytest.mark.parametrize('headers', [{'Content-Length': str(len(BODY))}, {}])
+def test_worker_decodes_from_segment_and_unlinks_it(headers):
+    ingest = ShmIngest()
+    descriptor = ingest.store(FakeResponse(BODY, headers), 'a.jpg')
+    assert descriptor[1:] == (0, len(BODY), 'a.jpg')
+
+    with multiprocessing.Pool(1) as pool:
+        assert pool.apply(decode_in_worker, (descriptor,)) == (320, 240)
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=descriptor[0])
+
+
+def test_cleanup_unlinks_unconsumed_segments():
+    ingest = ShmIngest()
+    descriptor = ingest.store(
+        FakeResponse(BODY, {'Content-Length': str(len(BODY))}), 'a.jpg')
+
+    ingest.cleanup()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=descriptor[0])
+
+
+def test_memory_ingest_never_touches_incoming(tmp_path):
+    from thumnbnail_multipro_queue import ThumbnailMakerService
+
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(320, 240, seed=i)
+              for i in range(4)}
+    with LocalImageServer(images) as server:
+        service = ThumbnailMakerService(str(tmp_path), ingest='memory')
+        service.make_thumbnails(server.urls())
+
+    assert os.listdir(str(tmp_path / 'incoming')) == []
+    assert len(os.listdir(str(tmp_path / 'outgoing'))) == 12
@@ -0,0 +1,141 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import threading
+
+from PIL import Image
+
+from thumbnail_samples import make_sample_bytes
+from thumbnail_service import ThumbnailMakerService
+from thumbnail_store import SegmentReader, SegmentStore
+from thumbnail_testserver import LocalImageServer
+
+
+def segments(store_dir):
+    return sorted(name for name in os.listdir(store_dir)
+                  if name.endswith('.seg'))
+
+
+def test_reader_serves_views_of_the_segments(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.put_many([('a_32.jpg', b'aaa'), ('a_64.jpg', b'bbbb')])
+    store.put('b_32.jpg', b'c' * 10)
+
+    with SegmentReader(str(tmp_path)) as reader:
+        view = reader.get('a_64.jpg')
+        assert isinstance(view, memoryview) and bytes(view) == b'bbbb'
+        assert bytes(reader.get('b_32.jpg')) == b'c' * 10
+        assert reader.get('missing.jpg') is None
+        view.release()
+    assert len(segments(str(tmp_path))) == 1
+    assert store.contains(['a_32.jpg', 'b_32.jpg'])
+    assert not store.contains(['a_32.jpg', 'missing.jpg'])
+    assert store.sizes(['a_32.jpg', 'missing.jpg']) == [3, 0]
+    store.close()
+
+
+def test_compaction_drops_overwritten_data(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_bytes=100)
+    for i in range(10):
+        store.put('key{}'.format(i % 3), bytes([i]) * 40)
+    # two thumbnails fit in a segment
+    before = segments(str(tmp_path))
+    assert len(before) == 5
+
+    busy = SegmentStore(str(tmp_path))
+    busy.put('other', b'x')
+    # three segments of garbage and one half garbage go, the ones still
+    # being written to stay
+    assert store.compact() == 4 * 80
+    after = segments(str(tmp_path))
+    assert len(set(before) - set(after)) == 4
+    assert busy._segment_name in after
+
+    with SegmentReader(str(tmp_path)) as reader:
+        for key, value in (('key0', 9), ('key1', 7), ('key2', 8)):
+            assert bytes(reader.get(key)) == bytes([value]) * 40
+        assert bytes(reader.get('other')) == b'x'
+    store.close()
+    busy.close()
+
+
+worker_store = None
+
+
+def init_worker(store):
+    global worker_store
+    worker_store = store
+
+
+def write_keys(worker):
+    for i in range(50):
+        worker_store.put('w{}-{}'.format(worker, i),
+                         '{}:{}'.format(worker, i).encode())
+    return os.getpid()
+
+
+def test_processes_append_to_segments_of_their_own(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    with multiprocessing.Pool(4, init_worker, (store,)) as pool:
+        pids = pool.map(write_keys, range(8), chunksize=1)
+
+    assert len(segments(str(tmp_path))) == len(set(pids))
+    with SegmentReader(str(tmp_path)) as reader:
+        for worker in range(8):
+            for i in range(50):
+                assert bytes(reader.get('w{}-{}'.format(worker, i))) == \
+                    '{}:{}'.format(worker, i).encode()
+
+
+@contextlib.contextmanager
+def holding(lock):
+    # lock stays held by another thread until the block is over
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with lock:
+            held.set()
+            release.wait()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        yield
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_a_child_forked_while_the_lock_is_held_can_write(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    init_worker(store)
+    child = multiprocessing.get_context('fork').Process(target=write_keys,
+                                                        args=(0,))
+    # another thread of the parent is half way through a put
+    with holding(store._lock):
+        child.start()
+        child.join(10)
+    if child.exitcode is None:
+        child.terminate()
+    assert child.exitcode == 0
+    with SegmentReader(str(tmp_path)) as reader:
+        assert bytes(reader.get('w0-49')) == b'0:49'
+
+
+def test_service_packs_thumbnails_into_the_store(tmp_path):
+    images = {'/img{}.jpg'.format(i): make_sample_bytes(160, 120, seed=i)
+              for i in range(5)}
+    store = SegmentStore(str(tmp_path / 'store'))
+    with LocalImageServer(images) as server:
+        service = ThumbnailMakerService(str(tmp_path), num_resizers=2,
+                                        store=store)
+        results = service.make_thumbnails(server.urls())
+
+    assert os.listdir(str(tmp_path / 'outgoing')) == []
+    keys = [key for _, out_paths in results for key in out_paths]
+    assert len(keys) == 15
+    assert service.stats['thumbnail_bytes'] == sum(store.sizes(keys))
+    with SegmentReader(store.store_dir) as reader:
+        with Image.open(io.BytesIO(reader.get('img0_200.jpg'))) as img:
+            assert img.size == (200, 150)
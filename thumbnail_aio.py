@@ -0,0 +1,248 @@
+# thumbnail_aio.py
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import aiofiles
+import aiohttp
+
+from thumbnail_exif import HEADER_BYTES, RANGE_HEADERS, usable_header
+from thumbnail_http import (DEFAULT_TIMEOUTS, LatencyTracker, RetryPolicy,
+                            conditional_headers)
+from thumbnail_journal import PART_SUFFIX
+from thumbnail_metrics import NO_METRICS
+
+# how many downloads run at the same time, also the size of the connection pool
+DEFAULT_CONCURRENCY = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class AsyncDownloader(object):
+    """Concurrent aiohttp downloader that streams bodies to the input dir.
+
+    At most `concurrency` downloads are in flight at once (0 per host limit
+    means no limit). Every finished file is handed to the on_downloaded
+    callback straight away, so resizing can start while the rest of the
+    batch is still downloading.
+    """
+
+    def __init__(self, input_dir, concurrency=DEFAULT_CONCURRENCY,
+                 limit_per_host=0, chunk_size=DEFAULT_CHUNK_SIZE,
+                 validators=None, have_thumbnails=None, metrics=NO_METRICS,
+                 backpressure=None, filename_for=None,
+                 timeouts=DEFAULT_TIMEOUTS, retry=None, hedge_quantile=None,
+                 latency=None, preview_targets=None, on_started=None):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.input_dir = input_dir
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.chunk_size = chunk_size
+        # optional thumbnail_http.ValidatorStore and a filename -> bool
+        # callable telling whether it's worth sending a conditional request
+        self.validators = validators
+        self.have_thumbnails = have_thumbnails
+        # gets the time of every completed download
+        self.metrics = metrics
+        # optional thumbnail_pool.Backpressure, a download only starts once
+        # it got a slot. whoever gets the file from on_downloaded binds the
+        # slot to it with backpressure.add()
+        self.backpressure = backpressure
+        # url -> name of the file in input_dir, the basename of the url path
+        # by default
+        self.filename_for = filename_for
+        # (connect, read) seconds, see thumbnail_http.open_url. retry is a
+        # thumbnail_http.RetryPolicy, None for the default one
+        self.timeouts = timeouts
+        self.retry = retry if retry is not None else RetryPolicy()
+        # a download slower than this quantile of the recent ones, as kept
+        # by the thumbnail_http.LatencyTracker latency, gets a second
+        # request and the first to finish wins. None never hedges
+        self.hedge_quantile = hedge_quantile
+        self.latency = latency if latency is not None else LatencyTracker()
+        # target sizes to make from the EXIF thumbnail of an image instead
+        # of downloading all of it, when it is wide enough. see
+        # thumbnail_exif. None always downloads the full image
+        self.preview_targets = preview_targets
+        # called with the url as a request for it goes out, after the wait
+        # for a slot. retries and hedges call it again
+        self.on_started = on_started
+
+    async def download_image(self, session, url, dl_sem):
+        if self.backpressure is None:
+            return await self._download_retried(session, url, dl_sem)
+        await self.backpressure.acquire_async()
+        try:
+            result = await self._download_retried(session, url, dl_sem)
+        except BaseException:
+            self.backpressure.cancel()
+            raise
+        if result is None:
+            self.backpressure.cancel()
+        return result
+
+    async def _download_retried(self, session, url, dl_sem):
+        for retry in range(self.retry.attempts):
+            try:
+                return await self._download_hedged(session, url, dl_sem)
+            except Exception as e:
+                if retry == self.retry.attempts - 1 or not \
+                        self.retry.retryable(e, (aiohttp.ClientError,)):
+                    raise
+                delay = self.retry.delay(retry)
+                logging.warning("downloading {} failed with {!r}, retrying "
+                                "in {:.3f} seconds".format(url, e, delay))
+            await asyncio.sleep(delay)
+
+    async def _download_hedged(self, session, url, dl_sem):
+        delay = None
+        if self.hedge_quantile is not None:
+            delay = self.latency.quantile(self.hedge_quantile)
+        if delay is None:
+            return await self._download_image(session, url, dl_sem)
+        # attempt -> suffix of the file it writes
+        suffixes = {}
+
+        def start(suffix):
+            attempt = asyncio.ensure_future(
+                self._download_image(session, url, dl_sem, suffix))
+            suffixes[attempt] = suffix
+            return attempt
+
+        attempts = [start('.hedge0')]
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done:
+            attempts.append(start('.hedge1'))
+        winner = None
+        pending = set(attempts)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in attempts:
+                if attempt in done and not attempt.exception():
+                    winner = attempt
+                    break
+        # the loser is cancelled and removes its own file, one that
+        # finished alongside the winner is removed here
+        for attempt in pending:
+            attempt.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for attempt in attempts:
+            if attempt is not winner and attempt.done() and \
+                    not attempt.cancelled() and not attempt.exception() and \
+                    attempt.result() is not None:
+                os.remove(self.input_dir + os.path.sep +
+                          attempt.result()[0] + suffixes[attempt])
+        if winner is None:
+            raise attempts[0].exception()
+        result = winner.result()
+        if result is not None:
+            img_filepath = self.input_dir + os.path.sep + result[0]
+            os.replace(img_filepath + suffixes[winner], img_filepath)
+        return result
+
+    async def _download_image(self, session, url, dl_sem, suffix=''):
+        # one attempt, the body goes to the file named suffix appended
+        if self.filename_for is not None:
+            img_filename = self.filename_for(url)
+        else:
+            img_filename = urlparse(url).path.split('/')[-1]
+        img_filepath = self.input_dir + os.path.sep + img_filename + suffix
+        # the body only gets its real name once it is complete
+        part_path = img_filepath + PART_SUFFIX
+
+        headers = {}
+        if self.validators is not None and \
+                (self.have_thumbnails is None or self.have_thumbnails(img_filename)):
+            headers = conditional_headers(self.validators.get(url))
+
+        async with dl_sem:
+            start = time.perf_counter()
+            if self.on_started is not None:
+                self.on_started(url)
+            data = None
+            if self.preview_targets is not None:
+                async with session.get(url, headers=dict(headers,
+                                                         **RANGE_HEADERS)) \
+                        as response:
+                    if response.status == 304:
+                        logging.info("image at url {} not modified".format(url))
+                        return None
+                    response.raise_for_status()
+                    try:
+                        data = await response.content.readexactly(HEADER_BYTES)
+                    except asyncio.IncompleteReadError as e:
+                        data = e.partial
+                    data = usable_header(response.status, response.headers,
+                                         data, self.preview_targets)
+                    if data is not None and self.validators is not None:
+                        self.validators.update(url, response.headers)
+            if data is not None:
+                try:
+                    async with aiofiles.open(part_path, 'wb') as f:
+                        await f.write(data)
+                    os.replace(part_path, img_filepath)
+                except BaseException:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                self.metrics.add('exif_previews')
+                elapsed = time.perf_counter() - start
+                self.metrics.observe('download', elapsed)
+                self.latency.add(elapsed)
+                return img_filename, len(data)
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    logging.info("image at url {} not modified".format(url))
+                    return None
+                response.raise_for_status()
+                # stream the body to disk chunk by chunk instead of
+                # buffering the whole image in memory
+                size = 0
+                try:
+                    async with aiofiles.open(part_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(
+                                self.chunk_size):
+                            await f.write(chunk)
+                            size += len(chunk)
+                    os.replace(part_path, img_filepath)
+                except BaseException:
+                    # failed or cancelled, don't leave half a body behind
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                if self.validators is not None:
+                    self.validators.update(url, response.headers)
+            elapsed = time.perf_counter() - start
+            self.metrics.observe('download', elapsed)
+            self.latency.add(elapsed)
+        return img_filename, size
+
+    async def download_images(self, img_url_list, on_downloaded,
+                              on_error=None):
+        # on_downloaded(img_filename, size) runs as soon as each file is written.
+        # without on_error(url, exc) the first failed download is raised
+        dl_sem = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.limit_per_host)
+
+        async def fetch(url):
+            try:
+                result = await self.download_image(session, url, dl_sem)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(url, e)
+                return
+            if result is not None:
+                on_downloaded(*result)
+
+        connect_timeout, read_timeout = self.timeouts
+        timeout = aiohttp.ClientTimeout(total=None,
+                                        sock_connect=connect_timeout,
+                                        sock_read=read_timeout)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout) as session:
+            await asyncio.gather(*[fetch(url) for url in img_url_list])
@@ -0,0 +1,215 @@
+# thumbnail_autoscale.py
+# grows and shrinks the download threads and resize processes of a running
+# service, instead of the fixed 4 threads and cpu_count() processes
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+# seconds between two scaling decisions
+DEFAULT_INTERVAL = 0.5
+# above this cpu utilization (0-1) more resize processes only add contention
+CPU_HIGH = 0.9
+# consecutive idle ticks before a stage is shrunk, so a short gap between
+# two batches doesn't tear down workers that are needed again right away
+IDLE_TICKS = 3
+# a stage that was grown by one has to finish this many times as many items
+# per second as before for the next step up, otherwise it stays at its size:
+# the bottleneck is elsewhere, e.g. the network or a per host limit
+MIN_GAIN = 1.1
+
+
+class CpuMonitor(object):
+    """System cpu utilization between two calls to utilization().
+
+    Reads the aggregate line of /proc/stat where there is one and falls back
+    to the 1 minute load average per cpu elsewhere.
+    """
+
+    def __init__(self):
+        self._last = self._read_stat()
+
+    @staticmethod
+    def _read_stat():
+        try:
+            with open('/proc/stat') as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle and iowait count as not busy
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        return sum(fields), idle
+
+    def utilization(self):
+        current = self._read_stat()
+        if current is None or self._last is None:
+            try:
+                load = os.getloadavg()[0]
+            except OSError:
+                return 0.0
+            return min(1.0, load / multiprocessing.cpu_count())
+        total = current[0] - self._last[0]
+        idle = current[1] - self._last[1]
+        self._last = current
+        if total <= 0:
+            return 0.0
+        return 1.0 - float(idle) / total
+
+
+class Sample(object):
+    """What the controller saw at one tick."""
+
+    def __init__(self, dl_backlog, resize_backlog, dl_rate, resize_rate, cpu):
+        # urls waiting or being downloaded
+        self.dl_backlog = dl_backlog
+        # images downloaded but not resized yet
+        self.resize_backlog = resize_backlog
+        # items finished per second since the last tick
+        self.dl_rate = dl_rate
+        self.resize_rate = resize_rate
+        self.cpu = cpu
+
+
+def growth_pays(idle, stage, size, rate):
+    # False while the last step up of stage brought less than MIN_GAIN
+    step = idle.get(stage + '_step')
+    if step is None:
+        return True
+    size_before, rate_before = step
+    if size <= size_before or rate >= rate_before * MIN_GAIN:
+        # shrunk since, or the step paid off
+        del idle[stage + '_step']
+        return True
+    return False
+
+
+def decide(sample, dl_threads, processes, dl_bounds, process_bounds,
+           idle, cpu_high=CPU_HIGH):
+    """Returns the (dl_threads, processes) to run for the next interval.
+
+    idle is a dict of consecutive idle ticks per stage, and of the size and
+    throughput of each stage before its last step up, updated in place.
+    """
+    min_dl, max_dl = dl_bounds
+    min_proc, max_proc = process_bounds
+    old_dl, old_processes = dl_threads, processes
+
+    # resize stage: cpu bound, only worth growing while there are idle cpus
+    # and the last process added made it faster
+    if sample.resize_backlog == 0:
+        idle['resize'] = idle.get('resize', 0) + 1
+        idle.pop('resize_step', None)
+    else:
+        idle['resize'] = 0
+    if sample.resize_backlog > processes and sample.cpu < cpu_high and \
+            growth_pays(idle, 'resize', processes, sample.resize_rate):
+        processes += 1
+    elif idle['resize'] >= IDLE_TICKS or sample.cpu >= cpu_high and \
+            sample.resize_backlog < processes:
+        processes -= 1
+
+    # download stage: i/o bound, grow while urls wait for a thread unless
+    # the resizers already can't keep up, more downloads would only pile up
+    if sample.dl_backlog == 0:
+        idle['download'] = idle.get('download', 0) + 1
+        idle.pop('download_step', None)
+    else:
+        idle['download'] = 0
+    resizers_behind = sample.resize_backlog > 2 * max(processes, 1)
+    if resizers_behind and (sample.cpu >= cpu_high or processes >= max_proc):
+        dl_threads -= 1
+    elif sample.dl_backlog > dl_threads and not resizers_behind:
+        if growth_pays(idle, 'download', dl_threads, sample.dl_rate):
+            dl_threads += 1
+    elif idle['download'] >= IDLE_TICKS:
+        dl_threads -= 1
+
+    dl_threads = max(min_dl, min(max_dl, dl_threads))
+    processes = max(min_proc, min(max_proc, processes))
+    # what a step up has to beat
+    if dl_threads > old_dl:
+        idle['download_step'] = (old_dl, sample.dl_rate)
+    if processes > old_processes:
+        idle['resize_step'] = (old_processes, sample.resize_rate)
+    return dl_threads, processes
+
+
+class AutoScaler(object):
+    """Background thread resizing the download and resize pools of a service.
+
+    Every interval it samples the backlog and throughput of both stages and
+    the cpu utilization, then applies decide(). Both pools stay within their
+    (min, max) bounds. decisions keeps the last (time, sample, dl, procs).
+    """
+
+    def __init__(self, dl_pool, resize_pool, dl_bounds=(1, 16),
+                 process_bounds=None, interval=DEFAULT_INTERVAL,
+                 cpu_high=CPU_HIGH):
+        self.dl_pool = dl_pool
+        self.resize_pool = resize_pool
+        self.dl_bounds = dl_bounds
+        self.process_bounds = process_bounds or \
+            (1, multiprocessing.cpu_count())
+        self.interval = interval
+        self.cpu_high = cpu_high
+        self.cpu = CpuMonitor()
+        self.decisions = []
+        self._idle = {}
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        now = time.monotonic()
+        dl_done = self.dl_pool.completed
+        resize_done = self.resize_pool.completed
+        dl_rate = resize_rate = 0.0
+        if self._last is not None:
+            elapsed = max(now - self._last[0], 1e-6)
+            dl_rate = (dl_done - self._last[1]) / elapsed
+            resize_rate = (resize_done - self._last[2]) / elapsed
+        self._last = (now, dl_done, resize_done)
+        return Sample(self.dl_pool.backlog(), self.resize_pool.backlog(),
+                      dl_rate, resize_rate, self.cpu.utilization())
+
+    def step(self):
+        sample = self.sample()
+        dl_threads = self.dl_pool.num_threads
+        processes = self.resize_pool.num_processes
+        new_dl, new_procs = decide(sample, dl_threads, processes,
+                                   self.dl_bounds, self.process_bounds,
+                                   self._idle, self.cpu_high)
+        if new_dl != dl_threads:
+            self.dl_pool.resize(new_dl)
+        if new_procs != processes:
+            self.resize_pool.resize(new_procs)
+        if (new_dl, new_procs) != (dl_threads, processes):
+            logging.info(
+                "autoscale: {} download threads, {} resize processes "
+                "(dl backlog {}, resize backlog {}, {:.1f} dl/s, "
+                "{:.1f} resized/s, cpu {:.0%})".format(
+                    new_dl, new_procs, sample.dl_backlog,
+                    sample.resize_backlog, sample.dl_rate,
+                    sample.resize_rate, sample.cpu))
+        self.decisions.append((time.time(), sample, new_dl, new_procs))
+        del self.decisions[:-100]
+        return new_dl, new_procs
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.step()
+            except RuntimeError:
+                # a pool was closed under us
+                break
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,176 @@
+# thumbnail_cache.py
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from thumbnail_journal import copy_atomic
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ThumbnailCache(object):
+    """On-disk thumbnail cache keyed by the source bytes and resize params.
+
+    Entries live in cache_dir/<key[:2]>/<key>/<basewidth><ext>. The index,
+    the LRU order and the hit/miss counters are kept in a sqlite database
+    next to them, which does the locking between resize processes and
+    threads, each with a connection of its own.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_path = cache_dir + os.path.sep + 'index.sqlite'
+        # connection and the pid it was opened in, per thread
+        self._local = threading.local()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # sqlite connections can't cross process boundaries, every worker
+        # opens its own on first use
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _db(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=60,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters ("
+                         "name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('misses', 0)")
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def make_key(self, source, params):
+        # source is a path or a seekable binary file object
+        h = hashlib.sha256()
+        if hasattr(source, 'read'):
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+            source.seek(0)
+        else:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    h.update(chunk)
+        h.update(repr(params).encode('utf-8'))
+        return h.hexdigest()
+
+    def _entry_dir(self, key):
+        return self.cache_dir + os.path.sep + key[:2] + os.path.sep + key
+
+    def _entry_file(self, key, basewidth, out_path):
+        return self._entry_dir(key) + os.path.sep + \
+            str(basewidth) + os.path.splitext(out_path)[1]
+
+    def get(self, key, targets):
+        # targets is a list of (basewidth, out_path). on a hit every stored
+        # thumbnail is copied to its out_path and True is returned
+        conn = self._db()
+        damaged = False
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT key FROM entries WHERE key = ?",
+                               (key,)).fetchone()
+            hit = row is not None
+            if hit:
+                # copy while holding the lock so eviction can't remove the
+                # entry half way through
+                try:
+                    for basewidth, out_path in targets:
+                        copy_atomic(
+                            self._entry_file(key, basewidth, out_path), out_path)
+                except OSError:
+                    logging.warning("cache entry {} is damaged".format(key))
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    damaged = True
+                    hit = False
+                else:
+                    conn.execute("UPDATE entries SET last_used = ? "
+                                 "WHERE key = ?", (time.time(), key))
+            conn.execute("UPDATE counters SET value = value + 1 "
+                         "WHERE name = ?", ('hits' if hit else 'misses',))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if damaged:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        return hit
+
+    def put(self, key, targets):
+        entry_dir = self._entry_dir(key)
+        # stage the files in a private dir and rename it into place, so other
+        # processes never see a half written entry
+        tmp_dir = self.cache_dir + os.path.sep + 'tmp-' + uuid.uuid4().hex
+        os.makedirs(tmp_dir)
+        size = 0
+        for basewidth, out_path in targets:
+            tmp_file = tmp_dir + os.path.sep + \
+                str(basewidth) + os.path.splitext(out_path)[1]
+            shutil.copyfile(out_path, tmp_file)
+            size += os.path.getsize(tmp_file)
+
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another worker stored the same content first, keep theirs
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._db().execute(
+            "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)",
+            (key, size, time.time()))
+        self.evict()
+
+    def evict(self):
+        conn = self._db()
+        evicted = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in conn.execute(
+                        "SELECT key, size FROM entries "
+                        "ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append(key)
+                    total -= size
+                conn.executemany("DELETE FROM entries WHERE key = ?",
+                                 [(key,) for key in evicted])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # the rows are gone, so no reader will touch these dirs any more
+        for key in evicted:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        if evicted:
+            logging.info("evicted {} cache entries".format(len(evicted)))
+
+    def stats(self):
+        conn = self._db()
+        counters = dict(conn.execute("SELECT name, value FROM counters"))
+        entries, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'hits': counters['hits'], 'misses': counters['misses'],
+                'entries': entries, 'bytes': total}
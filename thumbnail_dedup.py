@@ -0,0 +1,292 @@
+# thumbnail_dedup.py
+# deduplication for ThumbnailMakerService(dedup=True):
+#   - urls are normalised, so trivially different spellings count as one
+#   - concurrent requests for the same url share one download and resize
+#   - downloads with identical bytes are resized once, every requester gets
+#     the thumbnails of the first one
+#   - file names carry a hash of the url, two urls with the same basename
+#     no longer overwrite each other in incoming/ and outgoing/
+# a Deduplicator holds what the batches of a service share, each batch
+# keeps its own bookkeeping in a BatchDedup
+import collections
+import functools
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import threading
+from multiprocessing import shared_memory
+from urllib.parse import urlsplit, urlunsplit
+
+from thumbnail_shm import SharedSource
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# content digests remembered after their resize finished
+MAX_REMEMBERED = 65536
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                       '0123456789-._~')
+
+# what a Coalescer hands to the callers that waited on the first one
+RESIZED = 'resized'
+NOT_MODIFIED = 'not_modified'
+FAILED = 'failed'
+
+
+def normalize_url(url):
+    # lowercases scheme and host, drops the default port and the fragment,
+    # resolves dot segments and spells percent escapes the same way. the
+    # query is kept as is, parameter order can matter to the server
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        # ipv6 literal
+        netloc = '[' + netloc + ']'
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += ':' + parts.password
+        netloc = userinfo + '@' + netloc
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ':' + str(parts.port)
+    path = parts.path or '/'
+    trailing = path.endswith('/')
+    path = posixpath.normpath(path)
+    if path.startswith('//'):
+        path = '/' + path.lstrip('/')
+    if trailing and path != '/':
+        path += '/'
+    path = re.sub('%[0-9a-fA-F]{2}', _normalize_escape, path)
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def _normalize_escape(match):
+    # %7E -> ~, %2f -> %2F. escaped reserved characters stay escaped, they
+    # mean something else than the bare character
+    char = chr(int(match.group(0)[1:], 16))
+    return char if char in UNRESERVED else match.group(0).upper()
+
+
+def unique_filename(url):
+    # cat.jpg from two hosts becomes cat-<hash>.jpg with different hashes,
+    # the same normalised url always gets the same name
+    basename = urlsplit(url).path.split('/')[-1]
+    name, ext = os.path.splitext(basename)
+    digest = hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+    return '{}-{}{}'.format(name or 'image', digest[:12], ext)
+
+
+def content_digest(item):
+    # sha256 of a downloaded item, a path or a shared memory descriptor
+    h = hashlib.sha256()
+    if isinstance(item, tuple):
+        name, offset, length, _ = item
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            with shm.buf[offset:offset + length] as view:
+                h.update(view)
+        finally:
+            shm.close()
+    else:
+        with open(item, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def discard_item(item):
+    # drops a downloaded item that won't be resized
+    if isinstance(item, tuple):
+        # unlinked on exit
+        with SharedSource(item):
+            pass
+    else:
+        os.remove(item)
+
+
+class Coalescer(object):
+    """Lets the first caller for a key do the work, the others wait for it.
+
+    join() tells the first caller to go ahead. Every later caller gets the
+    outcome passed to complete(), as soon as it is there. With remember > 0
+    that many completed keys are kept and answered straight away, outcomes
+    other than RESIZED are never kept so the work is retried. A kept outcome
+    for which valid(key, outcome) is False is dropped and the caller goes
+    first, as if it had never been kept.
+    """
+
+    def __init__(self, remember=0, valid=None):
+        self.remember = remember
+        self.valid = valid
+        self._lock = threading.Lock()
+        # key -> callbacks of the callers waiting on it
+        self._waiting = {}
+        # key -> outcome, least recently used first
+        self._done = collections.OrderedDict()
+
+    def join(self, key, follower):
+        # True for the first caller. follower() runs for the others, under
+        # the lock so nobody can complete the key in between, and returns
+        # the callback to give the outcome to
+        with self._lock:
+            if key in self._done and self.valid is not None and \
+                    not self.valid(key, self._done[key]):
+                del self._done[key]
+            if key in self._done:
+                self._done.move_to_end(key)
+                outcome = self._done[key]
+                callback = follower()
+            elif key in self._waiting:
+                self._waiting[key].append(follower())
+                return False
+            else:
+                self._waiting[key] = []
+                return True
+        callback(outcome)
+        return False
+
+    def complete(self, key, outcome):
+        with self._lock:
+            callbacks = self._waiting.pop(key, [])
+            if self.remember and outcome[0] == RESIZED and outcome[2] is None:
+                self._done[key] = outcome
+                if len(self._done) > self.remember:
+                    self._done.popitem(last=False)
+        for callback in callbacks:
+            callback(outcome)
+
+
+class Deduplicator(object):
+    """What every batch of a service shares: the urls being downloaded and
+    the contents being resized or resized already.
+
+    A remembered resize is only reused while its thumbnails exist and no
+    other content was resized into them since.
+    """
+
+    def __init__(self, resizer, remember=MAX_REMEMBERED):
+        self.resizer = resizer
+        self.url_requests = Coalescer()
+        self.contents = Coalescer(remember, valid=self._thumbnails_still_of)
+        # tuple of output paths -> (digest, filename) of the content they
+        # are, or are being, resized from
+        self._thumbnail_contents = collections.OrderedDict()
+        self.remember = remember
+        self._lock = threading.Lock()
+
+    def _thumbnails_still_of(self, digest, outcome):
+        with self._lock:
+            owner = self._thumbnail_contents.get(tuple(outcome[1]))
+        return owner is not None and owner[0] == digest and \
+            self.resizer.outputs_exist(owner[1])
+
+    def resizing(self, filename, digest):
+        # called before filename may be resized from digest
+        key = tuple(self.resizer.output_paths(filename))
+        with self._lock:
+            self._thumbnail_contents[key] = (digest, filename)
+            self._thumbnail_contents.move_to_end(key)
+            if len(self._thumbnail_contents) > self.remember:
+                self._thumbnail_contents.popitem(last=False)
+
+    def batch(self, batch):
+        return BatchDedup(self, batch)
+
+
+class BatchDedup(object):
+    """Dedup bookkeeping of one thumbnail_pool.ResizeBatch.
+
+    The downloader asks join() before downloading a url and downloaded()
+    before resizing a download, and reports failed() downloads. finish()
+    settles the urls left once the downloads are over, they answered 304.
+    resized() takes every result of the batch, the batch.on_result hook.
+    A result another batch produces for us arrives through the batch's
+    expect() and add_result(), or discard() when there is none.
+    """
+
+    def __init__(self, dedup, batch):
+        self.dedup = dedup
+        self.batch = batch
+        # filename -> (url key, content digest) of the images this batch
+        # resizes on behalf of everyone asking for them
+        self.leading = {}
+        # url keys joined first and not settled yet
+        self.unsettled = set()
+        self._lock = threading.Lock()
+
+    def join(self, url, filename):
+        # True if this batch downloads url, otherwise it gets the outcome
+        # of whoever does
+        url_key = normalize_url(url)
+        if self.dedup.url_requests.join(
+                url_key, lambda: self._follower(filename, url)):
+            with self._lock:
+                self.unsettled.add(url_key)
+            return True
+        return False
+
+    def downloaded(self, item, filename):
+        # True if this batch resizes item. False if the same bytes are
+        # resized already, the caller discards item and the thumbnails of
+        # the first come in as the result
+        source = self.batch.sources[filename]
+        url_key = normalize_url(source)
+        with self._lock:
+            self.unsettled.discard(url_key)
+        digest = content_digest(item)
+        # before joining, so nobody reuses what these thumbnails held until
+        # now once they are about to be overwritten
+        self.dedup.resizing(filename, digest)
+        if self.dedup.contents.join(
+                digest, lambda: self._follower(filename, source, url_key)):
+            with self._lock:
+                self.leading[filename] = (url_key, digest)
+            return True
+        return False
+
+    def failed(self, url, error):
+        self.settle(normalize_url(url), (FAILED, None, error))
+
+    def finish(self):
+        for url_key in list(self.unsettled):
+            self.settle(url_key, (NOT_MODIFIED, None, None))
+
+    def settle(self, url_key, outcome):
+        with self._lock:
+            self.unsettled.discard(url_key)
+        self.dedup.url_requests.complete(url_key, outcome)
+
+    def resized(self, result):
+        with self._lock:
+            keys = self.leading.pop(result.filename, None)
+        if keys is not None:
+            url_key, digest = keys
+            outcome = (RESIZED, result.out_paths, result.error)
+            self.dedup.contents.complete(digest, outcome)
+            self.dedup.url_requests.complete(url_key, outcome)
+
+    def _follower(self, filename, source, url_key=None):
+        # the batch waits for a result another request produces, returns
+        # the callback that hands it the outcome
+        self.batch.expect()
+        return functools.partial(self._deliver, filename, source, url_key)
+
+    def _deliver(self, filename, source, url_key, outcome):
+        kind, out_paths, error = outcome
+        try:
+            if kind == RESIZED:
+                self.batch.add_result(filename, out_paths, error,
+                                      source=source)
+            else:
+                self.batch.discard()
+        except Exception as e:
+            # the expect() must be settled whatever happens, e.g.
+            # thumbnails removed in the meantime
+            logging.exception("delivering {} failed".format(filename))
+            self.batch.add_result(filename, None, repr(e), source=source)
+        if url_key is not None:
+            # our download turned out to be a duplicate, whoever waits on
+            # its url gets the same thumbnails
+            self.dedup.url_requests.complete(url_key, outcome)
@@ -0,0 +1,140 @@
+# thumbnail_encode.py
+# how each thumbnail is encoded. by default a thumbnail keeps the format of
+# its source with Pillow's default settings, an EncoderProfile picks the
+# format, quality, progressive/optimize, chroma subsampling and whether
+# metadata is kept, per target size if need be
+
+# extension of the output file for every format a profile can force
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+class EncoderProfile(object):
+    """Encoder settings for one thumbnail size.
+
+    format=None keeps the format of the source, the other options are only
+    passed to the encoders that understand them.
+    """
+
+    def __init__(self, format=None, quality=None, progressive=False,
+                 optimize=False, strip_metadata=True, subsampling=None,
+                 method=None):
+        if format is not None:
+            format = format.upper()
+            if format not in EXTENSIONS:
+                raise ValueError("unknown output format {!r}".format(format))
+        self.format = format
+        # JPEG 1-95, WebP 0-100
+        self.quality = quality
+        # JPEG only
+        self.progressive = progressive
+        # JPEG and PNG, an extra pass for smaller files
+        self.optimize = optimize
+        # leave EXIF and the ICC profile of the source out of the thumbnail,
+        # False copies both over, None leaves it to the encoder like a plain
+        # img.save() does: PNG keeps the ICC profile, JPEG drops both
+        self.strip_metadata = strip_metadata
+        # JPEG chroma subsampling, '4:4:4', '4:2:2' or '4:2:0'
+        self.subsampling = subsampling
+        # WebP effort 0 (fast) to 6 (small)
+        self.method = method
+
+    def __repr__(self):
+        # also part of the cache key, see ThumbnailResizer.cache_params
+        return ('EncoderProfile(format={!r}, quality={!r}, progressive={!r}, '
+                'optimize={!r}, strip_metadata={!r}, subsampling={!r}, '
+                'method={!r})'.format(
+                    self.format, self.quality, self.progressive,
+                    self.optimize, self.strip_metadata, self.subsampling,
+                    self.method))
+
+    def __eq__(self, other):
+        return isinstance(other, EncoderProfile) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def output_format(self, source_format):
+        return self.format or source_format
+
+    def extension(self, source_ext):
+        # extension of the thumbnail of a source with extension source_ext
+        if self.format is None:
+            return source_ext
+        return EXTENSIONS[self.format]
+
+    def encode(self, img, fp, source_format):
+        # writes img to the binary file object fp
+        fmt = self.output_format(source_format)
+        img = convert_for_format(img, fmt)
+        options = {}
+        if self.quality is not None and fmt in ('JPEG', 'WEBP'):
+            options['quality'] = self.quality
+        if self.optimize and fmt in ('JPEG', 'PNG'):
+            options['optimize'] = True
+        if fmt == 'JPEG':
+            if self.progressive:
+                options['progressive'] = True
+            if self.subsampling is not None:
+                options['subsampling'] = self.subsampling
+        if fmt == 'WEBP' and self.method is not None:
+            options['method'] = self.method
+        # resize() carries the source's info over to the thumbnail. some
+        # encoders, like PNG's, write what is in there unless told otherwise
+        if self.strip_metadata:
+            options.update(exif=b'', icc_profile=None)
+        elif self.strip_metadata is not None:
+            for key in ('exif', 'icc_profile'):
+                if img.info.get(key):
+                    options[key] = img.info[key]
+        img.save(fp, fmt, **options)
+
+
+def convert_for_format(img, fmt):
+    # JPEG has no alpha and no palette, WebP only takes RGB and RGBA
+    if fmt == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+        return img.convert('RGB')
+    if fmt == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in img.mode or 'transparency' in img.info
+        return img.convert('RGBA' if has_alpha else 'RGB')
+    return img
+
+
+# what thumbnails were always encoded with, the presets strip metadata
+DEFAULT_PROFILE = EncoderProfile(strip_metadata=None)
+
+PROFILES = {
+    'default': DEFAULT_PROFILE,
+    'jpeg': EncoderProfile('JPEG', quality=75, optimize=True,
+                           subsampling='4:2:0'),
+    'jpeg-progressive': EncoderProfile('JPEG', quality=75, progressive=True,
+                                       optimize=True, subsampling='4:2:0'),
+    'webp': EncoderProfile('WEBP', quality=80, method=4),
+    'png': EncoderProfile('PNG', optimize=True),
+}
+
+# tiny thumbnails hide compression artifacts well, spend the bytes on the
+# largest one
+CDN_PROFILES = {
+    32: EncoderProfile('WEBP', quality=60, method=4),
+    64: EncoderProfile('WEBP', quality=70, method=4),
+    200: EncoderProfile('JPEG', quality=75, progressive=True, optimize=True,
+                        subsampling='4:2:0'),
+}
+PROFILES['cdn'] = CDN_PROFILES
+
+
+def profiles_for_targets(profiles, target_sizes):
+    # profiles is None, a preset name from PROFILES, one EncoderProfile for
+    # every size or a dict of basewidth -> EncoderProfile, sizes missing
+    # from the dict keep the default. returns one profile per target size
+    if profiles is None:
+        profiles = DEFAULT_PROFILE
+    if isinstance(profiles, str):
+        if profiles not in PROFILES:
+            raise ValueError("unknown encoder profile {!r}".format(profiles))
+        profiles = PROFILES[profiles]
+    if isinstance(profiles, EncoderProfile):
+        return [profiles for _ in target_sizes]
+    return [profiles.get(basewidth, DEFAULT_PROFILE)
+            for basewidth in target_sizes]
+
@@ -0,0 +1,107 @@
+# thumbnail_exif.py
+# fast path for camera JPEGs: most carry a thumbnail of about 160x120 in
+# their EXIF block, which comes before the image data. a Range request for
+# the first HEADER_BYTES brings it in, and when it is at least as wide as
+# every target the thumbnails are made from it without the full download
+import io
+import logging
+
+from PIL import ExifTags, Image
+
+from thumbnail_http import DEFAULT_TIMEOUTS, open_url
+
+# an EXIF block is at most 64KiB, plus the small JFIF header before it
+HEADER_BYTES = 68 * 1024
+RANGE_HEADERS = {'Range': 'bytes=0-{}'.format(HEADER_BYTES - 1)}
+# IFD1 tags of the embedded JPEG, offset from the TIFF header and length
+JPEG_INTERCHANGE_FORMAT = 0x0201
+JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+# a preview whose aspect ratio is further off than this from the image's is
+# letterboxed or cropped, thumbnails made from it would be too
+MAX_ASPECT_ERROR = 0.02
+
+
+def embedded_preview(header):
+    # ((width, height) of the image, bytes of the embedded JPEG) or None.
+    # header is the start of the file, the image data needn't be in it
+    try:
+        with Image.open(io.BytesIO(header)) as img:
+            if img.format != 'JPEG':
+                return None
+            size = img.size
+            raw = img.info.get('exif')
+            ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    except Exception as e:
+        # cut off before the image size, or a broken EXIF block
+        logging.debug("no EXIF preview: {!r}".format(e))
+        return None
+    offset = ifd1.get(JPEG_INTERCHANGE_FORMAT)
+    length = ifd1.get(JPEG_INTERCHANGE_FORMAT_LENGTH)
+    if not raw or offset is None or not length:
+        return None
+    # offsets count from the TIFF header, after b'Exif\0\0'
+    start = len(b'Exif\0\0') + offset
+    preview = raw[start:start + length]
+    if len(preview) < length:
+        return None
+    return size, preview
+
+
+def preview_for_targets(header, target_sizes):
+    # the embedded preview if every target width can be made from it
+    # without upscaling, None when the full image is needed
+    found = embedded_preview(header)
+    if found is None:
+        return None
+    (width, height), preview = found
+    try:
+        with Image.open(io.BytesIO(preview)) as img:
+            img.load()
+            preview_width, preview_height = img.size
+    except Exception as e:
+        logging.debug("broken EXIF preview: {!r}".format(e))
+        return None
+    if preview_width < max(target_sizes) or preview_width > width:
+        return None
+    aspect = width / float(height)
+    if abs(preview_width / float(preview_height) - aspect) > \
+            MAX_ASPECT_ERROR * aspect:
+        return None
+    return preview
+
+
+def is_whole_file(status, headers, data):
+    # True if data, the answer to a RANGE_HEADERS request, is all of the file
+    if status == 206:
+        total = headers.get('Content-Range', '').rpartition('/')[2]
+        return total.isdigit() and int(total) <= len(data)
+    # the server ignored the Range header
+    return len(data) < HEADER_BYTES
+
+
+def usable_header(status, headers, data, target_sizes):
+    # what to resize instead of the full download: the file if data is all
+    # of it, or its embedded preview. None when the full image is needed
+    if is_whole_file(status, headers, data):
+        return data
+    return preview_for_targets(data, target_sizes)
+
+
+def fetch_header(url, validators=None, conditional=True,
+                 timeouts=DEFAULT_TIMEOUTS, pool=None):
+    # the first HEADER_BYTES of url, see open_url for the arguments. None
+    # if the server answered 304, otherwise (status, headers, data)
+    response = open_url(url, validators, conditional, timeouts, pool,
+                        RANGE_HEADERS)
+    if response is None:
+        return None
+    with response:
+        # a server that ignores the Range header sends everything, the rest
+        # goes with the connection
+        data = b''
+        while len(data) < HEADER_BYTES:
+            chunk = response.read(HEADER_BYTES - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return response.status, response.headers, data
@@ -0,0 +1,470 @@
+# thumbnail_fleet.py
+# resizing on other machines. the coordinator, a FleetResizePool in the
+# service, starts a multiprocessing manager that serves a work queue and a
+# results queue over TCP. workers connect to it with the shared authkey,
+# lease a few tasks at a time, resize them and put the thumbnails on the
+# results queue, which the coordinator writes to outgoing/ or its store.
+# images and thumbnails travel as bytes, workers need no shared disk.
+#
+# a worker heartbeats while it works. one that misses HEARTBEAT_TIMEOUT
+# worth of them is taken for dead and its leased tasks go back to the
+# front of the queue. a task finished twice that way is routed once, one
+# that took MAX_REQUEUES + 1 workers down with it is routed as an error.
+#
+# start workers on every node with
+#   THUMBNAIL_FLEET_AUTHKEY=... python thumbnail_fleet.py host:port \
+#       --processes 8
+# the authkey is what keeps strangers out: whoever has it can make the
+# workers and the coordinator unpickle anything
+import argparse
+import collections
+import copy
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from thumbnail_journal import RESIZED, write_atomic
+from thumbnail_logging import configure_logging
+from thumbnail_metrics import Metrics
+from thumbnail_pool import BatchPool
+from thumbnail_shm import SharedSource
+
+DEFAULT_ADDRESS = ('127.0.0.1', 50000)
+AUTHKEY_ENV = 'THUMBNAIL_FLEET_AUTHKEY'
+# seconds between heartbeats, and without one before a worker counts as dead
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 5.0
+# tasks a worker leases at a time, and how long it waits for them
+LEASE_SIZE = 4
+LEASE_WAIT = 1.0
+# how often the coordinator looks for dead workers
+REAP_INTERVAL = 1.0
+# times a task goes back after its worker died, the next death fails it:
+# an image that crashes the decoder would take down worker after worker
+MAX_REQUEUES = 2
+# seconds a worker started from the command line waits before connecting
+# again to a coordinator that went away
+RECONNECT_DELAY = 2.0
+
+
+class WorkQueue(object):
+    """The fleet's tasks, kept in the manager process.
+
+    A task is (task_id, batch_id, filename, data). lease() hands tasks out
+    and remembers which worker has them until it reports them done(), or
+    reap() decides it is dead and puts them back in front of the queue.
+    A task put back max_requeues times is failed instead, the error goes to
+    the results like the outcome of any other task.
+    """
+
+    def __init__(self, results, max_requeues=MAX_REQUEUES):
+        self.results = results
+        self.max_requeues = max_requeues
+        self._cond = threading.Condition()
+        self._tasks = collections.deque()
+        # worker id -> {task_id: task} of the tasks it leased
+        self._leases = {}
+        # worker id -> time.monotonic() it was last heard from
+        self._seen = {}
+        # task_id -> times it was put back after its worker died
+        self._requeues = {}
+        self._resizer = None
+        self._closed = False
+
+    def configure(self, resizer):
+        self._resizer = resizer
+
+    def resizer(self):
+        return self._resizer
+
+    def put(self, task):
+        with self._cond:
+            self._tasks.append(task)
+            self._cond.notify()
+
+    def lease(self, worker_id, max_items, timeout):
+        # up to max_items tasks, [] if none came within timeout, None once
+        # the queue is closed
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._seen[worker_id] = time.monotonic()
+                leased = self._leases.setdefault(worker_id, {})
+                if self._closed:
+                    return None
+                if self._tasks:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            tasks = [self._tasks.popleft()
+                     for _ in range(min(max_items, len(self._tasks)))]
+            leased.update((task[0], task) for task in tasks)
+            return tasks
+
+    def heartbeat(self, worker_id):
+        # False once the queue is closed
+        with self._cond:
+            self._seen[worker_id] = time.monotonic()
+            self._leases.setdefault(worker_id, {})
+            return not self._closed
+
+    def done(self, worker_id, results):
+        with self._cond:
+            leased = self._leases.get(worker_id, {})
+            for result in results:
+                leased.pop(result[0], None)
+                self._requeues.pop(result[0], None)
+        self.results.put((worker_id, results))
+
+    def reap(self, timeout):
+        # puts the tasks of workers not heard from in timeout seconds back
+        # and forgets them. returns (worker id, tasks put back) of each
+        now = time.monotonic()
+        with self._cond:
+            dead = [worker_id for worker_id, seen in self._seen.items()
+                    if now - seen > timeout]
+            return [(worker_id, self._drop(worker_id, died=True))
+                    for worker_id in dead]
+
+    def leave(self, worker_id):
+        # a worker that shuts down on its own
+        with self._cond:
+            return self._drop(worker_id)
+
+    def _drop(self, worker_id, died=False):
+        # called with _cond held, returns the number of tasks put back
+        self._seen.pop(worker_id, None)
+        tasks = sorted(self._leases.pop(worker_id, {}).values())
+        failed = []
+        if died:
+            requeued = []
+            for task in tasks:
+                requeues = self._requeues.pop(task[0], 0)
+                if requeues < self.max_requeues:
+                    self._requeues[task[0]] = requeues + 1
+                    requeued.append(task)
+                else:
+                    failed.append(task)
+            tasks = requeued
+        self._tasks.extendleft(reversed(tasks))
+        self._cond.notify_all()
+        if failed:
+            error = "{} fleet workers died resizing it".format(
+                self.max_requeues + 1)
+            self.results.put((worker_id, [
+                (task_id, batch_id, filename, None, error, None)
+                for task_id, batch_id, filename, _ in failed]))
+        return len(tasks)
+
+    def workers(self):
+        with self._cond:
+            return sorted(self._seen)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# created in the manager process on first use
+_state = {}
+
+
+def _fleet_state():
+    if not _state:
+        _state['results'] = queue.Queue()
+        _state['work'] = WorkQueue(_state['results'])
+    return _state
+
+
+def _get_work():
+    return _fleet_state()['work']
+
+
+def _get_results():
+    return _fleet_state()['results']
+
+
+class FleetServer(BaseManager):
+    pass
+
+
+FleetServer.register('get_work', callable=_get_work)
+FleetServer.register('get_results', callable=_get_results)
+
+
+class FleetClient(BaseManager):
+    pass
+
+
+FleetClient.register('get_work')
+FleetClient.register('get_results')
+
+
+def connect(address, authkey):
+    # proxies of the coordinator's work queue and results queue. raises
+    # multiprocessing.AuthenticationError for a wrong authkey
+    manager = FleetClient(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_work(), manager.get_results()
+
+
+class ThumbnailBuffer(object):
+    """Stands in for a store on a worker, keeps the encoded thumbnails."""
+
+    def __init__(self):
+        self._items = {}
+
+    def put_many(self, items):
+        self._items.update((key, bytes(data)) for key, data in items)
+
+    def take(self, keys):
+        return [(key, self._items.pop(key)) for key in keys]
+
+
+def worker_resizer(resizer):
+    # the coordinator's resizer as the workers get it, encoding into memory
+    remote = copy.copy(resizer)
+    remote.store = ThumbnailBuffer()
+    remote.cache = None
+    remote.mmap_input = False
+    # the thumbnails are only in place once the coordinator saved them
+    remote.journal = None
+    return remote
+
+
+def resize_remote(resizer, task):
+    # the result tuple of one task, the thumbnails as (name, bytes)
+    task_id, batch_id, filename, data = task
+    metrics = Metrics()
+    metrics.add('images')
+    try:
+        keys = resizer.resize_source(io.BytesIO(data), filename, metrics)
+        return (task_id, batch_id, filename, resizer.store.take(keys), None,
+                metrics)
+    except Exception as e:
+        logging.exception("resizing {} failed".format(filename))
+        return task_id, batch_id, filename, None, repr(e), metrics
+
+
+def run_worker(address, authkey, worker_id=None, lease_size=LEASE_SIZE,
+               heartbeat_interval=HEARTBEAT_INTERVAL):
+    # resizes tasks of the coordinator at address until it closes the queue
+    # or goes away
+    if worker_id is None:
+        worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+    work, results = connect(address, authkey)
+    resizer = work.resizer()
+    stopped = threading.Event()
+
+    def heartbeat():
+        # proxies keep a connection per thread, this one doesn't wait
+        # behind a long lease
+        try:
+            while not stopped.wait(heartbeat_interval):
+                if not work.heartbeat(worker_id):
+                    break
+        except (EOFError, OSError):
+            pass
+
+    beats = threading.Thread(target=heartbeat, daemon=True)
+    beats.start()
+    logging.info("fleet worker {} connected to {}".format(worker_id, address))
+    try:
+        while True:
+            tasks = work.lease(worker_id, lease_size, LEASE_WAIT)
+            if tasks is None:
+                break
+            if tasks:
+                work.done(worker_id,
+                          [resize_remote(resizer, task) for task in tasks])
+    except (EOFError, OSError) as e:
+        logging.warning("fleet worker {} lost the coordinator: {!r}".format(
+            worker_id, e))
+        return
+    finally:
+        stopped.set()
+    try:
+        work.leave(worker_id)
+    except (EOFError, OSError):
+        pass
+    logging.info("fleet worker {} done".format(worker_id))
+
+
+def serve(address, authkey, lease_size=LEASE_SIZE):
+    # run_worker over and over, a coordinator restarts between batches
+    # unless its service is persistent
+    while True:
+        try:
+            run_worker(address, authkey, lease_size=lease_size)
+        except (EOFError, OSError) as e:
+            logging.info("no fleet coordinator at {}: {!r}".format(address, e))
+        time.sleep(RECONNECT_DELAY)
+
+
+class FleetResizePool(BatchPool):
+    """Resize workers on other machines, connected over TCP.
+
+    Starts the manager that serves the work queue at address, with port 0
+    picking a free one, see self.address. Workers join and leave at any
+    time with run_worker() or the command line of this module, so resize()
+    can't start any and num_processes counts the connected ones.
+    """
+
+    def __init__(self, resizer, address=DEFAULT_ADDRESS, authkey=None,
+                 metrics=None, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        if not authkey:
+            raise ValueError("the fleet needs an authkey")
+        if resizer.cache is not None:
+            raise ValueError("the thumbnail cache only works with local "
+                             "resizers")
+        super().__init__(resizer, metrics)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.manager = FleetServer(address=address, authkey=authkey)
+        self.manager.start()
+        self.address = self.manager.address
+        self.work = self.manager.get_work()
+        self.results = self.manager.get_results()
+        self.work.configure(worker_resizer(resizer))
+        self._task_ids = itertools.count()
+        # task_id -> (batch_id, path of the downloaded file or None)
+        self._pending = {}
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        logging.info("fleet coordinator listening on {}".format(self.address))
+
+    @property
+    def num_processes(self):
+        return len(self.work.workers())
+
+    def resize(self, num_processes):
+        # workers come and go on their own
+        pass
+
+    def dispatch(self, batch_id, item):
+        if isinstance(item, tuple):
+            with SharedSource(item) as source:
+                data = source.read()
+            filename, path = item[3], None
+        else:
+            with open(item, 'rb') as f:
+                data = f.read()
+            filename, path = os.path.basename(item), item
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = (batch_id, path)
+        self.work.put((task_id, batch_id, filename, data))
+
+    def _collect(self):
+        last_reap = time.monotonic()
+        while True:
+            if time.monotonic() - last_reap > REAP_INTERVAL:
+                self._reap()
+                last_reap = time.monotonic()
+            try:
+                message = self.results.get(True, REAP_INTERVAL)
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            _, results = message
+            for result in results:
+                self._finish(*result)
+
+    def _reap(self):
+        for worker_id, requeued in self.work.reap(self.heartbeat_timeout):
+            logging.error("fleet worker {} missed its heartbeats, {} tasks "
+                          "put back".format(worker_id, requeued))
+
+    def _finish(self, task_id, batch_id, filename, thumbnails, error,
+                metrics):
+        with self._lock:
+            pending = self._pending.pop(task_id, None)
+        if pending is None:
+            # finished by the worker it was put back for as well
+            return
+        out_paths = None
+        if error is None:
+            try:
+                out_paths = self._save(thumbnails)
+            except Exception as e:
+                logging.exception("saving thumbnails of {} failed".format(
+                    filename))
+                error = repr(e)
+            else:
+                if self.resizer.journal is not None:
+                    self.resizer.journal.record(RESIZED, filename)
+        if pending[1] is not None:
+            os.remove(pending[1])
+        self.route(batch_id, filename, out_paths, error, metrics)
+
+    def _save(self, thumbnails):
+        if self.resizer.store is not None:
+            self.resizer.store.put_many(thumbnails)
+            return [key for key, _ in thumbnails]
+        out_paths = []
+        for name, data in thumbnails:
+            out_path = self.resizer.output_dir + os.path.sep + name
+            write_atomic(out_path, data)
+            out_paths.append(out_path)
+        return out_paths
+
+    def close(self):
+        # tasks no worker finished yet are dropped
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.work.close()
+        self.results.put(None)
+        self._collector.join()
+        self.manager.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="resize worker of a thumbnail fleet, the authkey comes "
+                    "from ${}".format(AUTHKEY_ENV))
+    parser.add_argument('address', help="host:port of the coordinator")
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--lease-size', type=int, default=LEASE_SIZE,
+                        help="tasks a worker takes at a time")
+    args = parser.parse_args()
+
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        parser.error("set {} to the coordinator's authkey".format(AUTHKEY_ENV))
+    host, _, port = args.address.rpartition(':')
+    address = (host, int(port))
+    workers = [multiprocessing.Process(target=serve,
+                                       args=(address, authkey.encode(),
+                                             args.lease_size))
+               for _ in range(args.processes)]
+    for p in workers:
+        p.start()
+    # a plain kill takes the worker processes down too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for p in workers:
+            p.join()
+    except (KeyboardInterrupt, SystemExit):
+        for p in workers:
+            p.terminate()
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
@@ -0,0 +1,496 @@
+# thumbnail_http.py
+import collections
+import functools
+import http.client
+import json
+import logging
+import os
+import io
+import random
+import select
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+COPY_CHUNK_SIZE = 64 * 1024
+# seconds to wait for the connection, and for each read once connected
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_TIMEOUTS = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+# answers worth asking again for, everything else 4xx is final
+RETRYABLE_STATUS = frozenset([408, 429, 500, 502, 503, 504])
+REDIRECT_STATUS = frozenset([301, 302, 303, 307, 308])
+MAX_REDIRECTS = 5
+# what is left of a body is read rather than dropping the connection, if
+# it is this short
+DRAIN_LIMIT = 64 * 1024
+USER_AGENT = 'thumbnail-maker'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class ValidatorStore(object):
+    """Per-URL HTTP validators (ETag, Last-Modified, Content-Length).
+
+    Persisted as json next to incoming/ so the next run can send
+    conditional requests. Safe to update from several download threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self._validators = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._validators = {}
+
+    def get(self, url):
+        with self._lock:
+            return self._validators.get(url)
+
+    def update(self, url, headers):
+        validators = {'etag': headers.get('ETag'),
+                      'last_modified': headers.get('Last-Modified'),
+                      'content_length': headers.get('Content-Length')}
+        with self._lock:
+            if validators['etag'] or validators['last_modified']:
+                self._validators[url] = validators
+            else:
+                self._validators.pop(url, None)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._validators, indent=1, sort_keys=True)
+        # write to a temp file and rename so a crash never leaves half a file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def conditional_headers(validators):
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+class RetryPolicy(object):
+    """How often and how patiently a failed download is tried again.
+
+    Waits a random time between 0 and min(max_backoff, backoff * 2 ** n)
+    before retry n ("full jitter"), so clients that failed together don't
+    come back together. Only timeouts, connection errors and the statuses
+    in RETRYABLE_STATUS are retried.
+    """
+
+    def __init__(self, attempts=3, backoff=0.1, max_backoff=5.0, rng=None):
+        if attempts < 1:
+            raise ValueError("attempts must be at least 1")
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rng = rng or random.Random()
+
+    def delay(self, retry):
+        return self.rng.uniform(0, min(self.max_backoff,
+                                       self.backoff * 2 ** retry))
+
+    def retryable(self, exc, extra=()):
+        # extra are more exception classes to retry, e.g. aiohttp's
+        status = getattr(exc, 'status', None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS
+        return isinstance(exc, (OSError, http.client.HTTPException) + extra)
+
+    def run(self, fn, *args):
+        # calls fn(*args) until it returns or fails for good
+        for retry in range(self.attempts):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if retry == self.attempts - 1 or not self.retryable(e):
+                    raise
+                delay = self.delay(retry)
+                logging.warning("attempt {} failed with {!r}, retrying in "
+                                "{:.3f} seconds".format(retry + 1, e, delay))
+            time.sleep(delay)
+
+
+# one attempt, no retries
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+class LatencyTracker(object):
+    """Latencies of the last `window` requests, for the hedging delay."""
+
+    def __init__(self, window=256, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q):
+        # None until there are min_samples to go on
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def hedged_call(first, second, delay, discard):
+    # runs first() on a thread of its own. if it hasn't finished after delay
+    # seconds second() is started too, and whichever returns first wins.
+    # the loser's result goes to discard() whenever it comes in. an error
+    # only counts once both have failed, then the first error is raised
+    cond = threading.Condition()
+    outcomes = []
+    state = {'winner': None}
+
+    def run(index, fn):
+        try:
+            outcome = (index, fn(), None)
+        except Exception as e:
+            outcome = (index, None, e)
+        with cond:
+            outcomes.append(outcome)
+            lost = state['winner'] is not None
+            cond.notify_all()
+        if lost and outcome[2] is None:
+            discard(outcome[1])
+
+    def settled():
+        # called with cond held
+        ok = [outcome for outcome in outcomes if outcome[2] is None]
+        if ok:
+            state['winner'] = ok[0]
+        elif len(outcomes) == started[0]:
+            state['winner'] = min(outcomes)
+        return state['winner'] is not None
+
+    started = [1]
+    threading.Thread(target=run, args=(0, first), daemon=True).start()
+    with cond:
+        cond.wait_for(settled, delay)
+        if state['winner'] is None:
+            started[0] = 2
+            threading.Thread(target=run, args=(1, second),
+                             daemon=True).start()
+            cond.wait_for(settled)
+        index, result, error = state['winner']
+        # discard whatever finished alongside the winner
+        losers = [outcome for outcome in outcomes
+                  if outcome[0] != index and outcome[2] is None]
+    for _, loser, _ in losers:
+        discard(loser)
+    if error is not None:
+        raise error
+    return result
+
+
+class TimeoutHTTPConnection(http.client.HTTPConnection):
+    # timeout is the connect timeout, read_timeout applies to every read
+    def __init__(self, *args, read_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        self.sock.settimeout(self.read_timeout)
+
+
+class TimeoutHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, read_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        self.sock.settimeout(self.read_timeout)
+
+
+class TimeoutHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, read_timeout):
+        super().__init__()
+        self.read_timeout = read_timeout
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(
+            TimeoutHTTPConnection, read_timeout=self.read_timeout), req)
+
+
+class TimeoutHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, read_timeout):
+        super().__init__()
+        self.read_timeout = read_timeout
+
+    def https_open(self, req):
+        return self.do_open(functools.partial(
+            TimeoutHTTPSConnection, read_timeout=self.read_timeout), req,
+            context=self._context)
+
+
+class PooledResponse(object):
+    """A response on a ConnectionPool connection.
+
+    Reads like the response urllib returns. close() gives the connection
+    back to the pool, for the next request to the host if the body was read
+    to the end and the server keeps the connection open.
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = self.code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def readinto(self, b):
+        return self._response.readinto(b)
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self._conn is None:
+            return
+        response = self._response
+        reusable = not response.will_close
+        if reusable and not response.isclosed():
+            # a 304, or an error page nobody read
+            if response.length is not None and response.length <= DRAIN_LIMIT:
+                try:
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    reusable = False
+            else:
+                reusable = False
+        response.close()
+        conn, self._conn = self._conn, None
+        self._pool.release(self._key, conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections per host, shared by download threads.
+
+    request() reuses an idle connection to the host of the url or opens a
+    new one, at most max_per_host per host at a time, 0 means no limit.
+    Callers wait for a connection when the host is at its limit. Every
+    request after the first to a host skips the TCP and TLS handshakes.
+    """
+
+    def __init__(self, max_per_host=0, timeouts=DEFAULT_TIMEOUTS,
+                 context=None):
+        self.max_per_host = max_per_host
+        self.timeouts = timeouts
+        # ssl context for https, None for the default one
+        self.context = context
+        self._cond = threading.Condition()
+        # (scheme, host, port) -> idle connections, most recently used last
+        self._idle = collections.defaultdict(list)
+        # (scheme, host, port) -> connections handed out
+        self._busy = collections.Counter()
+        # connections opened so far
+        self.opened = 0
+
+    def _connect(self, key, timeouts):
+        scheme, host, port = key
+        connect_timeout, read_timeout = timeouts
+        if scheme == 'https':
+            return TimeoutHTTPSConnection(host, port, timeout=connect_timeout,
+                                          read_timeout=read_timeout,
+                                          context=self.context)
+        return TimeoutHTTPConnection(host, port, timeout=connect_timeout,
+                                     read_timeout=read_timeout)
+
+    def acquire(self, key, timeouts):
+        # an idle connection to the host, or a new one. waits while the
+        # host has max_per_host connections in use
+        dropped = []
+        with self._cond:
+            while True:
+                conn = self._take_idle(key, dropped)
+                if conn is not None or not self.max_per_host or \
+                        self._busy[key] < self.max_per_host:
+                    break
+                self._cond.wait()
+            self._busy[key] += 1
+            if conn is None:
+                self.opened += 1
+        for old in dropped:
+            old.close()
+        if conn is None:
+            return self._connect(key, timeouts)
+        # the timeouts of this request, not the one that opened it
+        conn.timeout, conn.read_timeout = timeouts
+        conn.sock.settimeout(conn.read_timeout)
+        return conn
+
+    def _take_idle(self, key, dropped):
+        # called with _cond held
+        idle = self._idle[key]
+        while idle:
+            conn = idle.pop()
+            if not connection_dropped(conn):
+                return conn
+            dropped.append(conn)
+        return None
+
+    def release(self, key, conn, reusable):
+        with self._cond:
+            self._busy[key] -= 1
+            if reusable and conn.sock is not None:
+                self._idle[key].append(conn)
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            conn.close()
+
+    def request(self, url, headers=None, timeouts=None):
+        # GET url, following redirects. returns a PooledResponse whatever
+        # the status, close it to give the connection back
+        timeouts = timeouts or self.timeouts
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers, timeouts)
+            location = response.getheader('Location')
+            if response.status not in REDIRECT_STATUS or not location:
+                return response
+            response.close()
+            url = urljoin(url, location)
+        return response
+
+    def _request(self, url, headers, timeouts):
+        parts = urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS:
+            raise urllib.error.URLError(
+                "unsupported scheme {!r}".format(parts.scheme))
+        key = (parts.scheme, parts.hostname,
+               parts.port or DEFAULT_PORTS[parts.scheme])
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', USER_AGENT)
+        conn = self.acquire(key, timeouts)
+        try:
+            conn.request('GET', target, headers=headers)
+            response = conn.getresponse()
+        except BaseException:
+            self.release(key, conn, False)
+            raise
+        return PooledResponse(self, key, conn, response, url)
+
+    def close(self):
+        # closes the idle connections, the pool can still be used after
+        with self._cond:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+
+def connection_dropped(conn):
+    # an idle keep-alive connection only turns readable when the server
+    # closed it, or sent something it shouldn't have
+    if conn.sock is None:
+        return True
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+    return bool(readable)
+
+
+_openers = {}
+_openers_lock = threading.Lock()
+
+
+def opener_for(read_timeout):
+    # openers are thread safe, one per read timeout is enough
+    with _openers_lock:
+        opener = _openers.get(read_timeout)
+        if opener is None:
+            opener = urllib.request.build_opener(
+                TimeoutHTTPHandler(read_timeout),
+                TimeoutHTTPSHandler(read_timeout))
+            _openers[read_timeout] = opener
+        return opener
+
+
+def open_url(url, validators=None, conditional=True,
+             timeouts=DEFAULT_TIMEOUTS, pool=None, extra_headers=None):
+    # returns the response, or None if the server answered 304 Not Modified.
+    # validators is a ValidatorStore or None. pass conditional=False to skip
+    # the conditional headers, e.g. when the old thumbnails are gone.
+    # timeouts is (connect, read) in seconds, None waits forever. pool is a
+    # ConnectionPool to reuse connections from, None opens one per request
+    headers = dict(extra_headers or {})
+    if validators is not None and conditional:
+        headers.update(conditional_headers(validators.get(url)))
+    if pool is not None:
+        return _open_pooled(pool, url, headers, timeouts)
+    request = urllib.request.Request(url, headers=headers)
+    connect_timeout, read_timeout = timeouts
+    try:
+        return opener_for(read_timeout).open(request, timeout=connect_timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            e.close()
+            return None
+        raise
+
+
+def _open_pooled(pool, url, headers, timeouts):
+    # same answers and errors as the urllib path
+    response = pool.request(url, headers, timeouts)
+    if response.status == 304:
+        response.close()
+        return None
+    if response.status >= 400:
+        # read the error page here, so the connection goes back to the pool
+        # even if nobody closes the error
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        raise urllib.error.HTTPError(response.url, response.status,
+                                     response.reason, response.headers,
+                                     io.BytesIO(body))
+    return response
+
+
+def download_file(url, dest_path, validators=None, conditional=True,
+                  timeouts=DEFAULT_TIMEOUTS, pool=None):
+    # returns False on 304, in which case nothing is written. the
+    # validators are refreshed from every full response
+    response = open_url(url, validators, conditional, timeouts, pool)
+    if response is None:
+        return False
+
+    with response, open(dest_path, 'wb') as f:
+        shutil.copyfileobj(response, f, COPY_CHUNK_SIZE)
+        if validators is not None:
+            validators.update(url, response.headers)
+    return True
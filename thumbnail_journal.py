@@ -0,0 +1,171 @@
+# thumbnail_journal.py
+# crash safety for long runs. the journal is an append-only file of json
+# lines, one per state change of an image, keyed by its file name:
+#   queued      its url is part of a batch
+#   downloaded  its body is complete in incoming/
+#   resized     all of its thumbnails are in place
+#   committed   its batch handed the result to the caller
+# downloads and thumbnails are written under a temporary name and renamed,
+# so a file that exists under its real name is complete.
+# make_thumbnails(..., resume=True) replays the journal and skips whatever
+# a run that died already did
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+import weakref
+
+QUEUED = 'queued'
+DOWNLOADED = 'downloaded'
+RESIZED = 'resized'
+COMMITTED = 'committed'
+# the states in which the thumbnails of an image exist
+DONE = (RESIZED, COMMITTED)
+# where a download sits until it is complete
+PART_SUFFIX = '.part'
+
+# every Journal of this process, a forked child gets fresh locks for them:
+# the one it inherits may have been held by another thread of the parent
+_journals = weakref.WeakSet()
+
+
+def _after_fork():
+    for journal in list(_journals):
+        journal._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def temp_path(path):
+    # unique, so concurrent writers of one path don't share a temp file
+    return '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+
+
+def write_atomic(path, data):
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def copy_atomic(src, dst):
+    tmp_path = temp_path(dst)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Journal(object):
+    """Append-only log of per-image state, shared by the resize processes.
+
+    Every record goes out in a single write() to a file opened with
+    O_APPEND, so records of different processes never interleave and a
+    crash loses at most the line being written, which load() skips.
+    fsync=True also makes every record survive a power loss, at the price
+    of an fsync each. Can be pickled into resize workers.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._fd = None
+        self._pid = None
+        # file name -> its records merged, oldest first, once load() ran
+        self._latest = None
+        self._lock = threading.Lock()
+        _journals.add(self)
+
+    def __getstate__(self):
+        # the descriptor stays with the process that opened it
+        state = self.__dict__.copy()
+        state.update(_fd=None, _pid=None, _latest=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        _journals.add(self)
+
+    def record(self, state, filename, **fields):
+        entry = dict(fields, state=state, file=filename)
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: the parent's descriptor isn't ours to share
+                self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND |
+                                   os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+                # a line torn by a crash would swallow our first record
+                size = os.fstat(self._fd).st_size
+                if size and os.pread(self._fd, 1, size - 1) != b'\n':
+                    os.write(self._fd, b'\n')
+            os.write(self._fd, line)
+            if self.fsync:
+                os.fsync(self._fd)
+            if self._latest is not None:
+                self._merge(entry)
+
+    def _merge(self, entry):
+        # later fields win, a queued record keeps the size of an older
+        # download and so on
+        merged = self._latest.setdefault(entry['file'], {})
+        merged.update(entry)
+
+    def load(self):
+        # reads the whole journal, from then on latest() is kept up to date
+        # with the records of this process
+        latest = {}
+        self._latest = latest
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return latest
+        with f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    # two processes both ended the same torn line
+                    continue
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # torn by a crash half way through a write
+                    logging.warning("skipping damaged line {} of {}".format(
+                        number, self.path))
+                    continue
+                self._merge(entry)
+        return latest
+
+    def latest(self, filename):
+        # the merged records of filename, None if it was never recorded
+        with self._lock:
+            if self._latest is None:
+                self.load()
+            return self._latest.get(filename)
+
+    def compact(self):
+        # rewrites the journal with one line per image. only while nothing
+        # else writes to it: appends to the old file would be lost
+        latest = self.load()
+        data = ''.join(json.dumps(entry, sort_keys=True) + '\n'
+                       for entry in latest.values())
+        self.close()
+        write_atomic(self.path, data.encode('utf-8'))
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+            self._pid = None
@@ -0,0 +1,166 @@
+# thumbnail_logging.py
+# logging setup shared by every module, in place of each module calling
+# logging.basicConfig(filename='logfile.log', level=logging.DEBUG).
+# configured from the environment, no code edits needed:
+#   THUMBNAIL_LOG_LEVEL=INFO    any logging level name, DEBUG by default
+#   THUMBNAIL_LOG_QUEUE=1       workers only enqueue records, one listener
+#                               thread in the parent writes them in batches
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+
+LOG_FILE = 'logfile.log'
+LOG_FORMAT = '%(levelname)s:%(name)s:%(processName)s:%(message)s'
+# records buffered by the listener before one write to the file
+BATCH_SIZE = 256
+# seconds an idle listener waits before writing what it has buffered
+FLUSH_INTERVAL = 0.5
+
+_lock = threading.Lock()
+_configured = False
+_log_queue = None
+_listener = None
+
+
+class BatchingFileHandler(logging.FileHandler):
+    """FileHandler that collects formatted records and writes them at once.
+
+    Flushes when BATCH_SIZE records are buffered, on any record of level
+    ERROR or above, and whenever flush() is called.
+    """
+
+    def __init__(self, filename, batch_size=BATCH_SIZE):
+        super().__init__(filename)
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.batch_size or \
+                record.levelno >= logging.ERROR:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer and self.stream is not None:
+                self.stream.write(''.join(self.buffer))
+                self.stream.flush()
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class LogListener(object):
+    """Thread draining a log queue into a handler, like QueueListener.
+
+    Unlike QueueListener it flushes the handler whenever the queue has been
+    idle for flush_interval, so batched records don't sit in the buffer.
+    """
+
+    def __init__(self, log_queue, handler, flush_interval=FLUSH_INTERVAL):
+        self.log_queue = log_queue
+        self.handler = handler
+        self.flush_interval = flush_interval
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                record = self.log_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.handler.flush()
+                continue
+            if record is None:
+                break
+            if record.levelno >= self.handler.level:
+                self.handler.handle(record)
+        self.handler.flush()
+
+    def stop(self):
+        if self._thread is not None:
+            self.log_queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+def log_level():
+    name = os.environ.get('THUMBNAIL_LOG_LEVEL', 'DEBUG').upper()
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        raise ValueError("unknown THUMBNAIL_LOG_LEVEL {!r}".format(name))
+    return level
+
+
+def queued_logging():
+    return os.environ.get('THUMBNAIL_LOG_QUEUE', '') not in ('', '0')
+
+
+def configure_logging(filename=LOG_FILE, level=None, queued=None):
+    # idempotent, the first call wins like logging.basicConfig. level and
+    # queued default to THUMBNAIL_LOG_LEVEL and THUMBNAIL_LOG_QUEUE
+    global _configured, _log_queue, _listener
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+        if level is None:
+            level = log_level()
+        if queued is None:
+            queued = queued_logging()
+        root = logging.getLogger()
+        root.setLevel(level)
+        if not queued:
+            logging.basicConfig(filename=filename, level=level,
+                                format=LOG_FORMAT)
+            return
+        if multiprocessing.parent_process() is not None:
+            # a spawned worker importing us, its pool hands it the parent's
+            # queue through install_queue_handler() instead
+            return
+        handler = BatchingFileHandler(filename)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _log_queue = multiprocessing.Queue()
+        _listener = LogListener(_log_queue, handler).start()
+        root.addHandler(logging.handlers.QueueHandler(_log_queue))
+        atexit.register(stop_logging)
+
+
+def log_queue():
+    # what a pool passes to its worker processes, None unless queued
+    return _log_queue
+
+
+def install_queue_handler(worker_queue, level=None):
+    # called first thing in a worker process. forked workers inherit the
+    # parent's QueueHandler already, spawned ones start without any
+    if worker_queue is None:
+        return
+    root = logging.getLogger()
+    if not any(isinstance(h, logging.handlers.QueueHandler)
+               for h in root.handlers):
+        root.addHandler(logging.handlers.QueueHandler(worker_queue))
+    root.setLevel(level if level is not None else log_level())
+
+
+def stop_logging():
+    # writes out whatever is still buffered, called at exit
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.handler.close()
+        _listener = None
@@ -0,0 +1,162 @@
+# thumbnail_metrics.py
+# per-stage latency histograms and byte counters. resize workers fill a
+# small Metrics per image and add it up locally, every chunk of results
+# goes back to the parent with the sum of its Metrics, which the parent
+# merges into the service's Metrics once per chunk
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bound of bucket 0 in seconds, every next bucket doubles it
+BUCKET_BASE = 1e-5
+# bucket 30 is about 3 hours, anything slower lands there too
+MAX_BUCKET = 30
+
+
+def bucket_index(value):
+    if value <= BUCKET_BASE:
+        return 0
+    return min(MAX_BUCKET, int(math.ceil(math.log2(value / BUCKET_BASE))))
+
+
+def bucket_bound(index):
+    return BUCKET_BASE * 2 ** index
+
+
+class Histogram(object):
+    """Log2 bucketed latency histogram, only the buckets in use are stored."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+
+    def percentile(self, pct):
+        # upper bound of the bucket holding the rank, capped at the real max
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(pct / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'min': self.min or 0.0,
+                'max': self.max or 0.0,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'buckets': [[bucket_bound(index), self.buckets[index]]
+                            for index in sorted(self.buckets)]}
+
+
+class Metrics(object):
+    """Named latency histograms (seconds) and counters, thread-safe.
+
+    Stages recorded by the service: download, queue_wait, decode,
+    resize_<width> for every target, encode and write. Counters: bytes_in,
+    bytes_out, images and cache_hits. Picklable, so a worker can send its
+    Metrics back to the parent for merge().
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def merge(self, other):
+        with self._lock:
+            for name, histogram in other.histograms.items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].merge(histogram)
+            for name, n in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def timings(self):
+        # seconds spent in each stage, as ThumbnailResult.timings
+        with self._lock:
+            return {name: histogram.sum
+                    for name, histogram in self.histograms.items()}
+
+    def snapshot(self):
+        with self._lock:
+            return {'histograms': {name: histogram.snapshot()
+                                   for name, histogram in self.histograms.items()},
+                    'counters': dict(self.counters)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+
+class NullMetrics(object):
+    """Stands in for Metrics where nobody is collecting."""
+
+    def observe(self, name, seconds):
+        pass
+
+    def add(self, name, n=1):
+        pass
+
+    @contextmanager
+    def time(self, name):
+        yield
+
+
+NO_METRICS = NullMetrics()
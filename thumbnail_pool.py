@@ -0,0 +1,800 @@
+# thumbnail_pool.py
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from thumbnail_logging import install_queue_handler, log_queue
+from thumbnail_metrics import Metrics, NO_METRICS
+from thumbnail_shm import SharedSource
+
+# how often the collector thread checks for dead workers
+WORKER_CHECK_INTERVAL = 1.0
+# resize processes get tasks, and send results back, in chunks. a self-tuned
+# chunk holds about this many seconds of work, so the pickling and the pipe
+# round trip of a message are small next to the work it carries
+CHUNK_SECONDS = 0.02
+MAX_CHUNKSIZE = 256
+# chunk size until the first chunk came back with a measured cost
+INITIAL_CHUNKSIZE = 8
+# seconds a partly filled chunk waits for more items before it is sent
+CHUNK_LINGER = 0.005
+# weight of the newest chunk in the running per-item cost
+COST_SMOOTHING = 0.3
+
+
+def resize_item(resizer, item, metrics=NO_METRICS):
+    # item is either the path of a downloaded file, which is removed once
+    # resized, or a shared memory descriptor from thumbnail_shm
+    metrics.add('images')
+    if isinstance(item, tuple):
+        with SharedSource(item) as source:
+            return item[3], resizer.resize_source(source, item[3], metrics)
+    out_paths = resizer.resize_image(item, metrics=metrics)
+    os.remove(item)
+    return os.path.basename(item), out_paths
+
+
+def resize_task(resizer, batch_id, item, enqueued):
+    # resizes one item, returns the result tuple a pool routes to its batch.
+    # the per-task Metrics goes back with it, enqueued is a time.time()
+    metrics = Metrics()
+    if enqueued is not None:
+        metrics.observe('queue_wait', max(0.0, time.time() - enqueued))
+    try:
+        logging.debug("resizing image {}".format(item))
+        filename, out_paths = resize_item(resizer, item, metrics)
+        logging.debug("done resizing image {}".format(filename))
+        return batch_id, filename, out_paths, None, metrics
+    except Exception as e:
+        logging.exception("resizing {} failed".format(item))
+        filename = item[3] if isinstance(item, tuple) else \
+            os.path.basename(item)
+        return batch_id, filename, None, repr(e), metrics
+
+
+def resize_worker(resizer, task_queue, result_queue, worker_log_queue=None,
+                  current=None):
+    # loop of every long-lived resize process, a None task stops it. tasks
+    # come in (chunk_id, tasks) chunks, the id of the one being resized is
+    # kept in current, a shared value the parent reads if the process dies,
+    # -1 while the worker holds no chunk.
+    # each chunk goes back as one (chunk_id, results, seconds, metrics):
+    # the Metrics of its items are summed up here, in the worker,
+    # and every result only carries the stage timings of its image. the
+    # parent merges a Metrics per chunk instead of one per image, and as it
+    # arrives with the results its totals are exact once they are routed
+    install_queue_handler(worker_log_queue)
+    while True:
+        chunk = task_queue.get()
+        if chunk is None:
+            break
+        chunk_id, tasks = chunk
+        if current is not None:
+            current.value = chunk_id
+        start = time.perf_counter()
+        chunk_metrics = Metrics()
+        results = []
+        for task in tasks:
+            batch_id, filename, out_paths, error, metrics = \
+                resize_task(resizer, *task)
+            chunk_metrics.merge(metrics)
+            results.append((batch_id, filename, out_paths, error, None,
+                            metrics.timings()))
+        result_queue.put((chunk_id, results, time.perf_counter() - start,
+                          chunk_metrics))
+        if current is not None:
+            # the results are out, a death from here on doesn't lose them
+            current.value = -1
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def wake_waiters(waiters):
+    # resolves the (loop, future) pairs of coroutines waiting on another thread
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_wake, future)
+        except RuntimeError:
+            # that loop is closed already
+            pass
+
+
+class ThumbnailResult(object):
+    """One finished image, as streamed by a ResizeBatch."""
+
+    def __init__(self, filename, out_paths, error, latency, timings,
+                 source=None, sizes=None):
+        # source is the url the image came from, when the service knows it
+        self.source = source
+        self.filename = filename
+        self.out_paths = out_paths or []
+        self.error = error
+        # bytes of every output, in the order of out_paths
+        if sizes is None:
+            sizes = [os.path.getsize(path) for path in self.out_paths]
+        self.sizes = sizes
+        # seconds from the creation of the batch to this result
+        self.latency = latency
+        # seconds spent in each stage on this image, see thumbnail_metrics
+        self.timings = timings
+
+    def __repr__(self):
+        return 'ThumbnailResult({!r}, {} outputs, error={!r})'.format(
+            self.filename, len(self.out_paths), self.error)
+
+
+class ResizeBatch(object):
+    """Handle of one batch submitted to a ResizeWorkerPool.
+
+    Iterating it, with for or async for, yields a ThumbnailResult per image
+    in completion order as soon as that image is done, and stops once the
+    batch is. Any number of iterators can run at once, each sees every
+    result.
+    """
+
+    def __init__(self, pool, batch_id, on_done=None):
+        self.pool = pool
+        self.batch_id = batch_id
+        self.results = []
+        self.errors = []
+        # seconds from the creation of the batch to each result
+        self.latencies = []
+        # every ThumbnailResult so far, in completion order
+        self.stream = []
+        # filename -> url, filled in by whoever downloads the images
+        self.sources = {}
+        # filename -> time.perf_counter() when the first request for it
+        # went out, also filled in by the downloader
+        self.download_started = {}
+        # called with every ThumbnailResult as it is added, if set
+        self.on_result = None
+        self.created = time.perf_counter()
+        self._on_done = on_done
+        self._pending = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # (loop, future) of the async iterators waiting for the next result
+        self._waiters = []
+        self._done = threading.Event()
+
+    def submit(self, item):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("batch {} is closed".format(self.batch_id))
+            self._pending += 1
+        self.pool.put_task(self.batch_id, item)
+
+    def expect(self):
+        # holds the batch open for one result that won't come from the
+        # pool, add_result() or discard() settles it
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("batch {} is closed".format(self.batch_id))
+            self._pending += 1
+
+    def discard(self):
+        # settles an expect() that ended without a result
+        with self._lock:
+            self._pending -= 1
+        self._check_done()
+
+    def close(self):
+        # no more items will be submitted, the batch is done once the
+        # ones in flight are resized
+        with self._lock:
+            self._closed = True
+        self._check_done()
+
+    def add_result(self, filename, out_paths, error, timings=None,
+                   source=None):
+        # timings as returned by Metrics.timings()
+        if timings is None:
+            timings = {}
+        sizes = self.pool.resizer.output_sizes(out_paths or [])
+        if source is None:
+            source = self.sources.get(filename)
+        result = ThumbnailResult(filename, out_paths, error, None, timings,
+                                 source, sizes)
+        with self._lock:
+            # taken under the lock so latencies grow in stream order
+            result.latency = time.perf_counter() - self.created
+            self._pending -= 1
+            self.latencies.append(result.latency)
+            if error is None:
+                self.results.append((filename, out_paths))
+            else:
+                self.errors.append((filename, error))
+            self.stream.append(result)
+            self._notify()
+        if self.on_result is not None:
+            self.on_result(result)
+        self._check_done()
+
+    def _notify(self):
+        # called with the lock held
+        self._changed.notify_all()
+        waiters, self._waiters = self._waiters, []
+        wake_waiters(waiters)
+
+    def _check_done(self):
+        with self._lock:
+            done = self._closed and self._pending == 0 and \
+                not self._done.is_set()
+        if done:
+            if self._on_done is not None:
+                self._on_done()
+            self.pool.forget(self.batch_id)
+            with self._lock:
+                self._done.set()
+                self._notify()
+
+    def done(self):
+        return self._done.is_set()
+
+    def iter_results(self, timeout=None):
+        # timeout bounds the wait for each next result
+        seen = 0
+        while True:
+            with self._lock:
+                while seen == len(self.stream) and not self._done.is_set():
+                    if not self._changed.wait(timeout):
+                        raise TimeoutError(
+                            "no result from batch {} for {} seconds".format(
+                                self.batch_id, timeout))
+                if seen == len(self.stream):
+                    return
+                result = self.stream[seen]
+            seen += 1
+            yield result
+
+    def __iter__(self):
+        return self.iter_results()
+
+    async def aiter_results(self):
+        # waits on the event loop, results are added from other threads
+        loop = asyncio.get_running_loop()
+        seen = 0
+        while True:
+            with self._lock:
+                if seen < len(self.stream):
+                    result = self.stream[seen]
+                    future = None
+                elif self._done.is_set():
+                    return
+                else:
+                    future = loop.create_future()
+                    self._waiters.append((loop, future))
+            if future is not None:
+                await future
+                continue
+            seen += 1
+            yield result
+
+    def __aiter__(self):
+        return self.aiter_results()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("batch {} not done after {} seconds".format(
+                self.batch_id, timeout))
+        return self.results
+
+
+class BatchPool(object):
+    """Base of the resize pools, hands out batches and routes results.
+
+    Subclasses implement dispatch(batch_id, item) and report every item
+    back through route(), from whichever thread or process resized it.
+    """
+
+    def __init__(self, resizer, metrics=None):
+        self.resizer = resizer
+        # stage timings of every item resized by this pool
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._batches = {}
+        self._batch_ids = itertools.count()
+        self._lock = threading.Lock()
+        # task counters, the autoscaler derives backlog and throughput from them
+        self.submitted = 0
+        self.completed = 0
+        # optional Backpressure, released as every item is resized
+        self.backpressure = None
+
+    def backlog(self):
+        # items submitted but not resized yet, including those in progress
+        with self._lock:
+            return self.submitted - self.completed
+
+    def batch(self, on_done=None):
+        # on_done runs once, when the last item of the closed batch is done
+        with self._lock:
+            batch = ResizeBatch(self, next(self._batch_ids), on_done)
+            self._batches[batch.batch_id] = batch
+        return batch
+
+    def put_task(self, batch_id, item):
+        with self._lock:
+            self.submitted += 1
+        self.dispatch(batch_id, item)
+
+    def dispatch(self, batch_id, item):
+        raise NotImplementedError
+
+    def run_task(self, batch_id, item, enqueued=None):
+        # resizes in the calling thread and routes the result
+        self.route(*resize_task(self.resizer, batch_id, item, enqueued))
+
+    def route(self, batch_id, filename, out_paths, error, metrics=None,
+              timings=None):
+        # metrics of this item alone are merged here, timings come instead
+        # when its Metrics was merged as part of a bigger one
+        if metrics is not None:
+            self.metrics.merge(metrics)
+            timings = metrics.timings()
+        if self.backpressure is not None:
+            self.backpressure.release(filename)
+        with self._lock:
+            self.completed += 1
+            batch = self._batches.get(batch_id)
+        if batch is not None:
+            batch.add_result(filename, out_paths, error, timings)
+
+    def forget(self, batch_id):
+        with self._lock:
+            self._batches.pop(batch_id, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InlineResizePool(BatchPool):
+    """Resizes each item as it is submitted, in the submitting thread."""
+
+    num_processes = 1
+
+    def dispatch(self, batch_id, item):
+        self.run_task(batch_id, item)
+
+    def resize(self, num_processes):
+        pass
+
+    def close(self):
+        pass
+
+
+class ThreadResizePool(BatchPool):
+    """Resize threads of this process, Pillow drops the GIL while resizing.
+
+    Sized in threads, but named num_processes like ResizeWorkerPool so
+    the service and the autoscaler treat every pool alike.
+    """
+
+    def __init__(self, resizer, num_threads=1, metrics=None):
+        super().__init__(resizer, metrics)
+        self.threads = TaskThreadPool(num_threads)
+
+    @property
+    def num_processes(self):
+        return self.threads.num_threads
+
+    def resize(self, num_threads):
+        self.threads.resize(num_threads)
+
+    def dispatch(self, batch_id, item):
+        self.threads.submit(self.run_task, batch_id, item, time.time())
+
+    def close(self):
+        self.threads.close()
+
+
+class ResizeWorkerPool(BatchPool):
+    """Long-lived resize processes shared by every batch.
+
+    Workers are started once and pull (batch_id, item) tasks from one
+    queue, so several batches can be in flight at the same time. A
+    collector thread routes results back to their ResizeBatch and restarts
+    workers that died. Use close() or a with block to shut it down.
+
+    Tasks travel in chunks, a message per chunk both ways. chunksize=None
+    tunes it from the measured per-item cost, chunksize=1 sends every item
+    on its own.
+    """
+
+    def __init__(self, resizer, num_processes=None, metrics=None,
+                 chunksize=None):
+        super().__init__(resizer, metrics)
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self._workers = []
+        # process -> its shared chunk id, see resize_worker
+        self._current = {}
+        # chunk_id -> the tasks of every chunk sent but not back yet
+        self._in_flight = {}
+        # chunk_id -> (pid, exitcode) of a worker that died while the chunk
+        # was held by no live worker, see _replace_dead_workers
+        self._suspects = {}
+        self._chunk_ids = itertools.count()
+        # workers that were sent a pill by resize() but haven't exited yet
+        self._retiring = 0
+        self._closed = False
+        self.fixed_chunksize = chunksize
+        self.chunksize = chunksize or 1
+        # running per-item resize cost in seconds, None until measured
+        self.item_cost = None
+        # task messages sent, to compare against the items they carried
+        self.messages = 0
+        self._chunk = []
+        self._chunk_cond = threading.Condition()
+
+        self.resize(num_processes or multiprocessing.cpu_count())
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        self._flusher = threading.Thread(target=self._flush_chunks,
+                                         daemon=True)
+        self._flusher.start()
+
+    @property
+    def num_processes(self):
+        with self._lock:
+            return len(self._workers) - self._retiring
+
+    def _start_worker(self):
+        current = multiprocessing.RawValue('q', -1)
+        p = multiprocessing.Process(
+            target=resize_worker,
+            args=(self.resizer, self.task_queue, self.result_queue,
+                  log_queue(), current),
+            daemon=True)
+        p.start()
+        self._current[p] = current
+        return p
+
+    def resize(self, num_processes):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("pool is closed")
+            current = len(self._workers) - self._retiring
+            for _ in range(num_processes - current):
+                self._workers.append(self._start_worker())
+            for _ in range(current - num_processes):
+                # the pill queues up behind the work already submitted,
+                # whichever worker gets it exits
+                self._retiring += 1
+                self.task_queue.put(None)
+
+    def dispatch(self, batch_id, item):
+        with self._chunk_cond:
+            self._chunk.append((batch_id, item, time.time()))
+            if len(self._chunk) >= self.current_chunksize():
+                self._send_chunk()
+            else:
+                self._chunk_cond.notify()
+
+    def current_chunksize(self):
+        if self.fixed_chunksize:
+            return self.fixed_chunksize
+        # enough items for CHUNK_SECONDS of work, but never so many that
+        # the backlog can't be spread over every worker
+        size = INITIAL_CHUNKSIZE
+        if self.item_cost:
+            size = int(CHUNK_SECONDS / self.item_cost)
+        share = self.backlog() // (2 * max(1, self.num_processes))
+        self.chunksize = max(1, min(size, share, MAX_CHUNKSIZE))
+        return self.chunksize
+
+    def _send_chunk(self):
+        # called with _chunk_cond held
+        if self._chunk:
+            chunk_id = next(self._chunk_ids)
+            with self._lock:
+                self._in_flight[chunk_id] = self._chunk
+            self.task_queue.put((chunk_id, self._chunk))
+            self._chunk = []
+            self.messages += 1
+
+    def _flush_chunks(self):
+        # sends a partly filled chunk once it waited CHUNK_LINGER, so a
+        # trickle of items doesn't sit in the buffer
+        with self._chunk_cond:
+            while not self._closed:
+                if not self._chunk:
+                    self._chunk_cond.wait()
+                    continue
+                deadline = time.monotonic() + CHUNK_LINGER
+                while self._chunk and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._chunk_cond.wait(remaining)
+                self._send_chunk()
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            if time.monotonic() - last_check > WORKER_CHECK_INTERVAL:
+                self._replace_dead_workers()
+                last_check = time.monotonic()
+            try:
+                result = self.result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if result is None:
+                break
+            chunk_id, results, seconds, metrics = result
+            with self._lock:
+                # None if its worker died and it was settled already
+                tasks = self._in_flight.pop(chunk_id, None)
+            if tasks is None:
+                continue
+            self.metrics.merge(metrics)
+            if results:
+                cost = seconds / len(results)
+                self.item_cost = cost if self.item_cost is None else \
+                    COST_SMOOTHING * cost + \
+                    (1 - COST_SMOOTHING) * self.item_cost
+            for item_result in results:
+                self.route(*item_result)
+
+    def _replace_dead_workers(self):
+        # (pid, exitcode, tasks) of the chunks lost with a worker
+        lost = []
+        with self._lock:
+            if self._closed:
+                return
+            self._settle_suspects(lost)
+            died = []
+            for p in [p for p in self._workers if not p.is_alive()]:
+                p.join()
+                self._workers.remove(p)
+                chunk_id = self._current.pop(p).value
+                if p.exitcode == 0 and self._retiring:
+                    # took one of the pills sent by resize()
+                    self._retiring -= 1
+                    continue
+                logging.error("resize worker {} died with exit code {}, "
+                              "restarting it".format(p.pid, p.exitcode))
+                self._workers.append(self._start_worker())
+                died.append(p)
+                # the chunk it was on, unless its results came back. they
+                # are not retried, the item that killed it would kill the
+                # next worker too
+                tasks = self._in_flight.pop(chunk_id, None)
+                if tasks is not None:
+                    lost.append((p.pid, p.exitcode, tasks))
+            if died:
+                # it may have died holding a chunk it had not claimed yet,
+                # or whose results never left it. any chunk no live worker
+                # holds is suspect until the next check
+                held = set(current.value for current in self._current.values())
+                for chunk_id in self._in_flight:
+                    if chunk_id not in held:
+                        self._suspects.setdefault(
+                            chunk_id, (died[0].pid, died[0].exitcode))
+        for pid, exitcode, tasks in lost:
+            for batch_id, item, _ in tasks:
+                filename = item[3] if isinstance(item, tuple) else \
+                    os.path.basename(item)
+                self.route(batch_id, filename, None,
+                           "resize worker {} died with exit code {}".format(
+                               pid, exitcode))
+
+    def _settle_suspects(self, lost):
+        # called with _lock held, a check interval after the suspects were
+        # found. the task queue hands chunks out in order, so a suspect no
+        # live worker holds is lost once every live worker is idle or one
+        # of them holds a later chunk, otherwise it is still queued
+        held = [current.value for current in self._current.values()]
+        busy = [chunk_id for chunk_id in held if chunk_id >= 0]
+        for chunk_id in sorted(self._suspects):
+            if chunk_id not in self._in_flight or chunk_id in held:
+                del self._suspects[chunk_id]
+            elif not busy or max(busy) > chunk_id:
+                pid, exitcode = self._suspects.pop(chunk_id)
+                lost.append((pid, exitcode, self._in_flight.pop(chunk_id)))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers, self._workers = self._workers, []
+        with self._chunk_cond:
+            # whatever is buffered still goes out ahead of the pills
+            self._send_chunk()
+            self._chunk_cond.notify()
+        self._flusher.join()
+        for _ in workers:
+            self.task_queue.put(None)
+        for p in workers:
+            p.join()
+        self._current.clear()
+        self.result_queue.put(None)
+        self._collector.join()
+
+
+class Backpressure(object):
+    """Bounds the images downloaded but not resized yet.
+
+    A producer takes a slot with acquire() (or acquire_async() on an event
+    loop) before it starts a download and blocks while max_items slots are
+    taken or max_bytes are queued, 0 means no bound. A finished download
+    binds its slot to the file with add(), a 304 or a failure gives it back
+    with cancel() and the resize pool frees it with release(). Bytes are
+    only known once downloaded, so the byte bound can be overshot by what
+    the downloads in flight bring in.
+    """
+
+    def __init__(self, max_items=0, max_bytes=0, metrics=NO_METRICS):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        # throttle_wait: seconds each blocked producer waited, throttled:
+        # how many times a producer had to wait
+        self.metrics = metrics
+        self.items = 0
+        self.bytes = 0
+        self.throttled_seconds = 0.0
+        self._sizes = {}
+        self._cond = threading.Condition()
+        # (loop, future) of the coroutines waiting in acquire_async
+        self._waiters = []
+
+    def _full(self):
+        return (self.max_items and self.items >= self.max_items) or \
+            (self.max_bytes and self.bytes >= self.max_bytes)
+
+    def _throttled(self, seconds):
+        with self._cond:
+            self.throttled_seconds += seconds
+        self.metrics.observe('throttle_wait', seconds)
+        self.metrics.add('throttled')
+
+    def acquire(self):
+        start = None
+        with self._cond:
+            while self._full():
+                if start is None:
+                    start = time.perf_counter()
+                self._cond.wait()
+            self.items += 1
+        if start is not None:
+            self._throttled(time.perf_counter() - start)
+
+    async def acquire_async(self):
+        # same as acquire() but awaits instead of blocking the event loop
+        start = None
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if not self._full():
+                    self.items += 1
+                    break
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            if start is None:
+                start = time.perf_counter()
+            await future
+        if start is not None:
+            self._throttled(time.perf_counter() - start)
+
+    def add(self, filename, size):
+        with self._cond:
+            self.bytes += size
+            self._sizes.setdefault(filename, []).append(size)
+
+    def cancel(self):
+        with self._cond:
+            self.items -= 1
+            self._notify()
+
+    def release(self, filename):
+        with self._cond:
+            sizes = self._sizes.get(filename)
+            if not sizes:
+                # not downloaded through us
+                return
+            self.bytes -= sizes.pop()
+            if not sizes:
+                del self._sizes[filename]
+            self.items -= 1
+            self._notify()
+
+    def _notify(self):
+        # called with the condition held
+        self._cond.notify_all()
+        waiters, self._waiters = self._waiters, []
+        wake_waiters(waiters)
+
+
+class TaskThreadPool(object):
+    """Long-lived threads running fn(*args) tasks from a queue.
+
+    Runs the downloads of the service. Like ResizeWorkerPool it can be
+    grown and shrunk while busy.
+    """
+
+    def __init__(self, num_threads=4):
+        self.task_queue = queue.Queue()
+        self._threads = []
+        self._retiring = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.resize(num_threads)
+
+    @property
+    def num_threads(self):
+        with self._lock:
+            return len(self._threads) - self._retiring
+
+    def backlog(self):
+        # tasks submitted but not finished yet, including those in progress
+        with self._lock:
+            return self.submitted - self.completed
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self.submitted += 1
+        self.task_queue.put((fn, args))
+
+    def _work(self):
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("task {} failed".format(fn))
+            finally:
+                with self._lock:
+                    self.completed += 1
+        with self._lock:
+            self._threads.remove(threading.current_thread())
+            if self._retiring:
+                self._retiring -= 1
+
+    def resize(self, num_threads):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("pool is closed")
+            current = len(self._threads) - self._retiring
+            for _ in range(num_threads - current):
+                t = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(t)
+                t.start()
+            for _ in range(current - num_threads):
+                self._retiring += 1
+                self.task_queue.put(None)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+            # every live thread gets a pill, including those already retiring
+            self._retiring = len(threads)
+        for _ in threads:
+            self.task_queue.put(None)
+        for t in threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
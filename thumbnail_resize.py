@@ -0,0 +1,209 @@
+# thumbnail_resize.py
+import io
+import os
+import time
+
+import PIL
+from PIL import Image
+
+from thumbnail_encode import profiles_for_targets
+from thumbnail_journal import RESIZED, write_atomic
+from thumbnail_metrics import NO_METRICS
+from thumbnail_shm import MappedFile
+
+TARGET_SIZES = [32, 64, 200]
+
+# every target is resized straight from the original image
+RESIZE_DIRECT = 'direct'
+# the largest target is resized from the original and every smaller target
+# from the previous (already much smaller) output
+RESIZE_PYRAMID = 'pyramid'
+RESIZE_MODES = (RESIZE_DIRECT, RESIZE_PYRAMID)
+
+# quality guard for the pyramid: a step only reuses the previous output if
+# it is at least this many times wider than the target. below that LANCZOS
+# gets too few source pixels per output pixel and the thumbnail goes soft,
+# so we fall back to resizing from the original
+MIN_PYRAMID_STEP = 2.0
+
+
+def target_dimensions(size, basewidth):
+    # calculate target height of the resized image to maintain the aspect ratio
+    wpercent = (basewidth / float(size[0]))
+    hsize = int((float(size[1]) * float(wpercent)))
+    return basewidth, hsize
+
+
+def thumbnail_filename(filename, basewidth, ext=None):
+    # modified file name of the resized image, e.g. cat.jpg -> cat_32.jpg,
+    # or cat_32.webp when ext='.webp'
+    name, orig_ext = os.path.splitext(filename)
+    return name + '_' + str(basewidth) + (orig_ext if ext is None else ext)
+
+
+def draft_for_targets(img, target_sizes=TARGET_SIZES):
+    # ask the JPEG decoder to scale by 1/2, 1/4 or 1/8 while decoding, picking
+    # the smallest scale that is still at least as big as the largest target.
+    # must be called before the image is loaded, other formats ignore it
+    if img.format != 'JPEG':
+        return img.size
+    img.draft(img.mode, target_dimensions(img.size, max(target_sizes)))
+    return img.size
+
+
+def resize_to_targets(orig_img, target_sizes=TARGET_SIZES,
+                      mode=RESIZE_DIRECT, min_step=MIN_PYRAMID_STEP,
+                      orig_size=None, metrics=NO_METRICS):
+    if mode not in RESIZE_MODES:
+        raise ValueError("unknown resize mode {!r}".format(mode))
+    # size of the source before any draft scaling, target heights are
+    # computed from it so draft decoding doesn't change the output dimensions
+    if orig_size is None:
+        orig_size = orig_img.size
+
+    resized = {}
+    source = orig_img
+    # walk from the largest to the smallest target so the pyramid can
+    # reuse the previous output as the source of the next step
+    for basewidth in sorted(set(target_sizes), reverse=True):
+        if mode == RESIZE_DIRECT or source.size[0] < basewidth * min_step:
+            source = orig_img
+        # the height always comes from the original so both modes produce
+        # exactly the same dimensions
+        start = time.perf_counter()
+        img = source.resize(target_dimensions(orig_size, basewidth),
+                            PIL.Image.LANCZOS)
+        metrics.observe('resize_{}'.format(basewidth),
+                        time.perf_counter() - start)
+        resized[basewidth] = img
+        if mode == RESIZE_PYRAMID:
+            source = img
+
+    # hand the results back in the order the caller asked for
+    return [(basewidth, resized[basewidth]) for basewidth in target_sizes]
+
+
+class ThumbnailResizer(object):
+    """Shared resize loop used by every ThumbnailMakerService variant.
+
+    Only holds plain attributes so it can be pickled into pool workers.
+    """
+
+    def __init__(self, output_dir, target_sizes=TARGET_SIZES,
+                 resize_mode=RESIZE_DIRECT, draft=False, cache=None,
+                 profiles=None, store=None, mmap_input=False, journal=None):
+        if resize_mode not in RESIZE_MODES:
+            raise ValueError("unknown resize mode {!r}".format(resize_mode))
+        if cache is not None and store is not None:
+            raise ValueError("the thumbnail cache only works with files, "
+                             "not with a store")
+        self.output_dir = output_dir
+        self.target_sizes = list(target_sizes)
+        self.resize_mode = resize_mode
+        # decode JPEGs at a reduced scale before the final LANCZOS pass
+        self.draft = draft
+        # optional ThumbnailCache, a hit skips decode, resize and encode
+        self.cache = cache
+        # how each target is encoded, see thumbnail_encode.profiles_for_targets
+        self.profiles = profiles_for_targets(profiles, self.target_sizes)
+        # optional thumbnail_store.SegmentStore, thumbnails are appended to
+        # it instead of written to output_dir and named by their file name
+        self.store = store
+        # decode input files out of an mmap instead of a buffered file
+        self.mmap_input = mmap_input
+        # optional thumbnail_journal.Journal, gets a resized record once all
+        # thumbnails of an image are in place
+        self.journal = journal
+
+    def cache_params(self, ext):
+        # everything besides the source bytes that changes the output
+        return (self.target_sizes, self.resize_mode, self.draft, ext.lower(),
+                self.profiles)
+
+    def output_paths(self, filename):
+        # the keys of the thumbnails in the store when there is one
+        ext = os.path.splitext(filename)[1]
+        names = [thumbnail_filename(filename, basewidth, profile.extension(ext))
+                 for basewidth, profile in zip(self.target_sizes,
+                                               self.profiles)]
+        if self.store is not None:
+            return names
+        return [self.output_dir + os.path.sep + name for name in names]
+
+    def outputs_exist(self, filename):
+        if self.store is not None:
+            return self.store.contains(self.output_paths(filename))
+        return all(os.path.exists(out_path)
+                   for out_path in self.output_paths(filename))
+
+    def output_sizes(self, out_paths):
+        # bytes of each thumbnail, out_paths as returned by resize_source
+        if self.store is not None:
+            return self.store.sizes(out_paths)
+        return [os.path.getsize(out_path) for out_path in out_paths]
+
+    def resize_image(self, input_path, metrics=NO_METRICS):
+        if self.mmap_input:
+            # unmapped again on return, before the caller removes the file
+            with MappedFile(input_path) as source:
+                return self.resize_source(source, os.path.basename(input_path),
+                                          metrics)
+        return self.resize_source(input_path, os.path.basename(input_path),
+                                  metrics)
+
+    def resize_source(self, source, filename, metrics=NO_METRICS):
+        # source is a path or a readable, seekable binary file object,
+        # filename names the outputs. metrics gets the time of every stage
+        out_paths = self.output_paths(filename)
+        targets = list(zip(self.target_sizes, out_paths))
+
+        if self.cache is not None:
+            key = self.cache.make_key(
+                source, self.cache_params(os.path.splitext(filename)[1]))
+            if self.cache.get(key, targets):
+                metrics.add('cache_hits')
+                self._resized(filename)
+                return out_paths
+
+        with Image.open(source) as orig_img:
+            orig_size = orig_img.size
+            with metrics.time('decode'):
+                if self.draft:
+                    draft_for_targets(orig_img, self.target_sizes)
+                orig_img.load()
+            resized = resize_to_targets(orig_img, self.target_sizes,
+                                        self.resize_mode, orig_size=orig_size,
+                                        metrics=metrics)
+            # Pillow picks the format from the extension when saving to a
+            # path, encoding into a buffer needs it spelled out
+            fmt = Image.registered_extensions().get(
+                os.path.splitext(filename)[1].lower(), orig_img.format)
+            packed = []
+            for (_, img), out_path, profile in zip(resized, out_paths,
+                                                   self.profiles):
+                # save the resized image to the output dir with a modified
+                # file name, encode and write timed separately
+                with metrics.time('encode'):
+                    buf = io.BytesIO()
+                    profile.encode(img, buf, fmt)
+                if self.store is not None:
+                    packed.append((out_path, buf.getbuffer()))
+                else:
+                    # under a temporary name until complete, a crash never
+                    # leaves a truncated thumbnail behind
+                    with metrics.time('write'):
+                        write_atomic(out_path, buf.getbuffer())
+                metrics.add('bytes_out', buf.tell())
+            if packed:
+                # all targets of the image in one append and one index update
+                with metrics.time('write'):
+                    self.store.put_many(packed)
+
+        if self.cache is not None:
+            self.cache.put(key, targets)
+        self._resized(filename)
+        return out_paths
+
+    def _resized(self, filename):
+        if self.journal is not None:
+            self.journal.record(RESIZED, filename)
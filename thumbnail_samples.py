@@ -0,0 +1,68 @@
+# thumbnail_samples.py
+# generates photo-like sample images so tests and benchmarks can run offline
+import io
+import random
+import struct
+
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def make_sample_image(width, height, seed=0):
+    rnd = random.Random(seed)
+
+    # smooth colour gradients as the background, one per channel
+    channels = []
+    for angle in (0, 90, rnd.randint(0, 359)):
+        gradient = Image.linear_gradient('L').rotate(angle, expand=False)
+        channels.append(gradient.resize((width, height), PIL.Image.BILINEAR))
+    img = Image.merge('RGB', channels)
+
+    # some hard edges so resampling artifacts are visible in comparisons
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rnd.randrange(width), rnd.randrange(height)
+        x1 = x0 + rnd.randrange(width // 8 + 1, width // 3 + 2)
+        y1 = y0 + rnd.randrange(height // 8 + 1, height // 3 + 2)
+        colour = tuple(rnd.randrange(256) for _ in range(3))
+        draw.ellipse((x0, y0, x1, y1), fill=colour)
+
+    # fine grained texture, roughly like sensor noise in a real photo
+    noise = Image.effect_noise((max(1, width // 2), max(1, height // 2)), 24)
+    noise = noise.resize((width, height), PIL.Image.BILINEAR)
+    noise = noise.filter(ImageFilter.SMOOTH)
+    return Image.blend(img, Image.merge('RGB', (noise, noise, noise)), 0.15)
+
+
+def make_sample_bytes(width, height, fmt='JPEG', seed=0, **save_kwargs):
+    buf = io.BytesIO()
+    make_sample_image(width, height, seed).save(buf, fmt, **save_kwargs)
+    return buf.getvalue()
+
+
+def exif_with_thumbnail(thumbnail):
+    # an EXIF block carrying nothing but an embedded JPEG thumbnail: a big
+    # endian TIFF header, an empty IFD0 and an IFD1 pointing at the JPEG
+    ifd1_offset = 8 + 6
+    data_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = (b'MM\x00\x2a' + struct.pack('>I', 8) +
+            struct.pack('>HI', 0, ifd1_offset) +
+            struct.pack('>H', 2) +
+            struct.pack('>HHII', 0x0201, 4, 1, data_offset) +
+            struct.pack('>HHII', 0x0202, 4, 1, len(thumbnail)) +
+            struct.pack('>I', 0) + thumbnail)
+    return b'Exif\x00\x00' + tiff
+
+
+def make_camera_bytes(width, height, seed=0, preview_width=160,
+                      **save_kwargs):
+    # a JPEG with a preview_width wide thumbnail in its EXIF block, the way
+    # cameras write them
+    img = make_sample_image(width, height, seed)
+    preview = io.BytesIO()
+    img.resize((preview_width, max(1, height * preview_width // width)),
+               PIL.Image.LANCZOS).save(preview, 'JPEG', quality=75)
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', exif=exif_with_thumbnail(preview.getvalue()),
+             **save_kwargs)
+    return buf.getvalue()
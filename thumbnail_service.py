@@ -0,0 +1,617 @@
+# thumbnail_service.py
+# the one ThumbnailMakerService, the thumbnail_* and thumnbnail_* modules
+# are thin wrappers that pick one of its backends
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from threading import Lock, Thread
+from urllib.parse import urlparse
+
+from thumbnail_aio import AsyncDownloader, DEFAULT_CONCURRENCY
+from thumbnail_autoscale import AutoScaler
+from thumbnail_dedup import Deduplicator, discard_item, unique_filename
+from thumbnail_exif import fetch_header, usable_header
+from thumbnail_fleet import DEFAULT_ADDRESS, FleetResizePool
+from thumbnail_journal import (COMMITTED, DONE, DOWNLOADED, PART_SUFFIX,
+                               QUEUED, Journal, write_atomic)
+from thumbnail_http import (DEFAULT_TIMEOUTS, ConnectionPool, LatencyTracker,
+                            RetryPolicy, ValidatorStore, download_file,
+                            hedged_call, open_url)
+from thumbnail_logging import configure_logging
+from thumbnail_metrics import Metrics
+from thumbnail_pool import (Backpressure, InlineResizePool, ResizeWorkerPool,
+                            TaskThreadPool, ThreadResizePool)
+from thumbnail_resize import TARGET_SIZES, ThumbnailResizer, RESIZE_DIRECT
+from thumbnail_shm import ShmIngest
+
+configure_logging()
+
+# download --> i/o bound ==> threads or asyncio
+# resize --> cpu bound ==> processes, or threads while Pillow drops the GIL
+#
+# serial: download and resize one image after the other, nothing overlaps
+BACKEND_SERIAL = 'serial'
+# download threads, resize threads
+BACKEND_THREAD = 'thread'
+# download threads, resize processes
+BACKEND_PROCESS = 'process'
+# asyncio downloads, resize processes
+BACKEND_ASYNCIO = 'asyncio'
+# download threads feeding one resize thread through a queue
+BACKEND_THREAD_RESIZE = 'thread-resize'
+BACKENDS = (BACKEND_SERIAL, BACKEND_THREAD, BACKEND_PROCESS, BACKEND_ASYNCIO,
+            BACKEND_THREAD_RESIZE)
+# download threads, resize workers on other machines, see thumbnail_fleet.
+# not in BACKENDS, it does nothing until workers connect
+BACKEND_FLEET = 'fleet'
+
+# with hedge=True a download slower than this share of the recent ones gets
+# a second request
+HEDGE_QUANTILE = 0.95
+
+
+def discard_download(result):
+    # what the losing request of a hedged download brought in
+    if result is not None:
+        discard_item(result[0])
+
+
+class ThumbnailMakerService(object):
+    def __init__(self, home_dir='.', backend=BACKEND_PROCESS,
+                 resize_mode=RESIZE_DIRECT, draft=False, cache=None,
+                 revalidate=False, ingest='disk', persistent=False,
+                 num_resizers=None, num_dl_threads=4,
+                 max_concurrent_dl=DEFAULT_CONCURRENCY, limit_per_host=0,
+                 autoscale=False, dl_bounds=(1, 16), resize_bounds=None,
+                 max_queued=0, max_queued_bytes=0, chunksize=None,
+                 profiles=None, store=None, mmap_input=False, dedup=False,
+                 timeouts=DEFAULT_TIMEOUTS, retry=None, hedge=False,
+                 keepalive=True, target_sizes=TARGET_SIZES,
+                 exif_preview=False, fleet_address=DEFAULT_ADDRESS,
+                 fleet_authkey=None, journal=False):
+        if backend not in BACKENDS + (BACKEND_FLEET,):
+            raise ValueError("unknown backend {!r}".format(backend))
+        self.backend = backend
+        self.home_dir = home_dir
+        self.input_dir = self.home_dir + os.path.sep + 'incoming'
+        self.output_dir = self.home_dir + os.path.sep + 'outgoing'
+        # resize_mode='pyramid' derives the smaller targets from the larger ones
+        # draft=True lets the JPEG decoder downscale while decoding
+        # cache is an optional thumbnail_cache.ThumbnailCache
+        # profiles sets the output format and encoder options per size, a
+        # preset name like 'webp' or 'cdn' or thumbnail_encode.EncoderProfiles
+        # store is an optional thumbnail_store.SegmentStore that takes the
+        # thumbnails in place of outgoing/
+        # mmap_input=True decodes downloads out of an mmap of the file
+        # journal=True logs the state of every image to journal.jsonl, so a
+        # batch that died half way can be resumed, see thumbnail_journal
+        self.journal = None
+        if journal:
+            self.journal = Journal(self.home_dir + os.path.sep +
+                                   'journal.jsonl')
+        self.resizer = ThumbnailResizer(self.output_dir,
+                                        target_sizes=target_sizes,
+                                        resize_mode=resize_mode,
+                                        draft=draft, cache=cache,
+                                        profiles=profiles, store=store,
+                                        mmap_input=mmap_input,
+                                        journal=self.journal)
+        # revalidate=True remembers ETag/Last-Modified per url and sends
+        # conditional requests, a 304 skips both the download and the resize
+        self.validators = None
+        if revalidate:
+            self.validators = ValidatorStore(
+                self.home_dir + os.path.sep + 'validators.json')
+        # ingest='memory' skips incoming/: bodies go into shared memory and
+        # the resize processes only get a (name, offset, length, filename)
+        # descriptor
+        if ingest not in ('disk', 'memory'):
+            raise ValueError("unknown ingest mode {!r}".format(ingest))
+        if ingest == 'memory' and backend != BACKEND_PROCESS:
+            raise ValueError("ingest='memory' needs the process backend")
+        self.ingest = ingest
+        # resize threads or processes, depending on the backend
+        if num_resizers is None:
+            num_resizers = 1 if backend == BACKEND_THREAD_RESIZE \
+                else multiprocessing.cpu_count()
+        self.num_resizers = num_resizers
+        # resize processes get their work in chunks, None tunes the size from
+        # the measured per-image cost, 1 sends every image on its own
+        self.chunksize = chunksize
+        self.num_dl_threads = num_dl_threads
+        # asyncio backend: downloads in flight. limit_per_host caps the
+        # connections to one host on every backend, 0 means no cap
+        self.max_concurrent_dl = max_concurrent_dl
+        self.limit_per_host = limit_per_host
+        # autoscale=True resizes the download threads and the resizers at
+        # runtime, within dl_bounds and resize_bounds, from their backlogs,
+        # throughput and cpu usage
+        if autoscale and backend in (BACKEND_SERIAL, BACKEND_ASYNCIO):
+            raise ValueError("autoscale needs download threads, not the "
+                             "{} backend".format(backend))
+        self.autoscale = autoscale
+        self.dl_bounds = dl_bounds
+        self.resize_bounds = resize_bounds
+        # counters of the last make_thumbnails call, see submit()
+        self.stats = None
+        # stage latency histograms and byte counters of every batch since
+        # the service was created, resize workers report theirs back to it.
+        # metrics.snapshot() or metrics.to_json() to export
+        self.metrics = Metrics()
+        # max_queued and max_queued_bytes bound what sits downloaded but not
+        # resized yet, in incoming/ or in shared memory, across all batches.
+        # downloads wait for room, 0 means no bound
+        self.backpressure = None
+        if max_queued or max_queued_bytes:
+            self.backpressure = Backpressure(max_queued, max_queued_bytes,
+                                             self.metrics)
+
+        # dedup=True downloads and resizes every url once however often it
+        # is asked for, in one batch or in overlapping ones, resizes
+        # identical downloads once, and names files <name>-<url hash><ext>
+        # so different urls never share a file. see thumbnail_dedup
+        self.dedup = dedup
+        # every request gives up after timeouts=(connect, read) seconds.
+        # retry is a thumbnail_http.RetryPolicy, None for the default one and
+        # thumbnail_http.NO_RETRY to fail on the first error. hedge=True
+        # sends a second request for a download that takes longer than
+        # HEDGE_QUANTILE of the recent ones and keeps whichever is first
+        self.timeouts = timeouts
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.hedge = hedge
+        self.dl_latency = LatencyTracker()
+        # download threads share keep-alive connections per host, kept from
+        # one batch to the next, and from one make_thumbnails call to the
+        # next, until close(). keepalive=False opens a connection per
+        # request. the asyncio backend has aiohttp's pool
+        self.http = None
+        if keepalive:
+            self.http = ConnectionPool(limit_per_host, timeouts)
+        # the fleet backend serves its work queue at fleet_address, workers
+        # connect with fleet_authkey. port 0 picks a free port, see
+        # pool.address once started
+        if backend == BACKEND_FLEET and not fleet_authkey:
+            raise ValueError("the fleet backend needs a fleet_authkey")
+        self.fleet_address = fleet_address
+        self.fleet_authkey = fleet_authkey
+        # exif_preview=True first fetches only the start of every image and
+        # makes the thumbnails from the thumbnail embedded in its EXIF block
+        # when that is as wide as every target, see thumbnail_exif
+        self.exif_preview = exif_preview
+        self.deduplicator = Deduplicator(self.resizer) if dedup else None
+
+        self.pool = None
+        self.dl_pool = None
+        self.autoscaler = None
+        self.running = False
+        # persistent=True starts the resizers and download threads once,
+        # here, and reuses them for every batch until close(). otherwise
+        # every make_thumbnails call starts and stops its own
+        self.persistent = persistent
+        if persistent:
+            self.start()
+
+    def start(self):
+        if self.running:
+            return
+        if self.backend == BACKEND_SERIAL:
+            self.pool = InlineResizePool(self.resizer, self.metrics)
+        elif self.backend in (BACKEND_THREAD, BACKEND_THREAD_RESIZE):
+            self.pool = ThreadResizePool(self.resizer, self.num_resizers,
+                                         self.metrics)
+        elif self.backend == BACKEND_FLEET:
+            self.pool = FleetResizePool(self.resizer, self.fleet_address,
+                                        self.fleet_authkey, self.metrics)
+        else:
+            self.pool = ResizeWorkerPool(self.resizer, self.num_resizers,
+                                         self.metrics, self.chunksize)
+        self.pool.backpressure = self.backpressure
+        if self.backend not in (BACKEND_SERIAL, BACKEND_ASYNCIO):
+            self.dl_pool = TaskThreadPool(self.num_dl_threads)
+        if self.autoscale:
+            self.autoscaler = AutoScaler(self.dl_pool, self.pool,
+                                         self.dl_bounds,
+                                         self.resize_bounds).start()
+        self.running = True
+
+    def stop(self):
+        # stops the resizers and download threads, what make_thumbnails
+        # does after its batch unless the service is persistent. keep-alive
+        # connections stay open for the next call
+        if not self.running:
+            return
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+        if self.dl_pool is not None:
+            self.dl_pool.close()
+        self.pool.close()
+        if self.journal is not None:
+            self.journal.close()
+        self.running = False
+
+    def close(self):
+        self.stop()
+        if self.http is not None:
+            self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def download_url(self, url, shm_ingest=None):
+        # download core of every backend but asyncio. returns the item to
+        # resize and its size in bytes, None when the server answered 304
+        start = time.perf_counter()
+        result = self.retry.run(self._download_hedged, url, shm_ingest)
+        if result is not None:
+            # like the asyncio downloader, only completed downloads count
+            self.metrics.observe('download', time.perf_counter() - start)
+        return result
+
+    def _download_hedged(self, url, shm_ingest):
+        delay = None
+        if self.hedge:
+            delay = self.dl_latency.quantile(HEDGE_QUANTILE)
+        if delay is None:
+            return self._download_attempt(url, shm_ingest)
+        # both attempts write files of their own, the winner's is renamed
+        result = hedged_call(
+            lambda: self._download_attempt(url, shm_ingest, '.hedge0'),
+            lambda: self._download_attempt(url, shm_ingest, '.hedge1'),
+            delay, discard_download)
+        if result is not None and not isinstance(result[0], tuple):
+            img_filepath = result[0].rsplit('.hedge', 1)[0]
+            os.replace(result[0], img_filepath)
+            result = img_filepath, result[1]
+        return result
+
+    def _download_attempt(self, url, shm_ingest, suffix=''):
+        start = time.perf_counter()
+        result = self._download_url(url, shm_ingest, suffix)
+        self.dl_latency.add(time.perf_counter() - start)
+        return result
+
+    def image_filename(self, url):
+        # name of the download in incoming/, its thumbnails are named after it
+        if self.dedup:
+            return unique_filename(url)
+        return urlparse(url).path.split('/')[-1]
+
+    def _download_url(self, url, shm_ingest, suffix=''):
+        # suffix is appended to the name of the downloaded file
+        img_filename = self.image_filename(url)
+        # only revalidate while the old thumbnails are still there, a
+        # 304 then means they are up to date and the resize is skipped
+        have_thumbnails = self.resizer.outputs_exist(img_filename)
+        img_filepath = self.input_dir + os.path.sep + img_filename + suffix
+        if self.exif_preview:
+            header = fetch_header(url, self.validators,
+                                  conditional=have_thumbnails,
+                                  timeouts=self.timeouts, pool=self.http)
+            if header is None:
+                return None
+            status, headers, data = header
+            data = usable_header(status, headers, data,
+                                 self.resizer.target_sizes)
+            if data is not None:
+                self.metrics.add('exif_previews')
+                if self.validators is not None:
+                    self.validators.update(url, headers)
+                if shm_ingest is not None:
+                    return shm_ingest.store_bytes(data, img_filename), len(data)
+                write_atomic(img_filepath, data)
+                return img_filepath, len(data)
+        if shm_ingest is not None:
+            response = open_url(url, self.validators,
+                                conditional=have_thumbnails,
+                                timeouts=self.timeouts, pool=self.http)
+            if response is None:
+                return None
+            with response:
+                descriptor = shm_ingest.store(response, img_filename)
+                if self.validators is not None:
+                    self.validators.update(url, response.headers)
+            return descriptor, descriptor[2]
+        # the body only gets its real name once it is complete
+        part_path = img_filepath + PART_SUFFIX
+        try:
+            if not download_file(url, part_path, self.validators,
+                                 conditional=have_thumbnails,
+                                 timeouts=self.timeouts, pool=self.http):
+                return None
+            os.replace(part_path, img_filepath)
+        except BaseException:
+            # don't leave half a body behind for the next attempt to trip on
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        return img_filepath, os.path.getsize(img_filepath)
+
+    def submit(self, img_url_list, loop=None, resume=False):
+        # starts downloading a batch and returns its thumbnail_pool.ResizeBatch,
+        # which resizes each image as soon as it is downloaded. with
+        # persistent=True new batches can come in while earlier ones are
+        # still running. batch.stats holds the same counters on every backend.
+        # the asyncio backend downloads on a loop in a thread of its own
+        # unless loop, a running loop, is passed to run them on as a task.
+        # resume=True skips the images the journal has thumbnails of and
+        # resizes the ones it has complete downloads of without fetching
+        # them again
+        if resume and self.journal is None:
+            raise ValueError("resume=True needs journal=True")
+        if not self.running:
+            raise RuntimeError("the service is not running, pass "
+                               "persistent=True or call start()")
+        os.makedirs(self.input_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # segments are tracked per batch so cleaning up after one batch
+        # can't unlink the segments of another
+        shm_ingest = ShmIngest() if self.ingest == 'memory' else None
+        # coalesced counts the urls another request downloaded for us,
+        # duplicate_content the downloads another one was resized for,
+        # resumed the urls an earlier run got at least as far as downloading
+        stats = {'urls': len(img_url_list), 'downloaded': 0,
+                 'not_modified': 0, 'download_errors': 0, 'dl_bytes': 0,
+                 'coalesced': 0, 'duplicate_content': 0, 'resumed': 0}
+        lock = Lock()
+
+        def resized():
+            if shm_ingest is not None:
+                # unlink whatever a dead worker left behind
+                shm_ingest.cleanup()
+            stats.update(resized=len(batch.results),
+                         resize_errors=len(batch.errors),
+                         thumbnails=sum(len(result.out_paths)
+                                        for result in batch.stream),
+                         thumbnail_bytes=sum(sum(result.sizes)
+                                             for result in batch.stream))
+
+        batch = self.pool.batch(on_done=resized)
+        batch.stats = stats
+        batch.sources = {}
+        for url in img_url_list:
+            # the first of several urls for one file is the one downloaded
+            batch.sources.setdefault(self.image_filename(url), url)
+
+        # see thumbnail_dedup.BatchDedup
+        dedup = None
+        if self.dedup:
+            dedup = self.deduplicator.batch(batch)
+
+        def on_result(result):
+            if self.journal is not None and result.error is None:
+                self.journal.record(COMMITTED, result.filename)
+            if dedup is not None:
+                dedup.resized(result)
+
+        batch.on_result = on_result
+        to_download = img_url_list
+        # (path, size) of complete downloads an earlier run left in incoming/
+        kept = []
+        if self.journal is not None:
+            to_download = []
+            for url in img_url_list:
+                filename = self.image_filename(url)
+                entry = self.journal.latest(filename) if resume else None
+                img_filepath = self.input_dir + os.path.sep + filename
+                if entry is not None and entry['state'] in DONE and \
+                        self.resizer.outputs_exist(filename):
+                    stats['resumed'] += 1
+                    batch.expect()
+                    batch.add_result(filename,
+                                     self.resizer.output_paths(filename),
+                                     None, source=url)
+                elif entry is not None and entry['state'] == DOWNLOADED and \
+                        shm_ingest is None and os.path.exists(img_filepath):
+                    stats['resumed'] += 1
+                    kept.append((img_filepath, os.path.getsize(img_filepath)))
+                else:
+                    self.journal.record(QUEUED, filename, url=url)
+                    to_download.append(url)
+        if dedup is not None:
+            img_url_list = to_download
+            to_download = []
+            for url in img_url_list:
+                if dedup.join(url, self.image_filename(url)):
+                    to_download.append(url)
+                else:
+                    stats['coalesced'] += 1
+
+        def downloaded(item, size, fetched=True):
+            # fetched=False for a download kept from an earlier run
+            filename = item[3] if isinstance(item, tuple) \
+                else os.path.basename(item)
+            if fetched:
+                with lock:
+                    stats['downloaded'] += 1
+                    stats['dl_bytes'] += size
+                self.metrics.add('bytes_in', size)
+                if self.journal is not None and shm_ingest is None:
+                    self.journal.record(DOWNLOADED, filename, size=size)
+                if self.backpressure is not None:
+                    self.backpressure.add(filename, size)
+            if dedup is None or dedup.downloaded(item, filename):
+                batch.submit(item)
+                return
+            # the same bytes are resized or being resized already
+            with lock:
+                stats['duplicate_content'] += 1
+            discard_item(item)
+            if self.backpressure is not None:
+                self.backpressure.release(filename)
+
+        def failed(url, e):
+            logging.error("downloading {} failed: {!r}".format(url, e))
+            with lock:
+                stats['download_errors'] += 1
+            if dedup is not None:
+                dedup.failed(url, repr(e))
+
+        def finish_downloads():
+            stats['not_modified'] = stats['urls'] - stats['downloaded'] - \
+                stats['download_errors'] - stats['coalesced'] - \
+                stats['resumed']
+            # what is left answered 304, their thumbnails are up to date
+            if dedup is not None:
+                dedup.finish()
+            # persist the validators for the next run
+            if self.validators is not None:
+                self.validators.save()
+            batch.close()
+
+        def started(url):
+            # retries and hedges keep the time of the first request
+            batch.download_started.setdefault(self.image_filename(url),
+                                              time.perf_counter())
+
+        def download(url):
+            if self.backpressure is not None:
+                # blocks this download thread while the resizers are behind
+                self.backpressure.acquire()
+            started(url)
+            try:
+                result = self.download_url(url, shm_ingest)
+            except Exception as e:
+                result = None
+                failed(url, e)
+            if result is not None:
+                downloaded(*result)
+            elif self.backpressure is not None:
+                self.backpressure.cancel()
+
+        for img_filepath, size in kept:
+            downloaded(img_filepath, size, fetched=False)
+
+        if self.backend == BACKEND_SERIAL:
+            # still one image after another, off the caller's thread so
+            # results can be iterated while the rest are processed
+            def download_all():
+                for url in to_download:
+                    download(url)
+                finish_downloads()
+
+            Thread(target=download_all, daemon=True).start()
+        elif self.backend == BACKEND_ASYNCIO:
+            downloads = self.download_async(to_download, downloaded, failed,
+                                            finish_downloads, started)
+            if loop is None:
+                Thread(target=asyncio.run, args=(downloads,),
+                       daemon=True).start()
+            else:
+                batch.download_task = loop.create_task(downloads)
+        else:
+            # the last download of the batch to finish closes it
+            remaining = [len(to_download)]
+
+            def download_task(url):
+                try:
+                    download(url)
+                finally:
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        finish_downloads()
+
+            if not to_download:
+                finish_downloads()
+            for url in to_download:
+                self.dl_pool.submit(download_task, url)
+        return batch
+
+    async def download_async(self, img_url_list, downloaded, failed, finish,
+                             started=None):
+        # all downloads run concurrently on the current loop, bounded by
+        # max_concurrent_dl
+        downloader = AsyncDownloader(
+            self.input_dir, concurrency=self.max_concurrent_dl,
+            limit_per_host=self.limit_per_host, validators=self.validators,
+            have_thumbnails=self.resizer.outputs_exist, metrics=self.metrics,
+            backpressure=self.backpressure, filename_for=self.image_filename,
+            timeouts=self.timeouts, retry=self.retry,
+            hedge_quantile=HEDGE_QUANTILE if self.hedge else None,
+            latency=self.dl_latency,
+            preview_targets=self.resizer.target_sizes
+            if self.exif_preview else None, on_started=started)
+
+        def on_downloaded(img_filename, size):
+            downloaded(self.input_dir + os.path.sep + img_filename, size)
+
+        try:
+            await downloader.download_images(img_url_list, on_downloaded,
+                                             on_error=failed)
+        except Exception:
+            logging.exception("asyncio downloads failed")
+        finally:
+            finish()
+
+    def make_thumbnails(self, img_url_list, resume=False):
+        # resume=True picks up where an interrupted run with the same
+        # journal stopped, see submit()
+        logging.info("START make_thumbnails")
+        start = time.perf_counter()
+
+        started_here = not self.running
+        self.start()
+        try:
+            batch = self.submit(img_url_list, resume=resume)
+            results = batch.wait()
+        finally:
+            if started_here:
+                self.stop()
+
+        end = time.perf_counter()
+        self.stats = batch.stats
+        logging.info("{} backend: downloaded {} images [{} bytes], {} not "
+                     "modified, created {} thumbnails [{} bytes]".format(
+                         self.backend, self.stats['downloaded'],
+                         self.stats['dl_bytes'], self.stats['not_modified'],
+                         self.stats['thumbnails'],
+                         self.stats['thumbnail_bytes']))
+        logging.info("END make_thumbnails in {} seconds".format(end - start))
+        return results
+
+    def iter_thumbnails(self, img_url_list, timeout=None, resume=False):
+        # like make_thumbnails, but yields a thumbnail_pool.ThumbnailResult
+        # per image as soon as it is done, in completion order. timeout
+        # bounds the wait for each next result
+        started_here = not self.running
+        self.start()
+        try:
+            batch = self.submit(img_url_list, resume=resume)
+            for result in batch.iter_results(timeout):
+                yield result
+            self.stats = batch.stats
+        finally:
+            if started_here:
+                self.stop()
+
+    async def aiter_thumbnails(self, img_url_list, resume=False):
+        # async iterator version of iter_thumbnails. the asyncio backend
+        # downloads on the caller's loop, the others wait on it for results
+        # coming from their threads or processes
+        loop = asyncio.get_running_loop()
+        started_here = not self.running
+        await loop.run_in_executor(None, self.start)
+        batch = None
+        try:
+            batch = self.submit(
+                img_url_list,
+                loop=loop if self.backend == BACKEND_ASYNCIO else None,
+                resume=resume)
+            async for result in batch:
+                yield result
+            self.stats = batch.stats
+        finally:
+            task = getattr(batch, 'download_task', None)
+            if task is not None and not task.done():
+                # the caller stopped early, don't leave downloads behind
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            if started_here:
+                await loop.run_in_executor(None, self.stop)
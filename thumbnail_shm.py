@@ -0,0 +1,181 @@
+# thumbnail_shm.py
+# in-memory ingest: downloaded bodies go into shared memory segments and only
+# a small (name, offset, length, filename) descriptor crosses img_queue
+import io
+import logging
+import mmap
+import os
+import threading
+from multiprocessing import shared_memory
+
+
+class SegmentReader(io.RawIOBase):
+    """Read-only, seekable file object over a memoryview.
+
+    Lets Pillow decode straight out of a shared memory segment without
+    copying the whole body into a bytes object first.
+    """
+
+    def __init__(self, buf):
+        super().__init__()
+        self._buf = buf
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._buf) - self._pos))
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._buf) + offset
+        else:
+            raise ValueError("invalid whence {}".format(whence))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        # the segment can only be closed once every view on it is released
+        if not self.closed:
+            self._buf.release()
+        super().close()
+
+
+class SharedSource(object):
+    """Attaches to the segment of a descriptor in a resize worker.
+
+    Used as a context manager that returns a SegmentReader. On exit the
+    segment is unmapped and unlinked, the worker is its last user.
+    """
+
+    def __init__(self, descriptor):
+        self.name, self.offset, self.length, self.filename = descriptor
+        self._shm = None
+        self._reader = None
+
+    def __enter__(self):
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._reader = SegmentReader(
+            self._shm.buf[self.offset:self.offset + self.length])
+        return self._reader
+
+    def __exit__(self, *exc_info):
+        self._reader.close()
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class MappedFile(object):
+    """Maps a file read-only, for decoding out of the page cache.
+
+    Used as a context manager that returns a SegmentReader over the
+    mapping, so reads skip the buffered file object. On exit the mapping is
+    gone and the file can be removed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self._reader = None
+
+    def __enter__(self):
+        with open(self.path, 'rb') as f:
+            # the mapping stays valid once the descriptor is closed. an
+            # empty file can't be mapped, an empty buffer fails to decode
+            # the same way an empty file would
+            if not os.fstat(f.fileno()).st_size:
+                self._reader = SegmentReader(memoryview(b''))
+                return self._reader
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, 'madvise'):
+            # decoders read front to back, let the kernel read ahead
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._reader = SegmentReader(memoryview(self._mmap))
+        return self._reader
+
+    def __exit__(self, *exc_info):
+        self._reader.close()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class ShmIngest(object):
+    """Producer side, used by the download threads of the parent process.
+
+    Keeps the names of all segments it handed out so cleanup() can unlink
+    the ones a worker never got to, e.g. because it crashed.
+    """
+
+    def __init__(self):
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def store(self, response, img_filename):
+        length = response.headers.get('Content-Length')
+        if length is None:
+            return self.store_bytes(response.read(), img_filename)
+        # read the socket straight into the segment, no temporary copy
+        length = int(length)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, length))
+        try:
+            filled = 0
+            while filled < length:
+                with shm.buf[filled:length] as view:
+                    n = response.readinto(view)
+                if not n:
+                    raise IOError("connection closed after {} of {} "
+                                  "bytes".format(filled, length))
+                filled += n
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        return self._handed_out(shm, length, img_filename)
+
+    def store_bytes(self, data, img_filename):
+        # same as store(), for a body that is already in memory
+        length = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, length))
+        shm.buf[:length] = data
+        return self._handed_out(shm, length, img_filename)
+
+    def _handed_out(self, shm, length, img_filename):
+        with self._lock:
+            self._names.add(shm.name)
+        # the segment outlives our mapping until the worker unlinks it
+        shm.close()
+        return (shm.name, 0, length, img_filename)
+
+    def cleanup(self):
+        # call once the workers are done with the batch
+        with self._lock:
+            names, self._names = self._names, set()
+        leaked = 0
+        for name in names:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                continue
+            shm.close()
+            shm.unlink()
+            leaked += 1
+        if leaked:
+            logging.warning("unlinked {} unconsumed shared memory "
+                            "segments".format(leaked))
@@ -0,0 +1,318 @@
+# thumbnail_store.py
+# packs thumbnails into a few large segment files instead of one file per
+# thumbnail. layout of store_dir:
+#   index.sqlite        key -> (segment, offset, length), segment sizes
+#   <uuid>.seg          thumbnails appended back to back, no headers
+# every writing process appends to a segment of its own and holds an
+# exclusive flock on it while it does, so appends never interleave and
+# compaction can tell which segments are still being written
+import fcntl
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import uuid
+import weakref
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+# compact a segment once at least this share of it is overwritten data
+DEFAULT_MIN_GARBAGE = 0.5
+SEGMENT_EXT = '.seg'
+
+
+# every SegmentStore of this process, a forked child gets fresh locks for
+# them: the one it inherits may have been held by another thread of the parent
+_stores = weakref.WeakSet()
+
+
+def _after_fork():
+    for store in list(_stores):
+        store._lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def connect_index(db_path):
+    # shared by the threads of a store, which serialise on its lock
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None,
+                           check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                 "key TEXT PRIMARY KEY, segment TEXT, offset INTEGER, "
+                 "length INTEGER)")
+    # size is what was appended to the segment, live what entries still
+    # point at. the difference is garbage left by overwritten keys
+    conn.execute("CREATE TABLE IF NOT EXISTS segments ("
+                 "name TEXT PRIMARY KEY, size INTEGER, live INTEGER)")
+    return conn
+
+
+class SegmentStore(object):
+    """Appends thumbnails into segment files, safe from many processes.
+
+    Can be pickled into resize workers like ThumbnailCache, and shared by
+    resize threads. Read back with a SegmentReader.
+    """
+
+    def __init__(self, store_dir, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.store_dir = store_dir
+        self.segment_bytes = segment_bytes
+        self.db_path = store_dir + os.path.sep + 'index.sqlite'
+        self._conn = None
+        self._segment = None
+        self._segment_name = None
+        self._pid = None
+        self._lock = threading.RLock()
+        _stores.add(self)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # connections and open segments stay with the process that made them
+        state = self.__dict__.copy()
+        state.update(_conn=None, _segment=None, _segment_name=None, _pid=None,
+                     _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        _stores.add(self)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # forked: the parent's connection and segment aren't ours
+            self._conn = None
+            self._segment = None
+            self._segment_name = None
+            self._pid = os.getpid()
+
+    def _db(self):
+        self._check_pid()
+        if self._conn is None:
+            self._conn = connect_index(self.db_path)
+        return self._conn
+
+    def segment_path(self, name):
+        return self.store_dir + os.path.sep + name
+
+    def _open_segment(self, size=0):
+        # the current segment, or a new one if size more bytes would take
+        # it over segment_bytes
+        self._check_pid()
+        if self._segment is not None and self._segment.tell() and \
+                self._segment.tell() + size > self.segment_bytes:
+            self._close_segment()
+        if self._segment is None:
+            name = uuid.uuid4().hex + SEGMENT_EXT
+            f = open(self.segment_path(name), 'ab')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self._db().execute("INSERT INTO segments VALUES (?, 0, 0)",
+                               (name,))
+            self._segment, self._segment_name = f, name
+        return self._segment
+
+    def _close_segment(self):
+        if self._segment is not None:
+            # closing drops the flock, the segment can be compacted now
+            self._segment.close()
+            self._segment = None
+            self._segment_name = None
+
+    def put(self, key, data):
+        self.put_many([(key, data)])
+
+    def put_many(self, items):
+        # items is a list of (key, bytes-like). the data is appended first
+        # and indexed in one transaction after, so readers never see a key
+        # before its bytes are in the segment
+        with self._lock:
+            f = self._open_segment(sum(len(data) for _, data in items))
+            name = self._segment_name
+            entries = []
+            for key, data in items:
+                offset = f.tell()
+                f.write(data)
+                entries.append((key, name, offset, len(data)))
+            f.flush()
+            self._index(entries)
+
+    def _index(self, entries):
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, name, offset, length in entries:
+                old = conn.execute("SELECT segment, length FROM entries "
+                                   "WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    conn.execute("UPDATE segments SET live = live - ? "
+                                 "WHERE name = ?", (old[1], old[0]))
+                conn.execute("INSERT OR REPLACE INTO entries "
+                             "VALUES (?, ?, ?, ?)", (key, name, offset, length))
+                conn.execute("UPDATE segments SET size = size + ?, "
+                             "live = live + ? WHERE name = ?",
+                             (length, length, name))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def contains(self, keys):
+        keys = list(keys)
+        with self._lock:
+            found = self._db().execute(
+                "SELECT COUNT(*) FROM entries WHERE key IN ({})".format(
+                    ','.join('?' * len(keys))), keys).fetchone()[0]
+        return found == len(set(keys))
+
+    def sizes(self, keys):
+        # stored length of every key, 0 for unknown ones
+        sizes = []
+        with self._lock:
+            conn = self._db()
+            for key in keys:
+                row = conn.execute("SELECT length FROM entries WHERE key = ?",
+                                   (key,)).fetchone()
+                sizes.append(row[0] if row is not None else 0)
+        return sizes
+
+    def compact(self, min_garbage=DEFAULT_MIN_GARBAGE):
+        # copies what is still live out of segments that are mostly garbage
+        # into a segment of this process and deletes them. segments some
+        # process still appends to are skipped. returns the bytes freed
+        with self._lock:
+            return self._compact(min_garbage)
+
+    def _compact(self, min_garbage):
+        conn = self._db()
+        freed = 0
+        rows = conn.execute("SELECT name, size, live FROM segments").fetchall()
+        for name, size, live in rows:
+            if name == self._segment_name:
+                continue
+            if size and (size - live) < min_garbage * size:
+                continue
+            try:
+                f = open(self.segment_path(name), 'rb')
+            except FileNotFoundError:
+                # another compactor got there first
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                freed += self._compact_segment(name, f)
+        return freed
+
+    def _compact_segment(self, name, f):
+        conn = self._db()
+        entries = conn.execute("SELECT key, offset, length FROM entries "
+                               "WHERE segment = ?", (name,)).fetchall()
+        moved = []
+        if entries:
+            out = self._open_segment(sum(length for _, _, length in entries))
+            for key, offset, length in entries:
+                f.seek(offset)
+                moved.append((key, offset, out.tell(), length))
+                out.write(f.read(length))
+            out.flush()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT size FROM segments WHERE name = ?",
+                               (name,)).fetchone()
+            for key, offset, new_offset, length in moved:
+                # a writer may have replaced the key in the meantime, then
+                # the copy is garbage and its new entry stays
+                cursor = conn.execute(
+                    "UPDATE entries SET segment = ?, offset = ? "
+                    "WHERE key = ? AND segment = ? AND offset = ?",
+                    (self._segment_name, new_offset, key, name, offset))
+                conn.execute("UPDATE segments SET size = size + ?, "
+                             "live = live + ? WHERE name = ?",
+                             (length, length * cursor.rowcount,
+                              self._segment_name))
+            conn.execute("DELETE FROM segments WHERE name = ?", (name,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            # compacted by another process while we waited for the lock
+            return 0
+        # readers that mapped it already keep their mapping
+        os.remove(self.segment_path(name))
+        logging.debug("compacted segment {}, {} entries moved".format(
+            name, len(entries)))
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SegmentReader(object):
+    """Serves thumbnails out of a SegmentStore through mmap, without copies.
+
+    get() returns a memoryview into the mapped segment. Release the views
+    before close(), a mapping can't be closed while one is exported.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._conn = connect_index(store_dir + os.path.sep + 'index.sqlite')
+        # segment name -> mmap
+        self._maps = {}
+
+    def _map(self, name, end):
+        mapped = self._maps.get(name)
+        if mapped is not None and len(mapped) >= end:
+            return mapped
+        # not mapped yet, or the segment grew since
+        with open(self.store_dir + os.path.sep + name, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        old = self._maps.get(name)
+        self._maps[name] = mapped
+        if old is not None:
+            try:
+                old.close()
+            except BufferError:
+                # views of it are still around, it goes with the last one
+                pass
+        return mapped
+
+    def locate(self, key):
+        # (segment, offset, length) or None
+        return self._conn.execute("SELECT segment, offset, length FROM entries "
+                                  "WHERE key = ?", (key,)).fetchone()
+
+    def get(self, key):
+        # memoryview of the thumbnail, None if the store doesn't have it
+        for _ in range(2):
+            location = self.locate(key)
+            if location is None:
+                return None
+            name, offset, length = location
+            try:
+                mapped = self._map(name, offset + length)
+            except FileNotFoundError:
+                # compacted between the lookup and the open, look again
+                continue
+            return memoryview(mapped)[offset:offset + length]
+        return None
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
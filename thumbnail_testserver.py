@@ -0,0 +1,219 @@
+# thumbnail_testserver.py
+# a local stand-in for the image origin so tests and benchmarks run offline
+import email.utils
+import hashlib
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# bytes written at a time when a bandwidth cap is set
+BANDWIDTH_CHUNK = 16 * 1024
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        if self.server.handshake:
+            time.sleep(self.server.handshake)
+
+    def do_GET(self):
+        self.server.record(self)
+        fault = None
+        if self.server.fault is not None:
+            fault = self.server.fault(self.path)
+        if fault == 'reset':
+            # close with a RST instead of answering
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack('ii', 1, 0))
+            self.close_connection = True
+            self.connection.close()
+            return
+        self.server.enter()
+        try:
+            if fault == 'stall':
+                time.sleep(self.server.stall)
+            if isinstance(fault, int):
+                self.send_error(fault)
+                return
+            self.send_image()
+        finally:
+            self.server.leave()
+
+    def send_image(self):
+        server = self.server
+        body = server.images.get(self.path.split('?')[0])
+        if body is None:
+            self.send_error(404)
+            return
+        if server.latency:
+            time.sleep(server.latency)
+
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        last_modified = email.utils.formatdate(server.last_modified, usegmt=True)
+        if self.not_modified(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+
+        byte_range = self.byte_range(len(body))
+        if byte_range is None:
+            self.send_response(200)
+        else:
+            first, last = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                first, last, len(body)))
+            body = body[first:last + 1]
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        server.sent(len(body))
+        if not server.bandwidth:
+            self.wfile.write(body)
+            return
+        # trickle the body out in chunks to stay under the cap
+        chunk_size = max(1, min(BANDWIDTH_CHUNK, int(server.bandwidth)))
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / float(server.bandwidth))
+
+    def byte_range(self, size):
+        # (first, last) of a single 'bytes=first-last' Range, None to send
+        # the whole body
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match is None or not self.server.ranges:
+            return None
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else size - 1
+        if first >= size:
+            return None
+        return first, min(last, size - 1)
+
+    def not_modified(self, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+            return since.timestamp() >= int(self.server.last_modified)
+        return False
+
+
+class LocalImageServer(ThreadingHTTPServer):
+    """Serves a dict of path -> bytes on localhost from a background thread.
+
+    Answers conditional requests with 304 and records every request, so
+    tests can check which headers and statuses went over the wire. fault is
+    an optional callable(path) injecting failures: it returns 'reset' to
+    drop the connection, 'stall' to sleep `stall` seconds before answering,
+    a status code to answer with, or None to answer normally. Counts the
+    connections it accepts, clients that keep them alive open fewer, and
+    can hold every new connection `handshake` seconds like a far away host.
+    Answers single byte ranges with 206 unless ranges=False.
+    """
+    daemon_threads = True
+    # the default listen backlog of 5 makes concurrent clients wait for
+    # SYN retries, which would swamp any latency measurement
+    request_queue_size = 128
+
+    def __init__(self, images=None, latency=0.0, bandwidth=0, fault=None,
+                 stall=5.0, handshake=0.0, ranges=True):
+        super().__init__(('127.0.0.1', 0), ImageRequestHandler)
+        self.images = dict(images or {})
+        # seconds slept before answering each request
+        self.latency = latency
+        # bytes per second per response, 0 means no cap
+        self.bandwidth = bandwidth
+        self.fault = fault
+        self.stall = stall
+        # seconds before a new connection gets its first answer
+        self.handshake = handshake
+        self.ranges = ranges
+        self.last_modified = time.time()
+        self.requests = []
+        # requests being answered right now and the most seen at once
+        self.active = 0
+        self.peak_active = 0
+        self.connections = 0
+        # body bytes sent
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get_request(self):
+        request = super().get_request()
+        with self._lock:
+            self.connections += 1
+        return request
+
+    def record(self, handler):
+        with self._lock:
+            self.requests.append((handler.path, dict(handler.headers)))
+
+    def sent(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def handle_error(self, request, client_address):
+        # clients that gave up on a stalled or reset request
+        if not isinstance(sys.exc_info()[1], (ConnectionError, OSError)):
+            super().handle_error(request, client_address)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+
+    def urls(self):
+        return [self.url(path) for path in sorted(self.images)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def scripted_faults(plan):
+    # a fault callable for LocalImageServer from path -> list of faults, the
+    # n-th request for a path gets the n-th entry, later ones are answered
+    remaining = {path: list(faults) for path, faults in plan.items()}
+    lock = threading.Lock()
+
+    def fault(path):
+        with lock:
+            faults = remaining.get(path)
+            return faults.pop(0) if faults else None
+    return fault
@@ -1,130 +1,17 @@
-import time
-import os
-import logging
-from urllib.parse import urlparse
-from urllib.request import urlretrieve
-from queue import Queue
-from threading import Thread
-import multiprocessing
-
-import PIL
-from PIL import Image
-
-logging.basicConfig(filename='logfile.log', level=logging.DEBUG)
-
-
-class ThumbnailMakerService(object):
-    def __init__(self, home_dir='.'):
-        self.home_dir = home_dir
-        self.input_dir = self.home_dir + os.path.sep + 'incoming'
-        self.output_dir = self.home_dir + os.path.sep + 'outgoing'
-        # new
-        self.img_queue = multiprocessing.JoinableQueue()
-        # self.dl_queue = Queue()
-
-    def download_image(self, dl_queue):
-        while not dl_queue.empty():
-            try:  # passing non-block flag will trigger exception if que is empty
-                url = dl_queue.get(block=False)
-                img_filename = urlparse(url).path.split('/')[-1]
-                urlretrieve(url, self.input_dir + os.path.sep + img_filename)
-                self.img_queue.put(img_filename)
-
-                dl_queue.task_done()
-            except Queue.Empty:
-                logging.info("Queue empty")
-
-    def download_images(self, img_url_list):
-        if not img_url_list:
-            return
-        os.makedirs(self.input_dir, exist_ok=True)
-
-        logging.info("beginning image downloads")
-
-        start = time.perf_counter()
-        for url in img_url_list:
-            img_filename = urlparse(url).path.split('/')[-1]
-            urlretrieve(url, self.input_dir + os.path.sep + img_filename)
-            self.img_queue.put(img_filename)
-
-        end = time.perf_counter()
-
-        self.img_queue.put(None)
-
-        logging.info("downloaded {} images in {} seconds".format(
-            len(img_url_list), end - start))
-
-    def perform_resizing(self):
-        os.makedirs(self.output_dir, exist_ok=True)
-
-        logging.info("beginning image resizing")
-
-        target_sizes = [32, 64, 200]
-        num_images = len(os.listdir(self.input_dir))
-
-        start = time.perf_counter()
-        while True:
-            filename = self.img_queue.get()
-            if filename:
-                logging.info("resizing image {}".format(filename))
-                orig_img = Image.open(self.input_dir + os.path.sep + filename)
-                for basewidth in target_sizes:
-                    img = orig_img
-                    wpercent = (basewidth / float(img.size[0]))
-                    hsize = int((float(img.size[1]) * float(wpercent)))
-                    img = img.resize((basewidth, hsize), PIL.Image.LANCZOS)
-
-                    new_filename = os.path.splitext(filename)[0] + \
-                        '_' + str(basewidth) + os.path.splitext(filename)[1]
-                    img.save(self.output_dir + os.path.sep + new_filename)
-
-                os.remove(self.input_dir + os.path.sep + filename)
-                logging.info("done resizing image {}".format(filename))
-                self.img_queue.task_done()
-            else:
-                self.img_queue.task_done()
-                break
-
-        end = time.perf_counter()
-
-        logging.info("created {} thumbnails in {} seconds".format(
-            num_images, end - start))
-
-    def make_thumbnails(self, img_url_list):
-        logging.info("START make_thumbnails")
-        # make pickable
-        dl_queue = Queue()
-
-        start = time.perf_counter()
-        for _ in img_url_list:
-            dl_queue.put(_)
-
-        num_dl_threads = 4
-        for _ in range(num_dl_threads):
-            t = Thread(target=self.download_image, args=(dl_queue,))
-            t.start()
-
-        """
-        create multiple processes and spin up
-        not like creating a pool
-        the reason we don't need to write a new resize_image func 
-        is cos img_queue used inside the  perform_resizing
-        is compatible with multiprocessing 
-        as a JoinableQueue
-        """
-        num_processes = multiprocessing.cpu_count()
-        for _ in range(num_processes):
-            p = multiprocessing.Process(target=self.perform_resizing)
-            p.start()
-
-        dl_queue.join()
-        for _ in range(num_processes):
-            self.img_queue.put(None)
-
-        """
-        download --> i/o bound ==> threading
-        resize --> cpu bound ==> multiprocessing
-        """
-
-        end = time.perf_counter()
-        logging.info("END make_thumbnails in {} seconds".format(end - start))
+# thumnbnail_multipro_queue.py
+# download threads feeding long-running resize processes through a queue
+from thumbnail_logging import configure_logging
+from thumbnail_service import BACKEND_PROCESS
+from thumbnail_service import ThumbnailMakerService as _ThumbnailMakerService
+
+configure_logging()
+
+
+class ThumbnailMakerService(_ThumbnailMakerService):
+    def __init__(self, home_dir='.', num_processes=None,
+                 process_bounds=None, **kwargs):
+        # ingest='memory' hands the bodies over in shared memory, persistent
+        # and autoscale keep and resize the pools, see thumbnail_service
+        super().__init__(home_dir, backend=BACKEND_PROCESS,
+                         num_resizers=num_processes,
+                         resize_bounds=process_bounds, **kwargs)